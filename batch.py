@@ -0,0 +1,98 @@
+import struct
+
+# Readings buffered in alarm.sleep_memory, so they survive deep sleep.
+#   count:u8  clock:u32  last_distance:i16
+# then up to size readings of
+#   taken:u32  battery:u16  temperature:i16  distance:i16
+# where taken and clock are seconds since the oldest buffered reading.
+_HEADER = "<BIh"
+_READING = "<IHhh"
+_HEADER_LEN = struct.calcsize(_HEADER)
+_READING_LEN = struct.calcsize(_READING)
+
+
+def buffer_len(size):
+    return _HEADER_LEN + size * _READING_LEN
+
+
+def max_size(space):
+    """How many readings a buffer of space bytes can hold."""
+    return (space - _HEADER_LEN) // _READING_LEN
+
+
+class ReadingBuffer:
+    """Readings waiting to be sent together in one batch report.
+
+    memory is alarm.sleep_memory (or any bytearray, on the host). The buffer
+    works on a copy and only writes it back on save().
+    """
+
+    def __init__(self, memory, offset, size):
+        self.memory = memory
+        self.offset = offset
+        self.size = size
+        self.buf = bytearray(memory[offset : offset + buffer_len(size)])
+        self.count, self.clock, self.last_distance = struct.unpack_from(
+            _HEADER, self.buf, 0
+        )
+        if self.count > size:
+            self.reset()
+
+    def reset(self, last_distance=-1):
+        self.count, self.clock, self.last_distance = 0, 0, last_distance
+
+    def save(self):
+        struct.pack_into(
+            _HEADER, self.buf, 0, self.count, self.clock, self.last_distance
+        )
+        self.memory[self.offset : self.offset + len(self.buf)] = self.buf
+
+    def add(self, battery, temperature, distance):
+        """Adds a reading (as report.scale_reading) taken right now."""
+        if self.count == self.size:
+            # no room: forget the oldest reading
+            self.buf[_HEADER_LEN : _HEADER_LEN + (self.size - 1) * _READING_LEN] = (
+                self.buf[_HEADER_LEN + _READING_LEN : buffer_len(self.size)]
+            )
+            self.count -= 1
+        if not self.count:
+            self.clock = 0
+        struct.pack_into(
+            _READING,
+            self.buf,
+            _HEADER_LEN + self.count * _READING_LEN,
+            self.clock,
+            battery,
+            temperature,
+            distance,
+        )
+        self.count += 1
+
+    def advance(self, seconds):
+        """Moves the clock ahead, e.g. by the time about to be spent sleeping."""
+        if self.count:
+            self.clock += round(seconds)
+
+    def readings(self):
+        """Returns (age, battery, temperature, distance), oldest first."""
+        readings = []
+        for i in range(self.count):
+            taken, battery, temperature, distance = struct.unpack_from(
+                _READING, self.buf, _HEADER_LEN + i * _READING_LEN
+            )
+            readings.append((self.clock - taken, battery, temperature, distance))
+        return readings
+
+    def should_flush(self, max_age, distance_threshold):
+        if not self.count:
+            return False
+        if self.count >= self.size:
+            return True
+        readings = self.readings()
+        if readings[0][0] >= max_age:
+            return True
+        distance = readings[-1][3]
+        return abs(distance - self.last_distance) >= distance_threshold
+
+    def flushed(self):
+        self.reset(self.readings()[-1][3] if self.count else self.last_distance)
@@ -2,4 +2,59 @@
 deep_sleep_interval = 600
 # deep_sleep_interval = 900
 # deep_sleep_interval = 3600
+# With adaptive_sleep, deep_sleep_interval is only where the interval starts.
+# It then follows how fast distance and temperature change, and the battery
+# level, within these bounds (see schedule.py).
+adaptive_sleep = True
+min_sleep_interval = 300
+max_sleep_interval = 3600
+sleep_distance_step = 20  # [mm] change worth a wake
+sleep_temperature_step = 2  # [F] change worth a wake
+sleep_battery_low = 3.4  # [v] always sleep max_sleep_interval below this
+sleep_battery_ok = 3.7  # [v]
 send_packets = 3
+send_gap = 0.2  # [s] between copies, for the gateway to get back to receiving
+# The gateway acknowledges every report it hears (see rpi/link.py), so that
+# the copies left are not sent, and recommends the spreading factor and
+# transmit power for the next ones. After ack_max_misses reports in a row
+# without an ACK the sensor goes back to full power and spreading_factor.
+# Set ack_enabled to False with a gateway that does not send ACKs.
+ack_enabled = True
+ack_window = 0.3  # [s] to listen for the ACK at SF7, doubles with every SF step
+ack_max_misses = 2
+spreading_factor = 7
+# Address this sensor sends from. Give every sensor talking to the same
+# gateway its own address (0-254).
+lora_node = 1
+# Send the compact 8 byte report (see report.py). Set to False to go back to
+# the legacy text report, e.g. for the OpenMQTTGateway parsing script.
+binary_report = True
+
+# Readings are kept in sleep memory across deep sleeps and sent together
+# once batch_size of them are in, the oldest is batch_max_age seconds old,
+# or the distance moved batch_distance_threshold mm since the last report.
+# batch_size = 1 sends every reading right away. It can be at most 12: the
+# readings are kept from sleep_memory_batch up to sleep_memory_schedule (7 +
+# 10 * batch_size bytes), and also have to fit one frame (17 at worst, see
+# report.py). main.py uses the smaller of batch_size and what fits.
+batch_size = 6
+batch_max_age = 3600
+batch_distance_threshold = 50  # [mm]
+
+# Time the sensors get after the relay powers them, before they are talked to.
+# The sonar does not need it: its first readings are dropped anyway.
+sensor_settle_time = 0.1  # [s]
+# DS18B20 resolution: 9 to 12 bits, 0.5 to 0.0625 C. Conversion takes
+# 94 ms at 9 bits and doubles with every bit, but it overlaps the sonar.
+temperature_resolution = 12
+
+# Print where the awake time went, step by step, before every deep sleep
+# (see startup.py).
+startup_profile = False
+
+# Layout of alarm.sleep_memory
+sleep_memory_sequence = 0
+sleep_memory_batch = 1  # uses 7 + 10 * batch_size bytes
+sleep_memory_schedule = 128
+sleep_memory_ds18 = 160  # ROM id of the temperature sensor, 8 bytes
+sleep_memory_link = 168  # radio settings, 4 bytes
@@ -0,0 +1,62 @@
+# Robust running estimate of a distance from noisy sonar samples. Plain
+# python so it runs on CircuitPython and can be exercised on the host.
+
+
+class DistanceEstimator:
+    """Keeps samples sorted to track their median and MAD as they come in.
+
+    done() becomes true as soon as there are min_samples and the spread
+    around the median (MAD) is within tolerance, or when max_samples were
+    taken, so only noisy readings need the full count.
+    """
+
+    def __init__(self, tolerance=5, min_samples=5, max_samples=15):
+        self.tolerance = tolerance
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.samples = []
+
+    def add(self, value):
+        samples = self.samples
+        i = len(samples)
+        samples.append(value)
+        while i and samples[i - 1] > value:
+            samples[i] = samples[i - 1]
+            i -= 1
+        samples[i] = value
+
+    def median(self):
+        samples = self.samples
+        n = len(samples)
+        if n % 2:
+            return samples[n // 2]
+        return (samples[n // 2 - 1] + samples[n // 2]) / 2
+
+    def mad(self):
+        median = self.median()
+        deviations = sorted(abs(v - median) for v in self.samples)
+        n = len(deviations)
+        if n % 2:
+            return deviations[n // 2]
+        return (deviations[n // 2 - 1] + deviations[n // 2]) / 2
+
+    def done(self):
+        n = len(self.samples)
+        if n >= self.max_samples:
+            return True
+        return n >= self.min_samples and self.mad() <= self.tolerance
+
+    def confidence(self):
+        # share of the samples that agree with the median within tolerance
+        if not self.samples:
+            return 0.0
+        median = self.median()
+        agree = sum(1 for v in self.samples if abs(v - median) <= self.tolerance)
+        return agree / len(self.samples)
+
+    def distance(self):
+        # average of the samples that agree with the median, outliers left out
+        median = self.median()
+        limit = max(self.tolerance, 3 * self.mad())
+        inliers = [v for v in self.samples if abs(v - median) <= limit]
+        return round(sum(inliers) / len(inliers))
@@ -0,0 +1,79 @@
+import struct
+
+# Radio settings kept in alarm.sleep_memory, as the gateway recommended them:
+#   valid:u8  spreading_factor:u8  power:u8 (index in TX_POWERS)  misses:u8
+_STATE = "<BBBB"
+STATE_LEN = struct.calcsize(_STATE)
+
+# Transmit power steps [dBm]. The index of the one in use goes in the low
+# nibble of the header flags, so that the gateway knows (see rpi/link.py).
+TX_POWERS = (23, 20, 17, 14, 11, 8, 5)
+
+# ACK sent back by the gateway for a report it heard:
+#   version:u8  seq:u8 (of the copy heard)  spreading_factor:u8  power:i8 (dBm)
+ACK_V1 = 3
+_ACK = "<BBBb"
+ACK_LEN = struct.calcsize(_ACK)
+
+
+def decode_ack(packet, offset, sequence, copies):
+    """Returns (spreading_factor, power index) if packet acknowledges one of
+    the copies sequence .. sequence + copies - 1, or None."""
+    if packet is None or len(packet) - offset != ACK_LEN:
+        return None
+    version, seq, spreading_factor, power = struct.unpack_from(_ACK, packet, offset)
+    if version != ACK_V1 or (seq - sequence) % 256 >= copies:
+        return None
+    if not 6 <= spreading_factor <= 12:
+        return None
+    # the lowest step that is still at least the power asked for
+    index = 0
+    while index + 1 < len(TX_POWERS) and TX_POWERS[index + 1] >= power:
+        index += 1
+    return spreading_factor, index
+
+
+class LinkSettings:
+    """Spreading factor and transmit power to send with, from the last ACK.
+
+    After max_misses reports in a row without an ACK it goes back to full
+    power and default_sf, where the gateway heard it before it was told to
+    turn down.
+    """
+
+    def __init__(self, memory, offset, default_sf=7, max_misses=2):
+        self.memory = memory
+        self.offset = offset
+        self.default_sf = default_sf
+        self.max_misses = max_misses
+        valid, self.spreading_factor, self.power, self.misses = struct.unpack_from(
+            _STATE, bytearray(memory[offset : offset + STATE_LEN]), 0
+        )
+        if (
+            valid != 1
+            or not 6 <= self.spreading_factor <= 12
+            or self.power >= len(TX_POWERS)
+        ):
+            self.reset()
+
+    def reset(self):
+        self.spreading_factor, self.power, self.misses = self.default_sf, 0, 0
+
+    @property
+    def tx_power(self):
+        return TX_POWERS[self.power]
+
+    def save(self):
+        buf = bytearray(STATE_LEN)
+        struct.pack_into(
+            _STATE, buf, 0, 1, self.spreading_factor, self.power, self.misses
+        )
+        self.memory[self.offset : self.offset + STATE_LEN] = buf
+
+    def acknowledged(self, spreading_factor, power):
+        self.spreading_factor, self.power, self.misses = spreading_factor, power, 0
+
+    def missed(self):
+        self.misses += 1
+        if self.misses >= self.max_misses:
+            self.reset()
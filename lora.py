@@ -4,41 +4,80 @@
 # Simple demo of sending and recieving data with the RFM95 LoRa radio.
 # Author: Tony DiCola
 import board
-import busio
-import digitalio
-import adafruit_rfm9x
+
+from const import binary_report, lora_node
+from link import TX_POWERS, decode_ack
+from report import encode_readings, encode_report, encode_report_text
 
 # Define radio parameters.
 RADIO_FREQ_MHZ = 915.0  # Frequency of the radio in Mhz. Must match your
 # module! Can be a value like 915.0, 433.0, etc.
 
-CS = digitalio.DigitalInOut(board.D10)
-RESET = digitalio.DigitalInOut(board.D11)
+# The radio is only set up when first used, so that a wake that does not
+# send (e.g. one that only buffers a reading) skips it.
+rfm9x = None
+
+
+def init_radio():
+    global rfm9x
+    if rfm9x is not None:
+        return rfm9x
+    import busio
+    import digitalio
+    import adafruit_rfm9x
+
+    CS = digitalio.DigitalInOut(board.D10)
+    RESET = digitalio.DigitalInOut(board.D11)
+
+    # Initialize SPI bus.
+    spi = busio.SPI(board.SCK, MOSI=board.MOSI, MISO=board.MISO)
+
+    # Initialze RFM radio
+    rfm9x = adafruit_rfm9x.RFM9x(spi, CS, RESET, RADIO_FREQ_MHZ)
 
-# Initialize SPI bus.
-spi = busio.SPI(board.SCK, MOSI=board.MOSI, MISO=board.MISO)
+    # Note that the radio is configured in LoRa mode so you can't control sync
+    # word, encryption, frequency deviation, or other settings!
 
-# Initialze RFM radio
-rfm9x = adafruit_rfm9x.RFM9x(spi, CS, RESET, RADIO_FREQ_MHZ)
+    # You can however adjust the transmit power (in dB).  The default is 13 dB
+    # but high power radios like the RFM95 can go up to 23 dB:
+    rfm9x.tx_power = 23
 
-# Note that the radio is configured in LoRa mode so you can't control sync
-# word, encryption, frequency deviation, or other settings!
+    # This setting makes source and destination more specific. The gateway
+    # keeps the values of each sensor apart by this address.
+    rfm9x.node = lora_node
+    # rfm9x.destination = 8
+    return rfm9x
 
-# You can however adjust the transmit power (in dB).  The default is 13 dB but
-# high power radios like the RFM95 can go up to 23 dB:
-rfm9x.tx_power = 23
 
-# This setting makes source and destination more specific.
-rfm9x.node = 1
-# rfm9x.destination = 8
+def set_link(spreading_factor, power):
+    # power is the index in TX_POWERS, which the gateway reads from the flags
+    init_radio()
+    rfm9x.spreading_factor = spreading_factor
+    rfm9x.tx_power = TX_POWERS[power]
+    rfm9x.flags = power
+
+
+def receive_ack(sequence, copies, timeout):
+    """Listens up to timeout seconds for the gateway to acknowledge one of the
+    copies of a report. Returns (spreading_factor, power) it recommends."""
+    packet = init_radio().receive(timeout=timeout, with_header=True)
+    return decode_ack(packet, 4, sequence, copies)
 
 
 def send_report(sequence, battery, temperature, distance):
-    msg = bytes(
-        f"id:{sequence}, batt:{battery} v, temp:{temperature} F, dist:{distance} mm",
-        "utf-8",
-    )
+    if binary_report:
+        msg = encode_report(sequence, battery, temperature, distance)
+    else:
+        msg = encode_report_text(sequence, battery, temperature, distance)
+    return _send(msg)
+
+
+def send_readings(sequence, readings):
+    return _send(encode_readings(sequence, readings))
+
+
+def _send(msg):
     msg_len = len(msg)
     print(f"len:{msg_len} msg:{msg}")
-    rfm9x.send(msg)
+    init_radio().send(msg)
     return msg_len < 256
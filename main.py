@@ -1,14 +1,47 @@
+import startup
 import alarm
+import asyncio
 import time
 import board
 import analogio
 import digitalio
 import random
 
-from const import deep_sleep_interval, send_packets
-from lora import send_report
-from sonar import read_sonar
-from temperature import read_temperature
+from batch import ReadingBuffer, max_size
+from const import (
+    ack_enabled,
+    ack_max_misses,
+    ack_window,
+    adaptive_sleep,
+    batch_distance_threshold,
+    batch_max_age,
+    batch_size,
+    binary_report,
+    deep_sleep_interval,
+    max_sleep_interval,
+    min_sleep_interval,
+    send_gap,
+    send_packets,
+    sensor_settle_time,
+    sleep_battery_low,
+    sleep_battery_ok,
+    sleep_distance_step,
+    sleep_memory_batch,
+    sleep_memory_link,
+    sleep_memory_schedule,
+    sleep_memory_sequence,
+    sleep_temperature_step,
+    spreading_factor,
+    startup_profile,
+)
+from link import LinkSettings
+from lora import init_radio, receive_ack, send_readings, send_report, set_link
+from report import max_batch_readings, scale_reading
+from schedule import SleepSchedule
+from sonar import read_sonar_async
+from temperature import read_temperature_async
+
+startup.mark("imports")
 
 
 def done(bump_sequenace, msg):
@@ -16,41 +49,153 @@ def done(bump_sequenace, msg):
 
     blue_led.value, yellow_led.value, relay.value = False, False, False
 
-    time_alarm = alarm.time.TimeAlarm(
-        monotonic_time=time.monotonic() + deep_sleep_interval
-    )
+    time_alarm = alarm.time.TimeAlarm(monotonic_time=time.monotonic() + sleep_interval)
+
+    try:
+        if bump_sequenace:
+            alarm.sleep_memory[sleep_memory_sequence] = (sequence + send_packets) % 256
+        if readings:
+            readings.advance(time.monotonic() - wake_time + sleep_interval)
+            readings.save()
+        if schedule:
+            schedule.save()
+        if link:
+            link.save()
+    except (NotImplementedError, IndexError):
+        # https://github.com/adafruit/circuitpython/issues/5081
+        pass
+    startup.mark("save")
+    if startup_profile:
+        startup.report()
+
+    awake = time.monotonic() - wake_time
+    print(f"Awake {awake:.2f} seconds. Sleeping {sleep_interval} seconds. {msg}")
+    alarm.exit_and_deep_sleep_until_alarms(time_alarm)
 
-    if bump_sequenace:
-        try:
-            alarm.sleep_memory[0] = (sequence + send_packets) % 256
-        except (NotImplementedError, IndexError):
-            # https://github.com/adafruit/circuitpython/issues/5081
-            pass
 
-    print(f"Sleeping {deep_sleep_interval} seconds. {msg}")
-    alarm.exit_and_deep_sleep_until_alarms(time_alarm)
+async def sleep_until(deadline):
+    delay = deadline - time.monotonic()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+async def get_temperature(powered_at):
+    await sleep_until(powered_at + sensor_settle_time)
+    temperature = await read_temperature_async()
+    if temperature is not None:
+        # STATE 2: GOT TEMPERATURE
+        blue_led.value = True
+    return temperature
+
+
+async def get_distance():
+    sonar = await read_sonar_async()
+    if sonar:
+        # STATE 3: GOT DISTANCE
+        yellow_led.value = True
+    return sonar
+
+
+async def read_sensors(powered_at):
+    # The temperature conversion runs in the DS18B20 while the sonar is read
+    return await asyncio.gather(get_temperature(powered_at), get_distance())
+
+
+async def send(sequence, readings, battery_value, temperature, distance):
+    # returns how many copies failed to send. With a link, the copies left
+    # are not sent once the gateway acknowledged one.
+    send_fails = 0
+    next_send = time.monotonic()
+    if link:
+        set_link(link.spreading_factor, link.power)
+    for i in range(send_packets):
+        await sleep_until(next_send)
+        if readings:
+            sent = send_readings(sequence + i, readings.readings())
+        else:
+            sent = send_report(sequence + i, battery_value, temperature, distance)
+        if not sent:
+            send_fails += 1
+        elif link:
+            window = ack_window * 2 ** (link.spreading_factor - 7)
+            ack = receive_ack(sequence, send_packets, window)
+            if ack:
+                link.acknowledged(*ack)
+                print(
+                    f"acknowledged copy {i + 1}, next at"
+                    f" SF{link.spreading_factor} {link.tx_power} dBm"
+                )
+                break
+        next_send = time.monotonic() + send_gap
+    else:
+        if link:
+            link.missed()
+    return send_fails
+
 
+wake_time = startup.started
+
+# no more readings than fit in sleep memory, before the schedule, and in
+# one frame
+batch_size = min(
+    batch_size,
+    max_size(sleep_memory_schedule - sleep_memory_batch),
+    max_batch_readings(),
+)
 
 # Initialize message id with random in case sleep_memory is
-# not available.
+# not available. Without sleep_memory readings can not be buffered
+# either, so each one is sent right away.
 sequence = random.randint(0, 255 - send_packets)
+sleep_interval = deep_sleep_interval
+readings, schedule, link = None, None, None
 try:
+    if binary_report and batch_size > 1:
+        readings = ReadingBuffer(alarm.sleep_memory, sleep_memory_batch, batch_size)
+    if adaptive_sleep:
+        schedule = SleepSchedule(
+            alarm.sleep_memory,
+            sleep_memory_schedule,
+            min_interval=min_sleep_interval,
+            max_interval=max_sleep_interval,
+            distance_step=sleep_distance_step,
+            temperature_step=sleep_temperature_step,
+            battery_low=sleep_battery_low,
+            battery_ok=sleep_battery_ok,
+        )
+    if ack_enabled:
+        link = LinkSettings(
+            alarm.sleep_memory,
+            sleep_memory_link,
+            default_sf=spreading_factor,
+            max_misses=ack_max_misses,
+        )
     if alarm.wake_alarm:
-        sequence = alarm.sleep_memory[0]
+        sequence = alarm.sleep_memory[sleep_memory_sequence]
+        if schedule and schedule.valid:
+            sleep_interval = schedule.interval
     else:
-        time.sleep(3)
+        if readings:
+            readings.reset()
+        if schedule:
+            schedule.reset()
+        if link:
+            link.reset()
 except (NotImplementedError, IndexError):
     # https://github.com/adafruit/circuitpython/issues/5081
     pass
+startup.mark("settings")
+if not alarm.wake_alarm:
+    # cold boot only: a moment to break into the REPL
+    time.sleep(3)
+    startup.mark("cold boot pause")
 
 # The replay controls power to all the gizmos attached.
 # Because of that, we must "power it up" before trying to use them!
 relay = digitalio.DigitalInOut(board.D9)
 relay.direction = digitalio.Direction.OUTPUT
 relay.value = True
-
-# give woken up sensors a few seconds to quiesce
-time.sleep(2)
+powered_at = time.monotonic()
 
 blue_led = digitalio.DigitalInOut(board.D5)
 blue_led.direction = digitalio.Direction.OUTPUT
@@ -66,36 +211,40 @@ blue_led.value, yellow_led.value = False, False
 # https://learn.sparkfun.com/tutorials/voltage-dividers/all
 battery = analogio.AnalogIn(board.A2)
 battery_value = battery.value / 10000
+startup.mark("peripherals")
 
-temperature = read_temperature()
-if not temperature:
+temperature, sonar = asyncio.run(read_sensors(powered_at))
+startup.mark("sensors")
+if temperature is None:
     done(False, "failed to read temperature")
 
-# STATE 2: GOT BATTERY AND TEMPERATURE
-blue_led.value, yellow_led.value = True, False
-time.sleep(1)
-
-distance = read_sonar()
-if not distance:
-    print("failed to read distance:{distance}. Sensor farther than 4 meters?")
+if not sonar:
+    print("failed to read distance. Sensor farther than 4 meters?")
     distance = -1
     # done(False, "failed to read distance")
 else:
-    # STATE 3: GOT BATTERY, TEMPERATURE AND DISTANCE
-    blue_led.value, yellow_led.value = False, True
-    time.sleep(1)
+    distance, samples, confidence = sonar
+    print(f"distance:{distance} samples:{samples} confidence:{confidence:.2f}")
 
-send_fails = 0
-for i in range(send_packets):
-    if not send_report(sequence + i, battery_value, temperature, distance):
-        send_fails += 1
-    time.sleep(1)
+if schedule:
+    sleep_interval = schedule.next_interval(
+        distance, temperature, battery_value, deep_sleep_interval
+    )
 
-if send_fails:
+if readings:
+    readings.add(*scale_reading(battery_value, temperature, distance))
+    if not readings.should_flush(batch_max_age, batch_distance_threshold):
+        done(False, f"buffered {readings.count} of {batch_size} readings")
+
+# only now, a wake that buffers the reading does not need the radio
+init_radio()
+startup.mark("radio")
+failed = asyncio.run(send(sequence, readings, battery_value, temperature, distance))
+startup.mark("send")
+if failed:
     done(False, "failed to send report")
 
-# STATE 4: SENT RADIO REPORT
-blue_led.value, yellow_led.value = True, True
+if readings:
+    readings.flushed()
 
-time.sleep(3)
 done(True, "")
@@ -0,0 +1,61 @@
+# ME007YS frames are 4 bytes: 0xFF, distance high, distance low, checksum
+# (the low byte of the sum of the first three).
+FRAME_HEADER = 0xFF
+FRAME_LEN = 4
+
+
+class FrameDecoder:
+    """Pulls ME007YS distances out of a UART byte stream, many bytes at a time.
+
+    Bytes land in a small fixed buffer; after each scan only an incomplete
+    frame (at most 3 bytes) is moved back to the start, so there are no
+    allocations per byte and no per byte reads.
+    """
+
+    def __init__(self, size=64):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.len = 0
+        self.frames = 0
+        self.bad_bytes = 0
+
+    def read(self, uart):
+        """Reads what is waiting in the UART and returns the decoded distances."""
+        waiting = uart.in_waiting
+        if not waiting:
+            return []
+        end = min(self.len + waiting, len(self.buf))
+        n = uart.readinto(self.view[self.len : end])
+        if n:
+            self.len += n
+        return self.decode()
+
+    def feed(self, data):
+        """Same as read(), for bytes that are already at hand."""
+        distances = []
+        for i in range(0, len(data), len(self.buf) - FRAME_LEN):
+            chunk = data[i : i + len(self.buf) - FRAME_LEN]
+            self.buf[self.len : self.len + len(chunk)] = chunk
+            self.len += len(chunk)
+            distances.extend(self.decode())
+        return distances
+
+    def decode(self):
+        buf, length = self.buf, self.len
+        distances = []
+        i = 0
+        while i + FRAME_LEN <= length:
+            if (
+                buf[i] == FRAME_HEADER
+                and (buf[i] + buf[i + 1] + buf[i + 2]) & 0xFF == buf[i + 3]
+            ):
+                distances.append((buf[i + 1] << 8) + buf[i + 2])
+                self.frames += 1
+                i += FRAME_LEN
+            else:
+                self.bad_bytes += 1
+                i += 1
+        # keep a partial frame for the next read
+        buf[0 : length - i] = buf[i:length]
+        self.len = length - i
+        return distances
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Airtime and energy per delivered reading: acknowledged sends with adaptive
+power and spreading factor, against sending every report send_packets times.
+
+Runs main.py on the simulated hardware of misc/hwsim.py, with a gateway
+that hears the sensor at --snr dB (at full power, each a separate run)
+with --fading dB of deviation per frame, and listens on --gateway-sf.
+"blind" is ack_enabled = False, every copy at full power; "ack" is the
+gateway acknowledging with the recommendation of rpi/link.py.
+
+Run from the top of the repo:  python3 -m misc.bench_ack [--cycles N]
+"""
+
+import argparse
+import json
+
+from misc.hwsim import SLEEP_MA, Hardware
+
+SCHEMES = {
+    "blind": dict(ack_enabled=False),
+    "ack": dict(ack_enabled=True),
+}
+
+
+def run(scheme, snr, args):
+    hw = Hardware(
+        link_snr=snr,
+        fading=args.fading,
+        gateway_sfs=tuple(args.gateway_sf),
+        gateway_ack=scheme == "ack",
+        const=dict(SCHEMES[scheme], batch_size=args.batch_size),
+        seed=args.seed,
+    )
+    with hw.installed():
+        hw.run_cycle()
+        cycles = [hw.run_cycle() for _ in range(args.cycles)]
+
+    delivered = sum(c.delivered for c in cycles)
+    per_reading = max(delivered, 1)
+    charge = sum(c.charge for c in cycles) + SLEEP_MA * sum(c.sleep for c in cycles)
+    return {
+        "scheme": scheme,
+        "snr_db": snr,
+        "readings": len(cycles),
+        "delivered": delivered,
+        "frames": sum(c.frames for c in cycles),
+        "airtime_per_reading_ms": round(
+            sum(c.airtime for c in cycles) / per_reading * 1000, 1
+        ),
+        "gateway_airtime_per_reading_ms": round(hw.ack_airtime / per_reading * 1000, 1),
+        "radio_charge_per_reading_mC": round(
+            sum(c.radio_charge for c in cycles) / per_reading, 3
+        ),
+        "charge_per_reading_mC": round(charge / per_reading, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cycles", type=int, default=100)
+    parser.add_argument(
+        "--snr", type=float, nargs="+", default=[20, 10, 0, -5], help="[dB]"
+    )
+    parser.add_argument("--fading", type=float, default=2.0, help="[dB]")
+    parser.add_argument("--gateway-sf", type=int, nargs="+", default=[7, 9])
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    results = [run(scheme, snr, args) for snr in args.snr for scheme in SCHEMES]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for result in results:
+        for key, value in result.items():
+            print(f"{key:>32}: {value}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Host side benchmark of the ME007YS frame decoding.
+
+Feeds a recorded-like byte stream (frames mixed with noise bytes and cut
+off frames) through a fake UART, once byte by byte like the old
+sonar._read_me007ys did and once with me007ys.FrameDecoder.
+
+Run from the top of the repo:  python3 -m misc.bench_me007ys [frames]
+"""
+
+import random
+import sys
+import time
+
+from me007ys import FrameDecoder
+
+
+def make_stream(frames, noise=0.05, partial=0.05, seed=1):
+    rnd = random.Random(seed)
+    stream, expected = bytearray(), []
+    for _ in range(frames):
+        distance = rnd.randrange(280, 4500)
+        frame = bytes([0xFF, distance >> 8, distance & 0xFF])
+        frame += bytes([sum(frame) & 0xFF])
+        if rnd.random() < partial:
+            stream += frame[: rnd.randrange(1, 4)]
+        else:
+            stream += frame
+            expected.append(distance)
+        while rnd.random() < noise:
+            stream.append(rnd.randrange(0, 0xFF))
+    return bytes(stream), expected
+
+
+class FakeUart:
+    """Hands out the stream in chunks, the way the UART FIFO fills up."""
+
+    def __init__(self, stream, chunk=16):
+        self.stream = stream
+        self.pos = 0
+        self.chunk = chunk
+        self.reads = 0
+
+    @property
+    def in_waiting(self):
+        return min(self.chunk, len(self.stream) - self.pos)
+
+    def read(self, n):
+        self.reads += 1
+        data = self.stream[self.pos : self.pos + n]
+        self.pos += len(data)
+        return data or None
+
+    def readinto(self, buf):
+        self.reads += 1
+        n = min(len(buf), self.in_waiting)
+        buf[:n] = self.stream[self.pos : self.pos + n]
+        self.pos += n
+        return n
+
+
+def decode_bytewise(uart):
+    # what sonar._read_me007ys used to do, one uart.read(1) per byte
+    distances = []
+    buf = bytearray(3)
+    idx = 0
+    while True:
+        r = uart.read(1)
+        if r is None:
+            return distances
+        c = r[0]
+        if idx == 0 and c == 0xFF:
+            buf[0] = c
+            idx = idx + 1
+        elif 0 < idx < 3:
+            buf[idx] = c
+            idx = idx + 1
+        else:
+            if sum(buf) & 0xFF == c:
+                distances.append((buf[1] << 8) + buf[2])
+            idx = 0
+
+
+def decode_buffered(uart):
+    decoder = FrameDecoder()
+    distances = []
+    while uart.in_waiting:
+        distances.extend(decoder.read(uart))
+    return distances
+
+
+def run(name, decode, stream, expected):
+    uart = FakeUart(stream)
+    ts = time.perf_counter()
+    distances = decode(uart)
+    elapsed = time.perf_counter() - ts
+    found = sum(1 for d in set(distances) if d in set(expected))
+    print(
+        f"{name:<9} {len(distances):6d} frames ({found} of {len(set(expected))}"
+        f" distinct expected) {uart.reads:7d} reads"
+        f" {elapsed / len(stream) * 1e9:7.1f} ns/byte"
+    )
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    stream, expected = make_stream(frames)
+    print(f"{len(stream)} bytes, {len(expected)} complete frames")
+    run("bytewise", decode_bytewise, stream, expected)
+    run("buffered", decode_buffered, stream, expected)
+
+
+if __name__ == "__main__":
+    main()
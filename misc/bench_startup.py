@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Where the awake time of the sensor goes, by step of main.py and by kind of wake.
+
+Runs main.py on the simulated hardware of misc/hwsim.py: a cold boot, then
+--cycles timer wakes, and collects the steps startup.py marked in each.
+Wakes are "cold" (the first), "buffering" (the reading is kept in sleep
+memory, nothing sent) and "sending". The radio is only set up by wakes
+that send; radio_inits counts how many times it was.
+
+Only the time spent waiting on the hardware is simulated, not CPU time, so
+imports take no time here: run with startup_profile = True in const.py to
+see them on the board.
+
+Run from the top of the repo:  python3 -m misc.bench_startup [--cycles N]
+"""
+
+import argparse
+import json
+import sys
+
+from misc.hwsim import Hardware
+
+
+def kind(cycle, first):
+    if first:
+        return "cold"
+    return "sending" if cycle.frames else "buffering"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cycles", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=6)
+    parser.add_argument("--snr", type=float, default=10, help="[dB] at the gateway")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    hw = Hardware(
+        link_snr=args.snr,
+        const=dict(batch_size=args.batch_size),
+        seed=args.seed,
+    )
+    kinds = {}
+    with hw.installed():
+        for i in range(args.cycles + 1):
+            radio_inits = hw.radio_inits
+            cycle = hw.run_cycle()
+            stats = kinds.setdefault(
+                kind(cycle, i == 0),
+                {"wakes": 0, "awake_s": 0.0, "radio_inits": 0, "steps_ms": {}},
+            )
+            stats["wakes"] += 1
+            stats["awake_s"] += cycle.awake
+            stats["radio_inits"] += hw.radio_inits - radio_inits
+            for step, seconds in sys.modules["startup"].steps:
+                steps = stats["steps_ms"]
+                steps[step] = steps.get(step, 0.0) + seconds * 1000
+
+    # means per wake
+    for stats in kinds.values():
+        wakes = stats["wakes"]
+        stats["awake_s"] = round(stats["awake_s"] / wakes, 3)
+        stats["steps_ms"] = {
+            step: round(ms / wakes, 1) for step, ms in stats["steps_ms"].items()
+        }
+    if args.json:
+        print(json.dumps(kinds, indent=2))
+        return
+    for name, stats in kinds.items():
+        print(
+            f"{name}: {stats['wakes']} wakes, {stats['awake_s']} s awake,"
+            f" {stats['radio_inits']} radio inits"
+        )
+        for step, ms in stats["steps_ms"].items():
+            print(f"{step:>20}: {ms} ms")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Awake time, radio airtime and charge of the sensor firmware wake cycles.
+
+Runs main.py on the simulated hardware of misc/hwsim.py: a cold boot,
+then --cycles timer wakes. The distance moves --drift mm an hour, which
+is what decides the adaptive sleep interval and when batches are sent.
+--json prints the summary as JSON, e.g. to track it in CI.
+
+Run from the top of the repo:  python3 -m misc.bench_wake [--cycles N]
+"""
+
+import argparse
+import json
+import random
+
+from misc.hwsim import SLEEP_MA, Hardware
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def summary(hw, boot, cycles):
+    awake = [c.awake for c in cycles]
+    sending = [c for c in cycles if c.frames]
+    elapsed = sum(c.awake + c.sleep for c in cycles)
+    charge = sum(c.charge for c in cycles) + SLEEP_MA * sum(c.sleep for c in cycles)
+    return {
+        "cycles": len(cycles),
+        "cold_boot_awake_s": round(boot.awake, 3),
+        "awake_mean_s": round(sum(awake) / len(awake), 3),
+        "awake_p50_s": round(percentile(awake, 0.5), 3),
+        "awake_max_s": round(max(awake), 3),
+        "sending_cycles": len(sending),
+        "frames": sum(c.frames for c in cycles),
+        "airtime_per_cycle_ms": round(
+            sum(c.airtime for c in cycles) / len(cycles) * 1000, 1
+        ),
+        "awake_charge_per_cycle_mC": round(
+            sum(c.charge for c in cycles) / len(cycles), 2
+        ),
+        "sleep_mean_s": round(sum(c.sleep for c in cycles) / len(cycles), 1),
+        "average_current_mA": round(charge / elapsed, 4),
+        "ds18_scans": hw.scans,
+        "uart_overruns": hw.uart_overruns,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cycles", type=int, default=50)
+    parser.add_argument("--distance", type=float, default=1500, help="[mm]")
+    parser.add_argument("--drift", type=float, default=30, help="[mm/h]")
+    parser.add_argument("--noise", type=float, default=3, help="[mm]")
+    parser.add_argument("--outliers", type=float, default=0.02)
+    parser.add_argument("--corrupt", type=float, default=0.02)
+    parser.add_argument("--battery", type=float, default=3.9, help="[v]")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--verbose", action="store_true", help="print main.py output")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    hw = Hardware(
+        distance=lambda t: args.distance + args.drift * t / 3600,
+        distance_noise=args.noise,
+        outliers=args.outliers,
+        corrupt=args.corrupt,
+        battery=args.battery,
+        seed=args.seed,
+    )
+    with hw.installed():
+        boot = hw.run_cycle()
+        cycles = [hw.run_cycle() for _ in range(args.cycles)]
+
+    if args.verbose:
+        for cycle in [boot] + cycles:
+            print(cycle.output, end="")
+    result = summary(hw, boot, cycles)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    for key, value in result.items():
+        print(f"{key:>28}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Samples used and error of estimator.DistanceEstimator on synthetic sonar data,
+next to the old fixed 7 + 15 samples, sort and average approach.
+
+Run from the top of the repo:  python3 -m misc.sim_estimator [runs]
+"""
+
+import random
+import sys
+
+from estimator import DistanceEstimator
+
+TRUE_DISTANCE = 1500
+WARM_UP_SAMPLES = 7
+SONAR_SAMPLES = 15
+
+
+def distributions(rnd):
+    def clean():
+        return round(rnd.gauss(TRUE_DISTANCE, 1))
+
+    def noisy():
+        return round(rnd.gauss(TRUE_DISTANCE, 8))
+
+    def outliers():
+        if rnd.random() < 0.1:
+            return rnd.randrange(280, 4500)
+        return round(rnd.gauss(TRUE_DISTANCE, 2))
+
+    return {"clean": clean, "noisy": noisy, "outliers": outliers}
+
+
+def old_estimate(stream):
+    values = [next(stream) for _ in range(WARM_UP_SAMPLES + SONAR_SAMPLES)]
+    values.sort()
+    kept = values[WARM_UP_SAMPLES : len(values) - 1]
+    return sum(kept) // len(kept), SONAR_SAMPLES, None
+
+
+def new_estimate(stream):
+    for _ in range(WARM_UP_SAMPLES):
+        next(stream)
+    estimator = DistanceEstimator()
+    while not estimator.done():
+        estimator.add(next(stream))
+    return estimator.distance(), len(estimator.samples), estimator.confidence()
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rnd = random.Random(1)
+    dists = distributions(rnd)
+    print(
+        f"{'':<9} {'old samples':>11} {'old err':>8} {'new samples':>11}"
+        f" {'new err':>8} {'confidence':>10}"
+    )
+    for name, sample in dists.items():
+        totals = [0, 0, 0, 0, 0]
+        for _ in range(runs):
+
+            def stream():
+                while True:
+                    yield sample()
+
+            distance, samples, _ = old_estimate(stream())
+            totals[0] += samples
+            totals[1] += abs(distance - TRUE_DISTANCE)
+            distance, samples, confidence = new_estimate(stream())
+            totals[2] += samples
+            totals[3] += abs(distance - TRUE_DISTANCE)
+            totals[4] += confidence
+        avg = [t / runs for t in totals]
+        print(
+            f"{name:<9} {avg[0]:11.1f} {avg[1]:8.2f} {avg[2]:11.1f}"
+            f" {avg[3]:8.2f} {avg[4]:10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Replays a sensor trace through schedule.SleepSchedule and compares it with a
+fixed deep sleep interval: number of wakes, charge used and how far the last
+reported distance lags behind the real one.
+
+The trace is a csv of seconds,distance_mm,temperature_f,battery_v rows. When
+none is given a week with two fill-ups and a daily temperature swing is made
+up.
+
+Run from the top of the repo:  python3 -m misc.sim_schedule [trace.csv]
+"""
+
+import csv
+import math
+import sys
+
+import const
+from schedule import SleepSchedule
+
+# rough charge model of one wake and of deep sleep
+AWAKE_SECONDS = 10
+AWAKE_MA = 80
+SLEEP_MA = 0.5
+
+
+def synthetic_trace(days=7, step=60):
+    trace = []
+    for t in range(0, days * 86400, step):
+        hour = t / 3600
+        distance = 1500.0
+        for start in (40, 110):
+            # level rises (distance shrinks) for 3 hours, then drains over a day
+            if start <= hour < start + 3:
+                distance -= 800 * (hour - start) / 3
+            elif start + 3 <= hour < start + 27:
+                distance -= 800 * (1 - (hour - start - 3) / 24)
+        temperature = 60 + 10 * math.sin(2 * math.pi * (hour - 9) / 24)
+        battery = 3.9 - 0.2 * max(0, math.sin(2 * math.pi * (hour - 21) / 24))
+        trace.append((t, round(distance), round(temperature, 1), battery))
+    return trace
+
+
+def load_trace(filename):
+    with open(filename) as f:
+        return [
+            (float(t), int(d), float(temp), float(batt))
+            for t, d, temp, batt in csv.reader(f)
+        ]
+
+
+def sample(trace, t):
+    # the trace row at or just before t
+    lo, hi = 0, len(trace) - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if trace[mid][0] <= t:
+            lo = mid
+        else:
+            hi = mid - 1
+    return trace[lo]
+
+
+def simulate(trace, next_interval):
+    end = trace[-1][0]
+    t, wake_times = trace[0][0], []
+    while t <= end:
+        wake_times.append(t)
+        _, distance, temperature, battery = sample(trace, t)
+        t += AWAKE_SECONDS + next_interval(distance, temperature, battery)
+    wakes = len(wake_times)
+    # compare what was last reported against the truth, every trace row
+    i, errors = 0, []
+    for row_t, distance, _, _ in trace:
+        while i + 1 < len(wake_times) and wake_times[i + 1] <= row_t:
+            i += 1
+        reported = sample(trace, wake_times[i])[1]
+        errors.append(abs(distance - reported))
+    hours = (end - trace[0][0]) / 3600
+    charge = wakes * AWAKE_SECONDS * AWAKE_MA / 3600 + hours * SLEEP_MA
+    return wakes, charge, sum(errors) / len(errors), max(errors)
+
+
+def main():
+    trace = load_trace(sys.argv[1]) if len(sys.argv) > 1 else synthetic_trace()
+
+    def fixed(distance, temperature, battery):
+        return const.deep_sleep_interval
+
+    memory = bytearray(64)
+    schedule = SleepSchedule(
+        memory,
+        0,
+        min_interval=const.min_sleep_interval,
+        max_interval=const.max_sleep_interval,
+        distance_step=const.sleep_distance_step,
+        temperature_step=const.sleep_temperature_step,
+        battery_low=const.sleep_battery_low,
+        battery_ok=const.sleep_battery_ok,
+    )
+
+    def adaptive(distance, temperature, battery):
+        return schedule.next_interval(
+            distance, temperature, battery, const.deep_sleep_interval
+        )
+
+    print(f"{'':<9} {'wakes':>6} {'mAh':>8} {'mean err mm':>12} {'max err mm':>11}")
+    for name, policy in (("fixed", fixed), ("adaptive", adaptive)):
+        wakes, charge, mean_err, max_err = simulate(trace, policy)
+        print(f"{name:<9} {wakes:6d} {charge:8.1f} {mean_err:12.1f} {max_err:11d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import struct
+
+# Binary report, version 1 (little endian, 8 bytes):
+#   version:u8  sequence:u8  battery:u16 (100 uV)  temperature:i16 (0.1 F)
+#   distance:i16 (mm, -1 when the sonar had no reading)
+# The version byte can never be confused with the legacy text report, which
+# always starts with "id:".
+REPORT_VERSION = 1
+REPORT_FORMAT = "<BBHhh"
+
+# Batch report, version 2: several readings taken across deep sleep cycles.
+#   version:u8  sequence:u8  count:u8
+# followed by count readings, oldest first. Every reading is 4 varints:
+#   age (seconds before the report was sent), battery, temperature, distance
+# The first reading holds the values; the others hold the difference from
+# the reading before (zigzag encoded, age as how much younger it is), which
+# mostly fits a byte each.
+BATCH_VERSION = 2
+# At worst a reading takes 14 bytes: a 5 byte age and 3 bytes for each value.
+BATCH_READING_MAX_LEN = 14
+# The most an RFM9x frame can carry, after its 4 byte header.
+MAX_PAYLOAD = 252
+
+
+def max_batch_readings(payload=MAX_PAYLOAD):
+    """How many readings always fit in a batch report of payload bytes."""
+    return (payload - 3) // BATCH_READING_MAX_LEN
+
+
+def scale_reading(battery, temperature, distance):
+    # same units as the binary reports
+    return round(battery * 10000), round(temperature * 10), distance
+
+
+def encode_report(sequence, battery, temperature, distance):
+    return struct.pack(
+        REPORT_FORMAT,
+        REPORT_VERSION,
+        sequence & 0xFF,
+        *scale_reading(battery, temperature, distance),
+    )
+
+
+def encode_readings(sequence, readings):
+    # a single reading taken just now goes out as a plain version 1 report
+    if len(readings) == 1 and not readings[0][0]:
+        return struct.pack(
+            REPORT_FORMAT, REPORT_VERSION, sequence & 0xFF, *readings[0][1:]
+        )
+    return encode_batch(sequence, readings)
+
+
+def _varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def encode_batch(sequence, readings):
+    """readings are (age, battery, temperature, distance), as scale_reading."""
+    out = bytearray([BATCH_VERSION, sequence & 0xFF, len(readings)])
+    prev = None
+    for age, battery, temperature, distance in readings:
+        if prev is None:
+            _varint(out, age)
+            _varint(out, battery)
+            _varint(out, _zigzag(temperature))
+            _varint(out, _zigzag(distance))
+        else:
+            _varint(out, prev[0] - age)
+            _varint(out, _zigzag(battery - prev[1]))
+            _varint(out, _zigzag(temperature - prev[2]))
+            _varint(out, _zigzag(distance - prev[3]))
+        prev = age, battery, temperature, distance
+    return bytes(out)
+
+
+def encode_report_text(sequence, battery, temperature, distance):
+    return bytes(
+        f"id:{sequence}, batt:{battery} v, temp:{temperature} F, dist:{distance} mm",
+        "utf-8",
+    )
@@ -9,45 +9,100 @@ Example for using the RFM9x Radio with Raspberry Pi.
 Learn Guide: https://learn.adafruit.com/lora-and-lorawan-for-raspberry-pi
 Author: Brent Rubell for Adafruit Industries
 """
+
 # Import Python System Libraries
 import time
 
-# Import Blinka Libraries
-import busio
-from digitalio import DigitalInOut, Direction, Pull
-import board
-
-# Import the SSD1306 module.
-import adafruit_ssd1306
-
-# Import RFM9x
-import adafruit_rfm9x
-
 from datetime import datetime
 import asyncio
 import socket
 
-# Create the I2C interface.
-i2c = busio.I2C(board.SCL, board.SDA)
+from rpi import rpi_const as const
+from rpi import startup
+from rpi.capture import Capture
+from rpi.dedup import DedupCache
+from rpi.display import Renderer
+from rpi.events import EventBus, NodeChangedEvent
+from rpi.link import LinkAdvisor
+from rpi.metrics import registry
+from rpi.nodes import GATEWAY_NODE, NodeTable
+from rpi.packet import HEADER_LEN, Reading, decode_report
+from rpi.payload import format_value
+from rpi.radio import ChannelDedup, RadioGroup
+from rpi.store import Record, Store
+
+# The display and the radios are opened by the tasks that use them, in a
+# thread, so that importing this module does not wait on I2C and SPI, and
+# the rest of the gateway (metrics, spool, MQTT) is up in the meantime.
+# Blinka and the device drivers are imported there too: they are slow to
+# import.
+display = None
+radios = None
+
+
+def open_display():
+    global display
+    with startup.step("display"):
+        # Import Blinka Libraries
+        import board
+        import busio
+        from digitalio import DigitalInOut
+
+        # Import the SSD1306 module.
+        import adafruit_ssd1306
+
+        # Create the I2C interface.
+        i2c = busio.I2C(board.SCL, board.SDA)
+
+        # 128x32 OLED Display
+        reset_pin = DigitalInOut(board.D4)
+        display = adafruit_ssd1306.SSD1306_I2C(128, 32, i2c, reset=reset_pin)
+        # Clear the display.
+        display.fill(0)
+        display.show()
+    return display
+
 
-# 128x32 OLED Display
-reset_pin = DigitalInOut(board.D4)
-display = adafruit_ssd1306.SSD1306_I2C(128, 32, i2c, reset=reset_pin)
-# Clear the display.
-display.fill(0)
-display.show()
-width = display.width
-height = display.height
+def open_radio(spi, config):
+    import board
+    from digitalio import DigitalInOut
 
-# Configure LoRa Radio
-CS = DigitalInOut(board.CE1)
-RESET = DigitalInOut(board.D25)
-spi = busio.SPI(board.SCK, MOSI=board.MOSI, MISO=board.MISO)
-rfm9x = adafruit_rfm9x.RFM9x(spi, CS, RESET, 915.0)
+    # Import RFM9x
+    import adafruit_rfm9x
 
-rfm9x.tx_power = 23
-# rfm9x.node = 8
-# rfm9x.destination = 1
+    cs = DigitalInOut(getattr(board, config["cs"]))
+    reset = DigitalInOut(getattr(board, config["reset"]))
+    rfm9x = adafruit_rfm9x.RFM9x(spi, cs, reset, config["frequency"])
+    rfm9x.spreading_factor = config.get("spreading_factor", 7)
+    rfm9x.tx_power = 23
+    # rfm9x.node = 8
+    # rfm9x.destination = 1
+    return rfm9x
+
+
+def open_radios():
+    global radios
+    with startup.step("radios"):
+        import board
+        import busio
+
+        # Configure LoRa Radios
+        spi = busio.SPI(board.SCK, MOSI=board.MOSI, MISO=board.MISO)
+        radios = [
+            (config["channel"], open_radio(spi, config)) for config in const.RADIOS
+        ]
+    return radios
+
+
+def ack_frame(frame):
+    # runs in the radio thread of the channel the frame came in on
+    config = radio_configs[frame.channel]
+    spreading_factors = [
+        c.get("spreading_factor", 7)
+        for c in const.RADIOS
+        if c["frequency"] == config["frequency"]
+    ]
+    return link_advisor.ack(frame, config.get("spreading_factor", 7), spreading_factors)
 
 
 def get_ip():
@@ -64,108 +119,354 @@ def get_ip():
     return IP
 
 
-curr_values, prev_values = {}, {}
+node_table = NodeTable()
+node_changes = EventBus()
+dedup = DedupCache(window=const.DEDUP_WINDOW, hold=const.DEDUP_HOLD)
+channel_dedup = ChannelDedup(window=const.RADIO_DEDUP_WINDOW)
+link_advisor = LinkAdvisor(margin=const.ADR_MARGIN, history=const.ADR_HISTORY)
+radio_configs = {config["channel"]: config for config in const.RADIOS}
+reader = None
+store = None
+capture = None
 stop_gracefully = False
 
+frames_received = registry.counter(
+    "loraben_frames_received_total", "Radio frames received, by node", ("node",)
+)
+parse_failures = registry.counter(
+    "loraben_parse_failures_total",
+    "Frames that could not be decoded, by node",
+    ("node",),
+)
+channel_frames = registry.counter(
+    "loraben_channel_frames_total", "Radio frames received, by channel", ("channel",)
+)
+rssi = registry.histogram(
+    "loraben_rssi_dbm",
+    "RSSI of the received frames, by node",
+    (-120, -110, -100, -90, -80, -70, -60, -50, -40),
+    ("node",),
+)
+registry.counter("loraben_duplicates_total", "Redundant copies", fn=lambda: dedup.hits)
+registry.counter(
+    "loraben_measurements_total", "Measurements received", fn=lambda: dedup.misses
+)
+registry.counter(
+    "loraben_cross_channel_duplicates_total",
+    "Frames already received on another channel",
+    fn=lambda: channel_dedup.hits,
+)
+registry.counter(
+    "loraben_radio_overflows_total",
+    "Frames dropped because the radio queue was full",
+    fn=lambda: reader.overflows if reader else 0,
+)
+registry.counter(
+    "loraben_radio_errors_total",
+    "Radio receives that failed",
+    fn=lambda: reader.errors if reader else 0,
+)
+registry.counter(
+    "loraben_acks_sent_total",
+    "ACKs sent back to the sensors",
+    fn=lambda: reader.acks if reader else 0,
+)
+registry.counter(
+    "loraben_ack_failures_total",
+    "ACKs that could not be sent",
+    fn=lambda: reader.ack_failures if reader else 0,
+)
+registry.gauge(
+    "loraben_radio_queue_depth",
+    "Frames waiting for the event loop",
+    fn=lambda: reader.frames_q.qsize() if reader else 0,
+)
+registry.counter(
+    "loraben_captured_frames_total",
+    "Frames written to the capture files",
+    fn=lambda: capture.frames if capture else 0,
+)
+registry.counter(
+    "loraben_change_events_dropped_total",
+    "Node change events dropped by subscribers that fell behind",
+    fn=lambda: node_changes.dropped,
+)
+
 
 def stop_basic_receive():
     global stop_gracefully
     stop_gracefully = True
 
 
-def get_latest():
-    global curr_values
-    return curr_values
+def get_latest(node=GATEWAY_NODE):
+    return node_table.get(node)
+
+
+def get_nodes():
+    return node_table.nodes
+
+
+def get_store():
+    return store
+
+
+def subscribe_changes():
+    return node_changes.subscribe()
+
+
+def unsubscribe_changes(changes_q):
+    node_changes.unsubscribe(changes_q)
+
+
+def update_node(node, values):
+    delta = node_table.update(node, values)
+    if delta:
+        node_changes.publish(
+            NodeChangedEvent(node=node, values=dict(node_table.get(node)), delta=delta)
+        )
+
+
+def update_stats():
+    update_node(
+        GATEWAY_NODE,
+        {
+            "dedup_hits": dedup.hits,
+            "dedup_misses": dedup.misses,
+            "radio_overflows": reader.overflows if reader else 0,
+        },
+    )
 
 
 async def refresh_ip():
-    global curr_values
     cnt = 0
     while not stop_gracefully:
         if not cnt:
-            curr_values["ip"] = get_ip()
+            update_node(GATEWAY_NODE, {"ip": get_ip()})
         cnt = (cnt + 1) % 120
         await asyncio.sleep(0.5)
 
 
 async def refresh_display():
-    global curr_values, prev_values
-
-    fg_color, bg_color = 0, 1
-    while not stop_gracefully:
-        await asyncio.sleep(0.5)
-
-        if prev_values == curr_values:
-            # noop
-            continue
+    # subscribed first, for the changes made while the display is opened
+    changes_q = subscribe_changes()
+    shown_node = "?"
+
+    def apply(change):
+        nonlocal shown_node
+        if change.node != GATEWAY_NODE:
+            shown_node = change.node
+        elif "ip" not in change.delta:
+            return False
+
+        ip = get_latest().get("ip", "?")
+        curr_values = get_latest(shown_node)
+
+        def text(key):
+            return format_value(key, curr_values.get(key))
+
+        renderer.set_text("ip", 2, 0, f"ip:{ip}")
+        renderer.set_text("id", 0, 10, f"{shown_node}:{text('id')} {text('rssi')}")
+        renderer.set_text("batt", 80, 15, text("batt"))
+        renderer.set_text("temp", 2, 20, text("temp"))
+        renderer.set_text("dist", 47, 25, text("dist"))
+        return True
 
-        display.fill(fg_color)
-
-        display.text(f"ip:{curr_values['ip']}", 2, 0, bg_color)
-        display.text(
-            f"id:{curr_values.get('id','?')} {curr_values.get('rssi','? db')}",
-            0,
-            10,
-            bg_color,
+    try:
+        if display is None:
+            await asyncio.get_running_loop().run_in_executor(None, open_display)
+        renderer = Renderer(
+            display, display.width, display.height, max_fps=const.DISPLAY_MAX_FPS
         )
-        display.text(f"{curr_values.get('batt','? v')}", 80, 15, bg_color)
-        display.text(f"{curr_values.get('temp','? F')}", 2, 20, bg_color)
-        display.text(f"{curr_values.get('dist','? mm')}", 47, 25, bg_color)
-
-        display.show()
-        prev_values = curr_values.copy()
-        fg_color, bg_color = bg_color, fg_color
+        while not stop_gracefully:
+            if not apply(await changes_q.get()):
+                continue
+            await renderer.wait_frame()
+            # fold in whatever else changed while waiting for the frame
+            while not changes_q.empty():
+                apply(changes_q.get_nowait())
+            renderer.invert(not renderer.inverted)
+            renderer.show()
+    finally:
+        unsubscribe_changes(changes_q)
+
+
+def report_values(seq, reading, rssi, ts):
+    # numbers, in the units of rpi.payload.UNITS; ts is seconds since the epoch
+    return {
+        "id": seq,
+        "batt": reading.battery,
+        "temp": reading.temperature,
+        "dist": reading.distance,
+        "rssi": rssi,
+        "ts": round(ts, 3),
+    }
+
+
+def measurement_records(entry):
+    # a batch report holds several readings, each taken age seconds ago
+    report, frame = entry.item
+    return [
+        Record(
+            frame.ts - reading.age,
+            entry.node,
+            report.seq,
+            reading.battery,
+            reading.temperature,
+            reading.distance,
+            frame.rssi,
+        )
+        for reading in report.readings
+    ]
+
+
+def release_measurement(entry):
+    report, frame = entry.item
+    latest = report.readings[-1]
+    values = report_values(report.seq, latest, frame.rssi, frame.ts - latest.age)
+    values["len"] = len(frame.packet)
+    values["copies"] = entry.copies
+    if len(report.readings) > 1:
+        values["readings"] = len(report.readings)
+    update_node(entry.node, values)
+    if store:
+        for record in measurement_records(entry):
+            store.append(record)
+
+
+def count_copy(entry):
+    # only while it is still the latest measurement of the node
+    if node_table.get(entry.node).get("id") == entry.seq:
+        update_node(entry.node, {"copies": entry.copies})
+
+
+def open_store():
+    global store
+    if store or not const.STORE_DIR:
+        return
+    store = Store(
+        const.STORE_DIR,
+        segment_records=const.STORE_SEGMENT_RECORDS,
+        max_segments=const.STORE_MAX_SEGMENTS,
+    )
+    # start from the last known state, so ping has something to answer with
+    for node, record in store.latest().items():
+        if not node_table.get(node):
+            reading = Reading(0, record.battery, record.temperature, record.distance)
+            update_node(
+                node, report_values(record.seq, reading, record.rssi, record.ts)
+            )
+
+
+async def flush_store():
+    if store:
+        await store.flusher(const.STORE_FLUSH_INTERVAL)
+
+
+def open_capture():
+    global capture
+    if capture or not const.CAPTURE_DIR:
+        return
+    capture = Capture(
+        const.CAPTURE_DIR,
+        segment_bytes=const.CAPTURE_SEGMENT_BYTES,
+        max_segments=const.CAPTURE_MAX_SEGMENTS,
+    )
 
 
-def parse_packet_text(packet_text):
-    global curr_values
-    # example packet_text:  'id:227, batt:3.6472 v, temp:59.9 F, dist:183 mm'
-    for value in packet_text.split(","):
-        kv = value.strip().split(":")
-        if len(kv) == 2:
-            curr_values[kv[0]] = kv[1]
+async def flush_capture():
+    if capture:
+        try:
+            await capture.flusher(const.CAPTURE_FLUSH_INTERVAL)
+        finally:
+            capture.close()
 
 
 async def receive_packets(quiet):
-    global curr_values, stop_gracefully
+    global reader
+
+    if radios is None:
+        await asyncio.get_running_loop().run_in_executor(None, open_radios)
+    frames_q = asyncio.Queue(maxsize=const.RADIO_QUEUE_SIZE)
+    reader = RadioGroup(
+        radios,
+        asyncio.get_running_loop(),
+        frames_q,
+        const.RADIO_RECEIVE_TIMEOUT,
+        ack=ack_frame if const.ACK_ENABLED else None,
+        ack_window=const.RADIO_DEDUP_WINDOW,
+    )
+    reader.start()
+    startup.since_start("receiving")
+    try:
+        while not stop_gracefully:
+            try:
+                frame = await asyncio.wait_for(frames_q.get(), timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            receive_frame(frame, quiet, time.monotonic())
+    finally:
+        # joins the reader threads, which can take up to a receive timeout
+        await asyncio.get_running_loop().run_in_executor(None, reader.stop)
 
-    rfm9x.receive_timeut = 2
-    while not stop_gracefully:
-        await asyncio.sleep(0)
-        try:
-            packet = rfm9x.receive(with_header=True)
-        except (KeyboardInterrupt, SystemExit):
-            stop_gracefully = True
-            return
 
-        if packet is None:
-            continue
+def receive_frame(frame, quiet, now):
+    # now is the clock of dedup: time.monotonic(), or the time of the frame
+    # when replaying a capture (see rpi/replay.py)
+    if capture:
+        capture.add(frame)
+    channel_frames.labels(frame.channel).inc()
+    if channel_dedup.seen(frame):
+        return
+    handle_frame(frame, quiet, now)
 
-        # print("Received (raw header):", [hex(x) for x in packet[0:4]])
-        # print("Received (raw payload): {0}".format(packet[4:]))
 
-        try:
-            packet_text = str(packet[4:], "ascii")
-            parse_packet_text(packet_text)
-            curr_values.pop("parse_exception", None)
-        except Exception as e:
-            packet_text = f"parse_exception: {e}"
+def handle_frame(frame, quiet, now):
+    packet = frame.packet
+    # print("Received (raw header):", [hex(x) for x in packet[0:4]])
+    # print("Received (raw payload): {0}".format(packet[4:]))
 
-        ts = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-        if not quiet:
-            print(f"{ts} Received RSSI: {rfm9x.last_rssi} -- PAYLOAD: {packet_text}")
+    node = packet[1]
+    frames_received.labels(node).inc()
+    rssi.labels(node).observe(frame.rssi)
+    try:
+        report = decode_report(packet, HEADER_LEN)
+        node_table.discard(node, "parse_exception")
+        error = None
+    except Exception as e:
+        report = None
+        parse_failures.labels(node).inc()
+        error = e
+
+    if not quiet:
+        ts = datetime.fromtimestamp(frame.ts).strftime("%d/%m/%Y %H:%M:%S")
+        packet_text = f"parse_exception: {error}" if report is None else f"{report}"
+        print(
+            f"{ts} Received node: {node} channel: {frame.channel} RSSI: {frame.rssi}"
+            f" -- PAYLOAD: {packet_text}"
+        )
 
-        # add additional info to curr_values
-        curr_values["rssi"] = f"{rfm9x.last_rssi} dB"
-        curr_values["ts"] = ts
-        curr_values["len"] = f"{len(packet_text) + 4} bytes"
+    if report is None:
+        values = {"rssi": frame.rssi, "ts": frame.ts, "len": len(packet)}
+        update_node(node, values)
+        return
+    entry = dedup.offer(node, report.seq, report.readings, (report, frame), now)
+    if entry:
+        release_measurement(entry)
+        return
+    count_copy(dedup.last_copy)
+    if not quiet:
+        print(f"{ts} Duplicate of a previous packet from node: {node}")
 
 
 async def basic_receive_main(quiet=False):
+    open_store()
+    open_capture()
     await asyncio.gather(
         refresh_ip(),
         refresh_display(),
         receive_packets(quiet),
+        flush_store(),
+        flush_capture(),
     )
 
 
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+import os
+import struct
+import threading
+
+from rpi.radio import Frame
+from rpi.writer import QueuedWriter
+
+# A capture file is a header, then every frame as it came off the radios:
+# ts (seconds since the epoch), rssi (dBm), snr (0.25 dB steps, _NO_SNR for
+# radios without it), channel and length, then the frame itself, RFM9x
+# header included. Read by rpi/replay.py.
+_HEADER = struct.Struct("<4sH")
+_MAGIC = b"LBCF"
+_VERSION = 1
+_ENTRY = struct.Struct("<dhbBH")
+_NO_SNR = -128
+
+
+def _pack(frame):
+    if frame.snr is None:
+        snr = _NO_SNR
+    else:
+        snr = max(-127, min(127, round(frame.snr * 4)))
+    packet = bytes(frame.packet)
+    entry = _ENTRY.pack(frame.ts, round(frame.rssi), snr, frame.channel, len(packet))
+    return entry + packet
+
+
+def iter_frames(data, filename="capture"):
+    """The frames in the contents of a capture file, oldest first.
+
+    A frame cut short at the end, by a crash while it was written, is left out.
+    """
+    if len(data) < _HEADER.size:
+        return
+    magic, version = _HEADER.unpack_from(data, 0)
+    if (magic, version) != (_MAGIC, _VERSION):
+        raise ValueError(f"{filename} is not a version {_VERSION} capture")
+    offset, end = _HEADER.size, len(data)
+    while offset + _ENTRY.size <= end:
+        ts, rssi, snr, channel, length = _ENTRY.unpack_from(data, offset)
+        offset += _ENTRY.size
+        if offset + length > end:
+            break
+        packet = bytearray(data[offset : offset + length])
+        yield Frame(packet, rssi, ts, channel, None if snr == _NO_SNR else snr / 4)
+        offset += length
+
+
+def capture_files(paths):
+    """The capture files in paths, which are files or capture directories."""
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            files += sorted(
+                os.path.join(p, f)
+                for f in os.listdir(p)
+                if f.startswith("capture-") and f.endswith(".lbc")
+            )
+        else:
+            files.append(p)
+    return files
+
+
+def read_frames(paths):
+    for filename in capture_files(paths):
+        with open(filename, "rb") as f:
+            data = f.read()
+        yield from iter_frames(data, filename)
+
+
+class Capture(QueuedWriter):
+    """Keeps every frame received, raw, in capture files of segment_bytes.
+
+    Each start of the gateway begins a new file, and only the newest
+    max_segments files are kept. add() only queues a frame for flusher(),
+    see QueuedWriter.
+    """
+
+    def __init__(self, directory, segment_bytes=1 << 22, max_segments=16, batch=64):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        super().__init__(batch)
+        self.frames = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.files = capture_files([directory])
+        self._file = None
+        self._rotate()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def _rotate(self):
+        number = 0
+        if self.files:
+            number = int(os.path.basename(self.files[-1])[8:-4]) + 1
+        if self._file:
+            self._file.close()
+        filename = os.path.join(self.directory, f"capture-{number:010d}.lbc")
+        self._file = open(filename, "wb")
+        self._file.write(_HEADER.pack(_MAGIC, _VERSION))
+        self.files.append(filename)
+        while len(self.files) > self.max_segments:
+            os.remove(self.files.pop(0))
+
+    def add(self, frame):
+        self.frames += 1
+        self._queue(_pack(frame))
+
+    def _write(self, entries):
+        if not entries:
+            return
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(b"".join(entries))
+            self._file.flush()
+            if self._file.tell() >= self.segment_bytes:
+                self._rotate()
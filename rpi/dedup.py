@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+from collections import OrderedDict, deque
+
+
+class Measurement:
+    __slots__ = ("node", "seq", "key", "item", "first_seen", "copies")
+
+    def __init__(self, node, seq, key, item, now):
+        self.node = node
+        self.seq = seq
+        self.key = key
+        self.item = item
+        self.first_seen = now
+        self.copies = 1
+
+
+class DedupCache:
+    """Recognizes the redundant copies of one measurement sent by a sensor.
+
+    A sensor sends each report `window` times with consecutive (8 bit)
+    sequence numbers and the same payload. A frame is a copy of an earlier
+    one from the same node when the payload matches, its sequence is less
+    than `window` ahead (modulo 256) and it arrived within `hold` seconds.
+
+    offer() returns a new measurement on its first copy, to be released
+    right away, and keeps it for `hold` seconds only to recognize the copies
+    that follow. With ACKs the sensor stops sending copies once one is
+    acknowledged, so there is usually no copy to wait for. last_copy is the
+    measurement the latest copy was counted on.
+    """
+
+    def __init__(self, window=3, hold=4.0, node_depth=4, max_nodes=1024):
+        self.window = window
+        self.hold = hold
+        self.node_depth = node_depth
+        self.max_nodes = max_nodes
+        self.nodes = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.last_copy = None
+
+    def _find(self, node, seq, key, now):
+        for entry in self.nodes.get(node, ()):
+            if (
+                entry.key == key
+                and now - entry.first_seen < self.hold
+                and (seq - entry.seq) % 256 < self.window
+            ):
+                return entry
+        return None
+
+    def offer(self, node, seq, key, item, now):
+        """Returns the new measurement the frame starts, None for a copy."""
+        entry = self._find(node, seq, key, now)
+        if entry:
+            entry.copies += 1
+            self.hits += 1
+            self.last_copy = entry
+            return None
+
+        self.misses += 1
+        entry = Measurement(node, seq, key, item, now)
+        entries = self.nodes.get(node)
+        if entries is None:
+            entries = self.nodes[node] = deque(maxlen=self.node_depth)
+            if len(self.nodes) > self.max_nodes:
+                self.nodes.popitem(last=False)
+        else:
+            self.nodes.move_to_end(node)
+        entries.append(entry)
+        return entry
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+import asyncio
+import time
+from os import path
+
+# SSD1306 commands
+SET_COL_ADDR = 0x21
+SET_PAGE_ADDR = 0x22
+
+FONT_FILE = path.join(path.dirname(path.abspath(__file__)), "font5x8.bin")
+
+
+def load_font(font_file=FONT_FILE):
+    """Returns the glyph width, height and the columns of every character.
+
+    Same file format framebuf uses: width and height bytes, followed by
+    width column bytes per character (LSB is the top row).
+    """
+    with open(font_file, "rb") as f:
+        data = f.read()
+    width, height = data[0], data[1]
+    glyphs = [data[2 + c * width : 2 + (c + 1) * width] for c in range(256)]
+    return width, height, glyphs
+
+
+class Renderer:
+    """Draws text fields on an SSD1306 and only sends the parts that changed.
+
+    The frame is kept in the SSD1306 layout: one byte per column for each
+    8 pixel high page. show() compares it against what was last sent and
+    writes just the changed columns of each changed page, at most max_fps
+    times a second.
+    """
+
+    def __init__(self, display, width=128, height=32, max_fps=4, font_file=FONT_FILE):
+        self.display = display
+        self.width = width
+        self.pages = height // 8
+        self.frame = bytearray(width * self.pages)
+        self.shown = bytearray(width * self.pages)
+        self.fields = {}
+        self.frame_interval = 1 / max_fps
+        self.last_show = 0
+        self.inverted = False
+        self.bytes_sent = 0
+        self.glyph_w, self.glyph_h, self.glyphs = load_font(font_file)
+        self._shifted = {}
+        # what is on the panel is unknown until the first show
+        self._full = True
+
+    def _box(self, x, y, text):
+        return x, y, x + len(text) * (self.glyph_w + 1), y + self.glyph_h
+
+    def set_text(self, name, x, y, text):
+        old = self.fields.get(name)
+        if old == (x, y, text):
+            return
+        self.fields[name] = (x, y, text)
+        boxes = [self._box(x, y, text)]
+        if old:
+            boxes.append(self._box(*old))
+        for box in boxes:
+            self._clear(*box)
+        # redraw every field overlapping the area that was just cleared
+        for fx, fy, ftext in self.fields.values():
+            fbox = self._box(fx, fy, ftext)
+            if any(_overlaps(fbox, box) for box in boxes):
+                self._draw_text(fx, fy, ftext)
+
+    def _clear(self, x0, y0, x1, y1):
+        x0, x1 = max(x0, 0), min(x1, self.width)
+        for page in range(max(y0, 0) >> 3, min((y1 + 7) >> 3, self.pages)):
+            top = page * 8
+            mask = 0
+            for row in range(max(y0 - top, 0), min(y1 - top, 8)):
+                mask |= 1 << row
+            keep = ~mask & 0xFF
+            base = page * self.width
+            for x in range(base + x0, base + x1):
+                self.frame[x] &= keep
+
+    def _glyph(self, char, shift):
+        # cached columns of a glyph, split for the two pages it may straddle
+        key = char, shift
+        cols = self._shifted.get(key)
+        if cols is None:
+            glyph = self.glyphs[ord(char) & 0xFF]
+            lo = bytes((c << shift) & 0xFF for c in glyph)
+            hi = bytes(c >> (8 - shift) for c in glyph) if shift else None
+            cols = self._shifted[key] = lo, hi
+        return cols
+
+    def _draw_text(self, x, y, text):
+        page, shift = y >> 3, y & 7
+        frame, width = self.frame, self.width
+        for char in text:
+            lo, hi = self._glyph(char, shift)
+            end = min(x + self.glyph_w, width)
+            if x >= 0 and end > x:
+                cols = end - x
+                base = page * width + x
+                if page < self.pages:
+                    for i in range(cols):
+                        frame[base + i] |= lo[i]
+                if hi and page + 1 < self.pages:
+                    base += width
+                    for i in range(cols):
+                        frame[base + i] |= hi[i]
+            x += self.glyph_w + 1
+
+    def invert(self, inverted):
+        # done by the panel itself, so it costs a single command
+        if inverted != self.inverted:
+            self.inverted = inverted
+            self.display.invert(inverted)
+
+    async def wait_frame(self):
+        delay = self.last_show + self.frame_interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def show(self, full=False):
+        full, self._full = full or self._full, False
+        self.last_show = time.monotonic()
+        width = self.width
+        for page in range(self.pages):
+            start = page * width
+            if full:
+                x0, x1 = 0, width - 1
+            else:
+                x0 = _first_diff(self.frame, self.shown, start, width)
+                if x0 is None:
+                    continue
+                x1 = _last_diff(self.frame, self.shown, start, width)
+            self._write(page, x0, x1)
+            self.shown[start + x0 : start + x1 + 1] = self.frame[
+                start + x0 : start + x1 + 1
+            ]
+
+    def _write(self, page, x0, x1):
+        display = self.display
+        cmds = SET_COL_ADDR, x0, x1, SET_PAGE_ADDR, page, page
+        for cmd in cmds:
+            display.write_cmd(cmd)
+        start = page * self.width
+        buf = bytearray(x1 - x0 + 2)
+        buf[0] = 0x40  # Co=0, D/C#=1: data follows
+        buf[1:] = self.frame[start + x0 : start + x1 + 1]
+        with display.i2c_device:
+            display.i2c_device.write(buf)
+        # each command goes out as a control byte followed by the command
+        self.bytes_sent += 2 * len(cmds) + len(buf)
+
+
+def _overlaps(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def _first_diff(a, b, start, length):
+    if a[start : start + length] == b[start : start + length]:
+        return None
+    for i in range(length):
+        if a[start + i] != b[start + i]:
+            return i
+
+
+def _last_diff(a, b, start, length):
+    for i in range(length - 1, -1, -1):
+        if a[start + i] != b[start + i]:
+            return i
@@ -1,34 +1,64 @@
 #!/usr/bin/env python
-from collections import namedtuple
+import asyncio
 
 
 class BaseEvent:
-    def __init__(self, expected_attrs, attrs):
-        self.event = self.__class__.__name__
-        self.attrs = self._dict_to_attrs(attrs)
-        self._check_expected_attrs(expected_attrs)
-
-    def __getattr__(self, attr):
-        try:
-            return getattr(self.attrs, attr)
-        except AttributeError as e:
-            raise AttributeError(
-                f"{self.event} object is missing {attr} attribute"
-            ) from e
-
-    def _check_expected_attrs(self, expected_attrs):
-        if expected_attrs:
-            for attr in expected_attrs:
-                getattr(self, attr)
-
-    @staticmethod
-    def _dict_to_attrs(params_dict):
-        cls = namedtuple("Attrs", params_dict)
-        cls.__new__.__defaults__ = tuple(params_dict.values())
-        return cls()
+    """An event is a few fields, all required, named in __slots__.
+
+    event is the name of the class, which is what handlers dispatch on.
+    """
+
+    __slots__ = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.event = cls.__name__
+
+    def __repr__(self):
+        fields = ", ".join(f"{attr}={getattr(self, attr)!r}" for attr in self.__slots__)
+        return f"{self.event}({fields})"
 
 
 class MqttMsgEvent(BaseEvent):
-    def __init__(self, **attrs):
-        expected_attrs = "topic", "payload"
-        super().__init__(expected_attrs, attrs)
+    __slots__ = ("topic", "payload", "retain")
+
+    def __init__(self, topic, payload, retain=False):
+        self.topic = topic
+        self.payload = payload
+        self.retain = retain
+
+
+class NodeChangedEvent(BaseEvent):
+    __slots__ = ("node", "values", "delta")
+
+    def __init__(self, node, values, delta):
+        self.node = node
+        self.values = values
+        self.delta = delta
+
+
+class EventBus:
+    """Hands every published event to all subscribers, each with its own queue.
+
+    A subscriber that falls behind loses events once its queue is full,
+    which is counted in dropped; publishers are never blocked.
+    """
+
+    def __init__(self):
+        self.subscribers = []
+        self.dropped = 0
+
+    def subscribe(self, maxsize=256):
+        events_q = asyncio.Queue(maxsize=maxsize)
+        self.subscribers.append(events_q)
+        return events_q
+
+    def unsubscribe(self, events_q):
+        self.subscribers.remove(events_q)
+
+    def publish(self, event):
+        for events_q in self.subscribers:
+            try:
+                events_q.put_nowait(event)
+            except asyncio.QueueFull:
+                self.dropped += 1
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+import json
+import re
+
+# Columns of every row of a history reply. battery, temperature and distance
+# each have their min, max and mean over the readings in the bucket.
+COLUMNS = (
+    "ts",
+    "count",
+    "battery_min",
+    "battery_max",
+    "battery_mean",
+    "temperature_min",
+    "temperature_max",
+    "temperature_mean",
+    "distance_min",
+    "distance_max",
+    "distance_mean",
+)
+
+_REQUEST_ID = re.compile(r"[A-Za-z0-9_.-]{1,64}")
+
+
+def parse_request(payload, now, max_buckets):
+    """Returns the request in a history query, or raises ValueError.
+
+    payload is a JSON object with the request id, the node and the bucket
+    size in seconds. start and end (epoch seconds) default to the last day.
+    """
+    try:
+        request = json.loads(payload)
+    except ValueError as e:
+        raise ValueError(f"not JSON: {e}") from None
+    if not isinstance(request, dict):
+        raise ValueError("not a JSON object")
+    request_id = request.get("id")
+    if not isinstance(request_id, str) or not _REQUEST_ID.fullmatch(request_id):
+        raise ValueError("id must be 1 to 64 letters, digits, '_', '.' or '-'")
+    try:
+        node = int(request["node"])
+        end = float(request.get("end", now))
+        start = float(request.get("start", end - 86400))
+        bucket = float(request.get("bucket", 300))
+    except KeyError as e:
+        raise ValueError(f"missing {e}") from None
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"bad value: {e}") from None
+    if bucket < 1 or end <= start:
+        raise ValueError("bucket must be at least 1 second and start before end")
+    if (end - start) / bucket > max_buckets:
+        raise ValueError(f"more than {max_buckets} buckets, use a larger bucket")
+    return {
+        "id": request_id,
+        "node": node,
+        "start": start,
+        "end": end,
+        "bucket": bucket,
+    }
+
+
+def rows(buckets):
+    # Store.downsample() buckets as reply rows, in the units of the reports
+    return [
+        [
+            ts,
+            count,
+            battery[0] / 10000,
+            battery[1] / 10000,
+            round(battery[2] / 10000, 4),
+            temperature[0] / 10,
+            temperature[1] / 10,
+            round(temperature[2] / 10, 2),
+            *(
+                (distance[0], distance[1], round(distance[2], 1))
+                if distance
+                else (None, None, None)
+            ),
+        ]
+        for ts, count, battery, temperature, distance in buckets
+    ]
+
+
+def replies(topic, request, rows, page_rows):
+    """Yields (topic, payload) of each page of the reply, at least one."""
+    pages = max((len(rows) + page_rows - 1) // page_rows, 1)
+    for page in range(pages):
+        reply = dict(
+            request,
+            page=page,
+            pages=pages,
+            columns=COLUMNS,
+            rows=rows[page * page_rows : (page + 1) * page_rows],
+        )
+        yield f"{topic}/{request['id']}/{page}", json.dumps(
+            reply, separators=(",", ":")
+        )
+
+
+def error_reply(topic, payload, error):
+    # the id is echoed back when there is one, so the client can match it
+    try:
+        request_id = str(json.loads(payload).get("id"))
+    except (ValueError, AttributeError):
+        request_id = None
+    if not request_id or not _REQUEST_ID.fullmatch(request_id):
+        request_id = "error"
+    reply = {"id": request_id, "error": error}
+    return f"{topic}/{request_id}/error", json.dumps(reply, separators=(",", ":"))
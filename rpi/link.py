@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+import struct
+import threading
+from collections import deque
+
+from rpi.packet import HEADER_LEN, decode_report
+
+# ACK sent back to a sensor for a report it heard: version, seq of the copy
+# heard, spreading factor and power [dBm] to use from the next report on.
+# See link.py on the sensor side.
+ACK_V1 = 3
+_ACK_V1 = struct.Struct("<BBBb")
+
+# Transmit power steps [dBm] of the sensors. A sensor sends the index of the
+# one it uses in the low nibble of the header flags (0, full power, on
+# sensors that predate the ACK).
+TX_POWERS = (23, 20, 17, 14, 11, 8, 5)
+
+# SNR [dB] the SX127x needs to demodulate, by spreading factor, and the
+# sensitivity [dBm] at 125 kHz, for radios that do not report the SNR
+REQUIRED_SNR = {6: -5, 7: -7.5, 8: -10, 9: -12.5, 10: -15, 11: -17.5, 12: -20}
+SENSITIVITY = {6: -118, 7: -123, 8: -126, 9: -129, 10: -132, 11: -134.5, 12: -137}
+
+
+def encode_ack(seq, spreading_factor, tx_power):
+    return _ACK_V1.pack(ACK_V1, seq & 0xFF, spreading_factor, tx_power)
+
+
+class LinkAdvisor:
+    """Recommends the spreading factor and transmit power of every sensor.
+
+    For the last `history` frames of each node it keeps the SNR the frame
+    would have had at full power (TX_POWERS[0]). The recommendation is the
+    lowest spreading factor the gateway listens on that leaves `margin` dB
+    above what it needs at the best of those, and then the lowest power
+    that still does. Frames come from the radio threads, hence the lock.
+    """
+
+    def __init__(self, margin=10, history=8):
+        self.margin = margin
+        self.history = history
+        self.nodes = {}
+        self.acks = 0
+        self._lock = threading.Lock()
+
+    def observe(self, node, flags, spreading_factor, rssi, snr):
+        power = TX_POWERS[min(flags & 0x0F, len(TX_POWERS) - 1)]
+        if snr is None:
+            # the RSSI above sensitivity, as an SNR above what is needed
+            snr = rssi - SENSITIVITY[spreading_factor] + REQUIRED_SNR[spreading_factor]
+        with self._lock:
+            snrs = self.nodes.get(node)
+            if snrs is None:
+                snrs = self.nodes[node] = deque(maxlen=self.history)
+            snrs.append(snr + TX_POWERS[0] - power)
+
+    def recommend(self, node, spreading_factors):
+        """(spreading factor, power) for node, out of spreading_factors."""
+        with self._lock:
+            best = max(self.nodes.get(node, ()), default=None)
+        spreading_factors = sorted(spreading_factors)
+        if best is not None:
+            for spreading_factor in spreading_factors:
+                headroom = best - REQUIRED_SNR[spreading_factor] - self.margin
+                if headroom >= 0:
+                    steps = min(int(headroom // 3), len(TX_POWERS) - 1)
+                    return spreading_factor, TX_POWERS[steps]
+        return spreading_factors[-1], TX_POWERS[0]
+
+    def ack(self, frame, spreading_factor, spreading_factors):
+        """The ACK for frame, if it holds a report, else None.
+
+        frame came in at spreading_factor; spreading_factors are all the
+        ones the gateway listens on at that frequency.
+        """
+        packet = frame.packet
+        node = packet[1]
+        if len(packet) <= HEADER_LEN or node == 0xFF:
+            return None
+        try:
+            report = decode_report(packet, HEADER_LEN)
+        except Exception:
+            return None
+        self.observe(node, packet[3], spreading_factor, frame.rssi, frame.snr)
+        self.acks += 1
+        return encode_ack(report.seq, *self.recommend(node, spreading_factors))
@@ -1,8 +1,18 @@
 #!/usr/bin/env python
+import atexit
+import json
 import logging
-from logging.handlers import SysLogHandler
+import queue
+from logging.handlers import QueueHandler, QueueListener, SysLogHandler
 from os import path
 
+from rpi.metrics import registry
+
+# The handlers that do I/O (syslog, console) run in a listener thread. The
+# event loop only puts records in a bounded queue, see initLogger().
+_handler = None
+_listener = None
+
 
 def getLogger():
     return logging.getLogger("loraben")
@@ -16,13 +26,111 @@ def _log_handler_address(files=tuple()):
     raise Exception("Invalid files: %s" % ", ".join(files))
 
 
-def initLogger(testing=False):
+class _DroppingQueueHandler(QueueHandler):
+    """Hands records to the listener thread, never waiting for room.
+
+    Records are formatted by the listener, not here, so pass the values as
+    arguments (logger.debug("x: %s", x)) rather than in an f-string, and
+    only values that do not change after the call. When the queue is full
+    the record is dropped and counted.
+    """
+
+    def __init__(self, records_q):
+        super().__init__(records_q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(QueueListener):
+    """A QueueListener that can stop while the queue is full: it waits for
+    room for the sentinel, the listener thread makes it."""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through up to rate records a second from each call site.
+
+    Every call site (file and line) has a token bucket of burst records.
+    The first record let through after some were suppressed says how many.
+    """
+
+    def __init__(self, rate=5, burst=20):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        # (tokens, last record, suppressed) by call site
+        self.sites = {}
+        self.suppressed = 0
+
+    def filter(self, record):
+        key = (record.pathname, record.lineno)
+        site = self.sites.get(key)
+        if site is None:
+            site = self.sites[key] = [self.burst, record.created, 0]
+        tokens = min(self.burst, site[0] + (record.created - site[1]) * self.rate)
+        site[1] = record.created
+        if tokens < 1:
+            site[0] = tokens
+            site[2] += 1
+            self.suppressed += 1
+            return False
+        site[0] = tokens - 1
+        if site[2]:
+            record.msg = f"{record.msg} [{site[2]} suppressed]"
+            site[2] = 0
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, for log shippers."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "module": record.module,
+            "line": record.lineno,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def start_queue(logger, handlers, queue_size=1024, rate_limit=5, rate_burst=20):
+    """Logs through a queue to handlers, which run in a listener thread.
+
+    Returns the queue handler added to logger and the started listener.
+    """
+    handler = _DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    if rate_limit:
+        handler.addFilter(RateLimitFilter(rate_limit, rate_burst))
+    logger.addHandler(handler)
+    listener = _Listener(handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return handler, listener
+
+
+def initLogger(
+    testing=False, json_format=False, queue_size=1024, rate_limit=5, rate_burst=20
+):
+    global _handler, _listener
     logger = getLogger()
     logger.setLevel(logging.INFO)
     format = (
         "%(asctime)s [loraben] %(module)12s:%(lineno)-d %(levelname)-8s %(message)s"
     )
-    formatter = logging.Formatter(format)
+    formatter = JsonFormatter() if json_format else logging.Formatter(format)
 
     # Logs are normally configured here: /etc/rsyslog.d/*
     logHandlerAddress = _log_handler_address(
@@ -30,18 +138,36 @@ def initLogger(testing=False):
     )
     syslog = SysLogHandler(address=logHandlerAddress, facility=SysLogHandler.LOG_DAEMON)
     syslog.setFormatter(formatter)
-    logger.addHandler(syslog)
+
+    _handler, _listener = start_queue(
+        logger, [syslog], queue_size, rate_limit, rate_burst
+    )
+    atexit.register(_listener.stop)
+
+    registry.counter(
+        "loraben_log_dropped_total",
+        "Log records dropped because the log queue was full",
+        fn=lambda: _handler.dropped,
+    )
+    registry.counter(
+        "loraben_log_suppressed_total",
+        "Log records suppressed by the rate limit of their call site",
+        fn=lambda: sum(f.suppressed for f in _handler.filters),
+    )
     if testing:
-        log_to_console()
+        log_to_console(json_format)
         set_log_level_debug()
 
 
-def log_to_console():
+def log_to_console(json_format=False):
     consoleHandler = logging.StreamHandler()
     format = "%(asctime)s %(module)12s:%(lineno)-d %(levelname)-8s %(message)s"
-    formatter = logging.Formatter(format)
+    formatter = JsonFormatter() if json_format else logging.Formatter(format)
     consoleHandler.setFormatter(formatter)
-    getLogger().addHandler(consoleHandler)
+    if _listener:
+        _listener.handlers += (consoleHandler,)
+    else:
+        getLogger().addHandler(consoleHandler)
 
 
 def set_log_level_debug():
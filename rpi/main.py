@@ -1,49 +1,97 @@
 #!/usr/bin/env python
+# first, so that it times the imports that follow
+from rpi import startup
+
 import asyncio
 import collections
+import functools
+import json
+import time
 from contextlib import AsyncExitStack
 
 from asyncio_mqtt import Client, MqttError
 
 from rpi import rpi_const as const
+from rpi import history
 from rpi import log
 from rpi.events import MqttMsgEvent
+from rpi.metrics import registry, serve_http
 from rpi.basic_receive import (
     basic_receive_main,
-    get_latest,
+    get_nodes,
+    get_store,
     stop_basic_receive,
+    subscribe_changes,
+    unsubscribe_changes,
+    update_stats,
 )
+from rpi.nodes import GATEWAY_NODE
+from rpi.payload import encode, format_value
+from rpi.spool import Spool
 from rpi.mqtt import (
+    MqttSendQueue,
     handle_mqtt_publish,
     handle_mqtt_messages,
+    handle_spool_publish,
 )
 
 
-async def handle_main_event_mqtt(mqtt_msg: MqttMsgEvent, mqtt_send_q: asyncio.Queue):
+async def handle_main_event_mqtt(mqtt_msg: MqttMsgEvent, mqtt_send_q: MqttSendQueue):
     if mqtt_msg.topic in const.SUB_TOPICS:
-        msg = f"Mqtt event received {mqtt_msg.topic} {mqtt_msg.payload}"
-        logger.info(msg)
+        logger.info("Mqtt event received %s %s", mqtt_msg.topic, mqtt_msg.payload)
         if mqtt_msg.topic.endswith("/ping"):
-            curr_values = get_latest()
-            await publish_values(curr_values, curr_values, mqtt_send_q)
+            update_stats()
+            for node, curr_values in list(get_nodes().items()):
+                await publish_values(node, curr_values, curr_values, mqtt_send_q)
+        elif mqtt_msg.topic.endswith(f"/{const.TOPIC_HISTORY}"):
+            await handle_history_request(mqtt_msg, mqtt_send_q)
+        return
+
+    logger.debug("Ignoring Mqtt event received %s %s", mqtt_msg.topic, mqtt_msg.payload)
+
+
+async def handle_history_request(mqtt_msg: MqttMsgEvent, mqtt_send_q: MqttSendQueue):
+    topic = node_topic(GATEWAY_NODE, const.TOPIC_HISTORY)
+    store = get_store()
+    try:
+        if not store:
+            raise ValueError("no store to answer from, STORE_DIR is not set")
+        request = history.parse_request(
+            mqtt_msg.payload, time.time(), const.HISTORY_MAX_BUCKETS
+        )
+    except ValueError as e:
+        reply_topic, payload = history.error_reply(topic, mqtt_msg.payload, f"{e}")
+        await mqtt_send_q.put(MqttMsgEvent(topic=reply_topic, payload=payload))
         return
 
-    msg = f"Ignoring Mqtt event received {mqtt_msg.topic} {mqtt_msg.payload}"
-    logger.debug(msg)
+    # scanning the store can take a while, keep it off the event loop
+    buckets = await asyncio.get_running_loop().run_in_executor(
+        None,
+        store.downsample,
+        request["start"],
+        request["end"],
+        request["bucket"],
+        request["node"],
+    )
+    rows = history.rows(buckets)
+    for reply_topic, payload in history.replies(
+        topic, request, rows, const.HISTORY_PAGE_ROWS
+    ):
+        await mqtt_send_q.put(MqttMsgEvent(topic=reply_topic, payload=payload))
 
 
-async def handle_main_events(mqtt_send_q: asyncio.Queue, main_events_q: asyncio.Queue):
+async def handle_main_events(mqtt_send_q: MqttSendQueue, main_events_q: asyncio.Queue):
     handlers = {
         "MqttMsgEvent": handle_main_event_mqtt,
     }
     while not stop_gracefully:
         main_event = await main_events_q.get()
-        logger.debug(f"Handling {main_event.event}...")
+        logger.debug("Handling %s...", main_event.event)
         handler = handlers.get(main_event.event)
         if handler:
             await handler(main_event, mqtt_send_q)
         else:
-            logger.error(f"No handler found for {main_event.event}")
+            logger.error("No handler found for %s", main_event.event)
         main_events_q.task_done()
 
 
@@ -51,6 +99,10 @@ async def cancel_tasks(tasks):
     logger.info("Cancelling all tasks")
     for task in tasks:
         if task.done():
+            # retrieve how it ended, so that it is not lost (or reported by
+            # asyncio only at exit)
+            if not task.cancelled() and task.exception():
+                logger.debug("%s ended with %r", task.get_name(), task.exception())
             continue
         task.cancel()
         try:
@@ -59,36 +111,86 @@ async def cancel_tasks(tasks):
             pass
 
 
-async def publish_values(curr_values, delta_values, mqtt_send_q: asyncio.Queue):
-    logger.info(
-        f"publishing {const.TOPIC_PUB_MSG}:{curr_values} and sub-topics {sorted(delta_values.keys())}"
-    )
+def node_topic(node, topic):
+    if node == GATEWAY_NODE:
+        return f"{const.TOPIC_PREFIX}{topic}"
+    return f"{const.TOPIC_PREFIX}{node}/{topic}"
+
 
+async def publish_values(node, curr_values, delta_values, mqtt_send_q: MqttSendQueue):
+    msg_topic = node_topic(node, const.TOPIC_MSG)
+    payload = encode(curr_values, const.MQTT_PAYLOAD_FORMAT)
+    # the payload, not curr_values, which changes before it is logged
+    logger.info("publishing %s:%s", msg_topic, payload)
     await mqtt_send_q.put(
-        MqttMsgEvent(topic=const.TOPIC_PUB_MSG, payload=f"{curr_values}")
+        MqttMsgEvent(topic=msg_topic, payload=payload, retain=const.MQTT_RETAIN_MSG)
     )
-    for topic, payload in delta_values.items():
+    if not const.MQTT_PER_KEY_TOPICS:
+        return
+    for topic, value in delta_values.items():
         await mqtt_send_q.put(
-            MqttMsgEvent(topic=f"{const.TOPIC_PREFIX}{topic}", payload=f"{payload}")
+            MqttMsgEvent(
+                topic=node_topic(node, topic), payload=format_value(topic, value)
+            )
         )
 
 
-async def monitor_latest_receive(mqtt_send_q: asyncio.Queue):
-    prev_values = {}
+async def monitor_latest_receive(send_q):
+    # send_q is the spool, or the MqttSendQueue of the connection without one
+    changes_q = subscribe_changes()
+    try:
+        while not stop_gracefully:
+            change = await changes_q.get()
+            await publish_values(change.node, change.values, change.delta, send_q)
+    finally:
+        unsubscribe_changes(changes_q)
+
+
+async def publish_stats(mqtt_send_q: MqttSendQueue):
+    topic = node_topic(GATEWAY_NODE, const.TOPIC_STATS)
     while not stop_gracefully:
-        await asyncio.sleep(1)
-        curr_values = get_latest()
+        await asyncio.sleep(const.METRICS_PUBLISH_INTERVAL)
+        payload = json.dumps(registry.snapshot(), separators=(",", ":"))
+        await mqtt_send_q.put(MqttMsgEvent(topic=topic, payload=payload))
 
-        if prev_values == curr_values:
-            continue
 
-        prev_set = set(prev_values.items())
-        curr_set = set(curr_values.items())
-        await publish_values(curr_values, dict(curr_set - prev_set), mqtt_send_q)
-        prev_values = curr_values.copy()
+def register_queue_metrics(mqtt_send_q: MqttSendQueue, main_events_q: asyncio.Queue):
+    registry.gauge(
+        "loraben_mqtt_send_queue_depth",
+        "Topics waiting to be published",
+        fn=mqtt_send_q.qsize,
+    )
+    registry.counter(
+        "loraben_mqtt_send_dropped_total",
+        "Messages dropped because the MQTT send queue was full",
+        fn=lambda: mqtt_send_q.dropped,
+    )
+    registry.counter(
+        "loraben_mqtt_send_coalesced_total",
+        "Messages replaced by a newer one for the same topic before being sent",
+        fn=lambda: mqtt_send_q.coalesced,
+    )
+    registry.gauge(
+        "loraben_main_events_queue_depth",
+        "MQTT messages received and waiting to be handled",
+        fn=main_events_q.qsize,
+    )
 
 
-async def main_loop():
+def register_spool_metrics(spool: Spool):
+    registry.gauge(
+        "loraben_spool_backlog_bytes",
+        "Spooled messages not acknowledged by the broker yet",
+        fn=spool.backlog_bytes,
+    )
+    registry.counter(
+        "loraben_spool_dropped_segments_total",
+        "Spool segments deleted before all their messages were published",
+        fn=lambda: spool.dropped_segments,
+    )
+
+
+async def main_loop(spool: Spool = None):
     global stop_gracefully
 
     # https://pypi.org/project/asyncio-mqtt/
@@ -97,8 +199,11 @@ async def main_loop():
     mqtt_username = const.MQTT_BROKER_USERNAME
     mqtt_password = const.MQTT_BROKER_PASSWORD
     mqtt_client_id = const.MQTT_CLIENT_ID
-    mqtt_send_q = asyncio.Queue(maxsize=256)
+    mqtt_send_q = MqttSendQueue(
+        maxsize=const.MQTT_SEND_QUEUE_SIZE, drop_policy=const.MQTT_DROP_POLICY
+    )
     main_events_q = asyncio.Queue(maxsize=256)
+    register_queue_metrics(mqtt_send_q, main_events_q)
 
     async with AsyncExitStack() as stack:
         # Keep track of the asyncio tasks that we create, so that
@@ -113,6 +218,8 @@ async def main_loop():
             client_id=mqtt_client_id,
         )
         await stack.enter_async_context(client)
+        if "broker" not in startup.steps:
+            startup.since_start("broker")
 
         messages = await stack.enter_async_context(client.messages())
         task = asyncio.create_task(handle_mqtt_messages(messages, main_events_q))
@@ -127,11 +234,13 @@ async def main_loop():
         task = asyncio.create_task(handle_main_events(mqtt_send_q, main_events_q))
         tasks.add(task)
 
-        quiet = not (const.LOG_TO_CONSOLE and const.LOG_LEVEL_DEBUG)
-        task = asyncio.create_task(basic_receive_main(quiet=quiet))
+        if spool:
+            task = asyncio.create_task(handle_spool_publish(client, spool))
+        else:
+            task = asyncio.create_task(monitor_latest_receive(mqtt_send_q))
         tasks.add(task)
 
-        task = asyncio.create_task(monitor_latest_receive(mqtt_send_q))
+        task = asyncio.create_task(publish_stats(mqtt_send_q))
         tasks.add(task)
 
         # Wait for everything to complete (or fail due to, e.g., network errors)
@@ -140,22 +249,30 @@ async def main_loop():
     logger.debug("all done!")
 
 
-# cfg_globals
-stop_gracefully = False
-logger = None
+def background_done(failed: asyncio.Future, task: asyncio.Task):
+    # The background tasks run as long as the gateway does. One that fails
+    # (e.g. the radios could not be opened, or the metrics port is taken)
+    # stops the gateway, to be restarted by its service.
+    if task.cancelled() or stop_gracefully or failed.done():
+        return
+    error = task.exception() or RuntimeError(f"{task.get_name()} ended")
+    logger.error("%s failed: %r", task.get_name(), error, exc_info=error)
+    failed.set_exception(error)
 
 
-async def main():
+async def keep_connected(spool: Spool = None):
     global stop_gracefully
 
     # Run the loop indefinitely. Reconnect automatically if the connection is lost.
     reconnect_interval = const.MQTT_RECONNECT_INTERVAL
     while not stop_gracefully:
         try:
-            await main_loop()
+            await main_loop(spool)
         except MqttError as error:
             logger.warning(
-                f'MQTT error "{error}". Reconnecting in {reconnect_interval} seconds.'
+                'MQTT error "%s". Reconnecting in %s seconds.',
+                error,
+                reconnect_interval,
             )
         except (KeyboardInterrupt, SystemExit):
             logger.info("got KeyboardInterrupt")
@@ -165,16 +282,74 @@ async def main():
         await asyncio.sleep(reconnect_interval)
 
 
+# cfg_globals
+stop_gracefully = False
+logger = None
+
+
+async def main():
+    # Outside of main_loop, so that the radio keeps receiving (into the spool)
+    # and the metrics can be read while the broker is unreachable
+    background = set()
+    quiet = not (const.LOG_TO_CONSOLE and const.LOG_LEVEL_DEBUG)
+    background.add(
+        asyncio.create_task(basic_receive_main(quiet=quiet), name="basic_receive")
+    )
+    spool = None
+    if const.SPOOL_DIR:
+        spool = Spool(
+            const.SPOOL_DIR,
+            segment_bytes=const.SPOOL_SEGMENT_BYTES,
+            max_segments=const.SPOOL_MAX_SEGMENTS,
+        )
+        register_spool_metrics(spool)
+        background.add(
+            asyncio.create_task(
+                spool.flusher(const.SPOOL_COMMIT_INTERVAL), name="spool_committer"
+            )
+        )
+        background.add(
+            asyncio.create_task(monitor_latest_receive(spool), name="spool_changes")
+        )
+    if const.METRICS_HTTP_PORT:
+        background.add(
+            asyncio.create_task(
+                serve_http(registry, const.METRICS_HTTP_ADDR, const.METRICS_HTTP_PORT),
+                name="metrics_http",
+            )
+        )
+    failed = asyncio.get_running_loop().create_future()
+    for task in background:
+        task.add_done_callback(functools.partial(background_done, failed))
+    connection = asyncio.create_task(keep_connected(spool), name="mqtt")
+    try:
+        await asyncio.wait((connection, failed), return_when=asyncio.FIRST_COMPLETED)
+        if failed.done():
+            failed.result()
+        connection.result()
+    finally:
+        await cancel_tasks([connection])
+        await cancel_tasks(background)
+        if spool:
+            spool.close()
+
+
 if __name__ == "__main__":
     logger = log.getLogger()
-    log.initLogger()
+    log.initLogger(
+        json_format=const.LOG_JSON,
+        queue_size=const.LOG_QUEUE_SIZE,
+        rate_limit=const.LOG_RATE_LIMIT,
+        rate_burst=const.LOG_RATE_BURST,
+    )
 
     if const.LOG_TO_CONSOLE:
-        log.log_to_console()
+        log.log_to_console(const.LOG_JSON)
     if const.LOG_LEVEL_DEBUG:
         log.set_log_level_debug()
 
     logger.info("main process started")
+    startup.since_start("imports")
     asyncio.run(main())
     if not stop_gracefully:
         raise RuntimeError("main is exiting")
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+import asyncio
+import math
+from bisect import bisect_left
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield "", (), self.value
+
+
+class Gauge:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def samples(self):
+        yield "", (), self.value
+
+
+class Callback:
+    """A value that is kept elsewhere (e.g. a queue size), read when collected."""
+
+    __slots__ = ("fn",)
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def samples(self):
+        yield "", (), self.fn()
+
+
+class Histogram:
+    """Counts observations in fixed buckets, each bucket is an upper bound."""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = tuple(sorted(bounds))
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.bounds + (math.inf,), self.counts):
+            cumulative += count
+            yield "_bucket", (("le", _format(bound)),), cumulative
+        yield "_sum", (), self.sum
+        yield "_count", (), self.count
+
+
+class Family:
+    """All the children of one metric, one per combination of label values."""
+
+    def __init__(self, name, help, kind, label_names, make):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.label_names = label_names
+        self.make = make
+        self.children = {}
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.make()
+        return child
+
+
+class Registry:
+    """Metrics of the gateway, for the Prometheus endpoint and loraben/stats.
+
+    Updating a metric is an attribute update on the object the registry
+    handed out, so it is cheap enough for every frame. Values that are
+    already counted elsewhere are registered with fn and only read when the
+    metrics are collected.
+    """
+
+    def __init__(self):
+        self.families = {}
+
+    def _metric(self, name, help, kind, labels, make):
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = Family(name, help, kind, labels, make)
+        return family if labels else family.labels()
+
+    def counter(self, name, help, labels=(), fn=None):
+        if fn:
+            return self._callback(name, help, "counter", fn)
+        return self._metric(name, help, "counter", labels, Counter)
+
+    def gauge(self, name, help, labels=(), fn=None):
+        if fn:
+            return self._callback(name, help, "gauge", fn)
+        return self._metric(name, help, "gauge", labels, Gauge)
+
+    def histogram(self, name, help, buckets, labels=()):
+        return self._metric(name, help, "histogram", labels, lambda: Histogram(buckets))
+
+    def _callback(self, name, help, kind, fn):
+        # registering again (e.g. after an MQTT reconnect) points it to the new fn
+        family = self._metric(name, help, kind, (), lambda: Callback(fn))
+        family.fn = fn
+        return family
+
+    def render(self):
+        lines = []
+        for family in self.families.values():
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for values, child in family.children.items():
+                labels = tuple(zip(family.label_names, values))
+                for suffix, extra, value in child.samples():
+                    lines.append(
+                        f"{family.name}{suffix}{_labels(labels + extra)} {_format(value)}"
+                    )
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Current values, by metric name and then label values, for JSON."""
+        values = {}
+        for family in self.families.values():
+            children = {}
+            for label_values, child in family.children.items():
+                if isinstance(child, Histogram):
+                    value = {"count": child.count, "sum": child.sum}
+                else:
+                    value = next(child.samples())[2]
+                children[",".join(str(v) for v in label_values)] = value
+            if family.label_names:
+                values[family.name] = children
+            elif children:
+                values[family.name] = children[""]
+        return values
+
+
+def _format(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+async def serve_http(registry, host, port):
+    """Serves GET /metrics until cancelled."""
+
+    async def handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            # skip the headers
+            while await asyncio.wait_for(reader.readline(), 5) not in (
+                b"\r\n",
+                b"\n",
+                b"",
+            ):
+                pass
+            parts = request.split()
+            if len(parts) > 1 and parts[0] == b"GET" and parts[1] == b"/metrics":
+                status, body = "200 OK", registry.render().encode()
+            else:
+                status, body = "404 Not Found", b""
+            header = (
+                f"HTTP/1.0 {status}\r\n"
+                f"Content-Type: {CONTENT_TYPE}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n"
+            )
+            writer.write(header.encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+registry = Registry()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Gateway with several radios, each on its own channel, fed by simulated sensors.
+
+Runs rpi.main.main() unchanged on the stubs of rpi.misc.stubs, with one
+simulated radio per --channels. Every node transmits on channel
+node % channels, each report as --copies frames like send_packets on the
+sensor, and each frame is lost with --loss. A fraction --leak of the frames
+is also heard, weaker, on the next channel, like a strong sensor next to a
+gateway listening on neighbouring frequencies.
+
+Counts what each channel received, the frames recognized as heard on
+another channel, reports released once each, duplicates beyond the
+different copies that got through on any channel, and reports whose last
+published copy count is not that number (leaked frames that are not
+recognized, e.g. with --channel-window 0, count as copies too).
+
+Run from the top of the repo:  python3 -m rpi.misc.bench_channels [-o out.json]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from rpi.misc import stubs
+from rpi.misc.bench_gateway import REPORT_V1
+
+
+class ChannelRadio:
+    """Behaves like rfm9x.receive(), for the frames scheduled on one channel."""
+
+    def __init__(self, frames):
+        # (due, packet, rssi), oldest first
+        self.frames = frames
+        self.receive_timeout = 0.5
+        self.last_rssi = 0
+        self.last_snr = 0
+        self.received = 0
+        self.start = None
+
+    def receive(self, with_header=False, timeout=None):
+        timeout = self.receive_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        if not self.frames or self.start + self.frames[0][0] > deadline:
+            time.sleep(max(deadline - time.monotonic(), 0))
+            return None
+        due, packet, rssi = self.frames.pop(0)
+        time.sleep(max(self.start + due - time.monotonic(), 0))
+        self.received += 1
+        self.last_rssi = rssi
+        self.last_snr = (rssi + 120) / 4
+        return bytearray(packet)
+
+    def send(self, data, **kwargs):
+        # the gateway's ACKs
+        return True
+
+
+def schedule(args, rnd):
+    """Frames each channel hears, and by (node, seq) of any of its copies, the
+    copies of each report that got through on any channel."""
+    frames = [[] for _ in range(args.channels)]
+    delivered = {}
+    interval = args.nodes / args.rate
+    for node in range(1, args.nodes + 1):
+        channel = node % args.channels
+        seq = rnd.randrange(256)
+        t = rnd.uniform(0, interval)
+        while t < args.duration:
+            payload = REPORT_V1.pack(
+                1,
+                seq,
+                rnd.randrange(34000, 42000),
+                rnd.randrange(300, 900),
+                rnd.randrange(280, 4500),
+            )
+            copies = set()
+            # the report is published with the seq of the first copy received
+            for i in range(args.copies):
+                delivered[(node, (seq + i) % 256)] = copies
+            for i in range(args.copies):
+                # copies only differ in their sequence number
+                packet = bytes([0xFF, node, 0, 0]) + payload[:1]
+                packet += bytes([(seq + i) % 256]) + payload[2:]
+                rssi = -rnd.randrange(40, 110)
+                due = t + i * args.copy_gap
+                if rnd.random() >= args.loss:
+                    frames[channel].append((due, packet, rssi))
+                    copies.add(i)
+                neighbour = (channel + 1) % args.channels
+                if neighbour != channel and rnd.random() < args.leak:
+                    frames[neighbour].append((due + 0.01, packet, rssi - 15))
+                    copies.add(i)
+            seq = (seq + args.copies) % 256
+            t += interval
+    for channel_frames in frames:
+        channel_frames.sort()
+    return frames, delivered
+
+
+async def collect_released(basic_receive, released, copies):
+    from rpi.nodes import GATEWAY_NODE
+
+    changes_q = basic_receive.subscribe_changes()
+    try:
+        while True:
+            change = await changes_q.get()
+            if change.node == GATEWAY_NODE or "id" not in change.values:
+                continue
+            key = (change.node, change.values["id"])
+            if "id" in change.delta:
+                released.append(key)
+            copies[key] = change.values["copies"]
+    finally:
+        basic_receive.unsubscribe_changes(changes_q)
+
+
+async def run(args):
+    rnd = random.Random(args.seed)
+    frames, delivered = schedule(args, rnd)
+    radios = [ChannelRadio(channel_frames) for channel_frames in frames]
+    stubs.install(radios, stubs.StubBroker(args.rtt))
+
+    from rpi import rpi_const as const
+
+    # before basic_receive is imported, which opens the radios
+    const.RADIOS = tuple(
+        dict(
+            channel=channel,
+            cs=f"CS{channel}",
+            reset=f"RESET{channel}",
+            frequency=915.0 + channel * 0.2,
+            spreading_factor=7,
+        )
+        for channel in range(args.channels)
+    )
+    const.RADIO_DEDUP_WINDOW = args.channel_window
+    const.STORE_DIR = None
+    const.SPOOL_DIR = None
+    const.METRICS_HTTP_PORT = None
+
+    from rpi import log
+    from rpi import main as gateway
+    from rpi import basic_receive
+
+    gateway.logger = log.getLogger()
+
+    released, copies = [], {}
+    start = time.monotonic()
+    for radio in radios:
+        radio.start = start
+    tasks = [
+        asyncio.create_task(gateway.main()),
+        asyncio.create_task(collect_released(basic_receive, released, copies)),
+    ]
+    await asyncio.sleep(args.duration + 1)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    reports = list({id(copies): copies for copies in delivered.values()}.values())
+    heard = set(released)
+    return {
+        "args": vars(args),
+        "frames_per_channel": [radio.received for radio in radios],
+        "cross_channel_duplicates": basic_receive.channel_dedup.hits,
+        "reports_sent": len(reports),
+        "reports_heard": sum(1 for copies in reports if copies),
+        "reports_released": len(released),
+        "reports_released_twice": len(released) - len(heard),
+        "copies_miscounted": sum(
+            1 for key, n in copies.items() if n != len(delivered.get(key, ()))
+        ),
+        "duplicates": basic_receive.dedup.hits,
+        "duplicates_expected": sum(len(copies) - 1 for copies in reports if copies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument("--nodes", type=int, default=40)
+    parser.add_argument("--rate", type=float, default=4, help="reports/s, all nodes")
+    parser.add_argument("--copies", type=int, default=3)
+    parser.add_argument("--copy-gap", type=float, default=0.2)
+    parser.add_argument("--loss", type=float, default=0.1)
+    parser.add_argument("--leak", type=float, default=0.3)
+    parser.add_argument("--channel-window", type=float, default=0.5)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--rtt", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-o", "--output", help="save the results in this JSON file")
+    args = parser.parse_args()
+    if not 0 < args.nodes < 255:
+        parser.error("--nodes must be 1 to 254, the node address is one byte")
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Bytes pushed to the OLED and render time per update, using a fake display.
+
+"full" sends the whole frame on every update, like display.show() did;
+"dirty" sends only the changed columns of the changed pages.
+
+Run from the top of the repo:  python3 -m rpi.misc.bench_display [updates]
+"""
+
+import random
+import sys
+import time
+
+from rpi.display import Renderer
+
+
+class FakeI2CDevice:
+    def __init__(self):
+        self.bytes_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def write(self, buf):
+        self.bytes_written += len(buf)
+
+
+class FakeDisplay:
+    def __init__(self):
+        self.i2c_device = FakeI2CDevice()
+        self.cmds = 0
+
+    def write_cmd(self, cmd):
+        self.cmds += 1
+
+    def invert(self, invert):
+        self.write_cmd(0xA6 | invert)
+
+
+def updates(count, nodes=20):
+    rnd = random.Random(1)
+    for i in range(count):
+        node = rnd.randrange(1, nodes + 1)
+        yield {
+            "ip": "ip:192.168.30.217",
+            "id": f"{node}:{i % 256} -{rnd.randrange(40, 110)} dB",
+            "batt": f"{3.6 + rnd.randrange(100) / 1000} v",
+            "temp": f"{60 + rnd.randrange(50) / 10} F",
+            "dist": f"{rnd.randrange(200, 4000)} mm",
+        }
+
+
+def run(name, count, full):
+    display = FakeDisplay()
+    renderer = Renderer(display)
+    layout = {"ip": (2, 0), "id": (0, 10), "batt": (80, 15), "temp": (2, 20)}
+    layout["dist"] = (47, 25)
+
+    ts = time.perf_counter()
+    for fields in updates(count):
+        for name_, text in fields.items():
+            renderer.set_text(name_, *layout[name_], text)
+        renderer.invert(not renderer.inverted)
+        renderer.show(full=full)
+    elapsed = time.perf_counter() - ts
+
+    pushed = display.i2c_device.bytes_written + 2 * display.cmds
+    print(
+        f"{name:<6} {pushed / count:7.1f} bytes/update"
+        f"  {elapsed / count * 1e6:8.1f} us/update"
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    run("full", count, full=True)
+    run("dirty", count, full=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Construction and attribute access cost of the events in rpi.events.
+
+"namedtuple" is how events used to be built: a new namedtuple class for
+every instance, read through __getattr__. "slots" is rpi.events now.
+
+Run from the top of the repo:  python3 -m rpi.misc.bench_events [count]
+"""
+
+import sys
+import time
+from collections import namedtuple
+
+from rpi.events import MqttMsgEvent
+
+
+class OldBaseEvent:
+    def __init__(self, expected_attrs, attrs):
+        self.event = self.__class__.__name__
+        self.attrs = self._dict_to_attrs(attrs)
+        self._check_expected_attrs(expected_attrs)
+
+    def __getattr__(self, attr):
+        try:
+            return getattr(self.attrs, attr)
+        except AttributeError as e:
+            raise AttributeError(
+                f"{self.event} object is missing {attr} attribute"
+            ) from e
+
+    def _check_expected_attrs(self, expected_attrs):
+        if expected_attrs:
+            for attr in expected_attrs:
+                getattr(self, attr)
+
+    @staticmethod
+    def _dict_to_attrs(params_dict):
+        cls = namedtuple("Attrs", params_dict)
+        cls.__new__.__defaults__ = tuple(params_dict.values())
+        return cls()
+
+
+class OldMqttMsgEvent(OldBaseEvent):
+    def __init__(self, **attrs):
+        expected_attrs = "topic", "payload"
+        super().__init__(expected_attrs, attrs)
+
+
+def bench(name, event_class, count):
+    start = time.perf_counter()
+    events = [
+        event_class(topic="loraben/1/dist", payload=f"{i} mm") for i in range(count)
+    ]
+    built = time.perf_counter()
+    for event in events:
+        event.event, event.topic, event.payload
+    read = time.perf_counter()
+    print(
+        f"{name:<11} construct:{(built - start) / count * 1e6:8.2f} us"
+        f"  access:{(read - built) / count * 1e6:6.3f} us"
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    bench("namedtuple", OldMqttMsgEvent, count)
+    bench("slots", MqttMsgEvent, count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+End-to-end gateway throughput and latency, from radio receive to publish.
+
+Runs rpi.main.main() unchanged on the stubs of rpi.misc.stubs, with a
+synthetic radio: --nodes sensors that together send --rate reports a
+second, each as --copies frames with consecutive sequence numbers (like
+send_packets on the sensor), of which --loss are lost. The default is one
+copy, as the sensor stops sending copies once the gateway acknowledged one.
+The stub broker acknowledges publishes after --rtt seconds.
+
+Latency is from the first copy of a report coming off the radio to the
+publish of its node's msg topic, including the spool commit interval. Throughput is the readings (msg
+topics) published, over the time from the start to the last of them; the
+frames the radio offered are in offered_frames_per_s. Queue depths are
+sampled every 50 ms.
+
+Run from the top of the repo:  python3 -m rpi.misc.bench_gateway [-o out.json]
+"""
+
+import argparse
+import asyncio
+import heapq
+import json
+import os
+import random
+import shutil
+import struct
+import tempfile
+import threading
+import time
+
+from rpi.misc import stubs
+
+REPORT_V1 = struct.Struct("<BBHhh")
+
+
+class SyntheticRadio:
+    """Behaves like rfm9x.receive(), with frames of many nodes due on a schedule."""
+
+    def __init__(self, nodes, rate, copies, loss, copy_gap=0.2, seed=1):
+        self.rnd = random.Random(seed)
+        self.copies = copies
+        self.loss = loss
+        self.copy_gap = copy_gap
+        self.interval = nodes / rate
+        self.receive_timeout = 0.5
+        self.last_rssi = 0
+        self.frames = 0
+        self.lost = 0
+        self.acks = 0
+        self.end = None
+        # when the first copy of (node, seq) came off the radio
+        self.first_copy = {}
+        self._lock = threading.Lock()
+        self._due = []
+        start = time.time()
+        for node in range(1, nodes + 1):
+            due = start + self.rnd.uniform(0, self.interval)
+            heapq.heappush(self._due, (due, node, self.rnd.randrange(256), None, 0))
+
+    def _report(self, node, seq):
+        rnd = self.rnd
+        return REPORT_V1.pack(
+            1,
+            seq,
+            rnd.randrange(34000, 42000),
+            rnd.randrange(300, 900),
+            rnd.randrange(280, 4500),
+        )
+
+    def receive(self, with_header=False, timeout=None):
+        timeout = self.receive_timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+        while True:
+            due, node, seq, payload, copy = self._due[0]
+            if self.end is not None and due > self.end or due > deadline:
+                time.sleep(max(deadline - time.time(), 0))
+                return None
+            time.sleep(max(due - time.time(), 0))
+            heapq.heappop(self._due)
+            if payload is None:
+                # a new report: its copies follow, and the next report after them
+                payload = self._report(node, seq)
+                for i in range(1, self.copies):
+                    heapq.heappush(
+                        self._due,
+                        (due + i * self.copy_gap, node, (seq + i) % 256, payload, i),
+                    )
+                next_seq = (seq + self.copies) % 256
+                heapq.heappush(
+                    self._due, (due + self.interval, node, next_seq, None, 0)
+                )
+            with self._lock:
+                self.first_copy[(node, seq)] = due - copy * self.copy_gap
+            if self.rnd.random() < self.loss:
+                self.lost += 1
+                continue
+            self.frames += 1
+            self.last_rssi = -self.rnd.randrange(40, 110)
+            return bytearray([0xFF, node, 0, 0]) + payload
+
+    def send(self, data, **kwargs):
+        # the gateway's ACKs
+        self.acks += 1
+        return True
+
+    def latency(self, node, seq):
+        with self._lock:
+            first = self.first_copy.get((node, seq))
+        return None if first is None else time.time() - first
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+async def sample_depths(gateway, basic_receive, depths):
+    while True:
+        await asyncio.sleep(0.05)
+        if basic_receive.reader:
+            depths["radio"].append(basic_receive.reader.frames_q.qsize())
+        subscribers = basic_receive.node_changes.subscribers
+        depths["changes"].append(max((q.qsize() for q in subscribers), default=0))
+        for send_q in gateway.MqttSendQueue.instances:
+            depths["mqtt_send"].append(send_q.qsize())
+
+
+async def run(args):
+    radio = SyntheticRadio(args.nodes, args.rate, args.copies, args.loss)
+    latencies = []
+    # time of the last publish, and of the last reading published
+    last = {"publish": None, "msg": None}
+
+    def on_publish(topic, payload):
+        last["publish"] = time.time()
+        parts = topic.split("/")
+        if len(parts) == 3 and parts[2] == "msg":
+            last["msg"] = last["publish"]
+            seq = json.loads(payload).get("id")
+            latency = None if seq is None else radio.latency(int(parts[1]), seq)
+            if latency is not None:
+                latencies.append(latency)
+
+    broker = stubs.StubBroker(args.rtt, on_publish)
+    stubs.install(radio, broker)
+
+    from rpi import log
+    from rpi import main as gateway
+    from rpi import basic_receive
+    from rpi import rpi_const as const
+    from rpi.mqtt import MqttSendQueue
+
+    class SendQueue(MqttSendQueue):
+        instances = []
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.instances.append(self)
+
+    store_dir = tempfile.mkdtemp(prefix="bench_gateway-")
+    const.STORE_DIR = os.path.join(store_dir, "store")
+    const.SPOOL_DIR = os.path.join(store_dir, "spool")
+    const.METRICS_HTTP_PORT = None
+    const.MQTT_PUBLISH_RATE = args.publish_rate
+    const.MQTT_PUBLISH_BURST = args.publish_rate * 2
+    gateway.logger = log.getLogger()
+    gateway.MqttSendQueue = SendQueue
+
+    depths = {"radio": [], "changes": [], "mqtt_send": []}
+    tasks = [
+        asyncio.create_task(gateway.main()),
+        asyncio.create_task(sample_depths(gateway, basic_receive, depths)),
+    ]
+    start = time.time()
+    radio.end = start + args.duration
+    # let the last reports through the spool and the publish queue
+    await asyncio.sleep(args.duration + 1)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    shutil.rmtree(store_dir, ignore_errors=True)
+
+    dedup = basic_receive.dedup
+    send_q = SendQueue.instances[0]
+    return {
+        "args": vars(args),
+        "frames_received": radio.frames,
+        "frames_lost": radio.lost,
+        "reports_released": dedup.misses,
+        "duplicates": dedup.hits,
+        "publishes": broker.published,
+        "msg_publishes": len(latencies),
+        "offered_frames_per_s": round(radio.frames / args.duration, 2),
+        # what was processed: published, until the last one was
+        "throughput_readings_per_s": _rate(len(latencies), start, last["msg"]),
+        "throughput_publishes_per_s": _rate(broker.published, start, last["publish"]),
+        "latency_p50_ms": _ms(percentile(latencies, 0.5)),
+        "latency_p99_ms": _ms(percentile(latencies, 0.99)),
+        "latency_max_ms": _ms(max(latencies, default=None)),
+        "queue_depth": {
+            name: {
+                "mean": round(sum(d) / len(d), 2) if d else 0,
+                "max": max(d, default=0),
+            }
+            for name, d in depths.items()
+        },
+        "drops": {
+            "radio_overflows": basic_receive.reader.overflows,
+            "change_events": basic_receive.node_changes.dropped,
+            "mqtt_send": send_q.dropped,
+            "mqtt_coalesced": send_q.coalesced,
+        },
+        "acks_sent": radio.acks,
+        "broker_max_in_flight": broker.max_in_flight,
+    }
+
+
+def _rate(count, start, end):
+    return None if end is None else round(count / (end - start), 2)
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=5, help="reports/s, all nodes")
+    parser.add_argument("--copies", type=int, default=1)
+    parser.add_argument("--loss", type=float, default=0.1)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--rtt", type=float, default=0.02)
+    parser.add_argument("--publish-rate", type=float, default=1000)
+    parser.add_argument("-o", "--output", help="save the results in this JSON file")
+    args = parser.parse_args()
+    if not 0 < args.nodes < 255:
+        parser.error("--nodes must be 1 to 254, the node address is one byte")
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Cost of logging, per received packet, and how long it holds up the event loop.
+
+Every packet makes the log calls the gateway makes for one report
+(publishing ... at info, Published: ... at debug), at --level. The sink
+takes --sink-delay seconds per record, like a syslog socket that is
+backed up. Compared:
+
+- sync: f-strings and the handler called in the logging thread, like before
+- queue: lazy arguments, records handed to the listener thread of rpi.log
+- queue+limit: the same, with the per call site rate limit of rpi.log
+
+Reports the time per packet spent in the caller, the event loop lag while
+--rate packets a second are logged, and what the sink wrote.
+
+Run from the top of the repo:  python3 -m rpi.misc.bench_logging [-o out.json]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from rpi import log
+
+
+class SlowSink:
+    """A stream that takes delay seconds per write."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.records = 0
+
+    def write(self, text):
+        time.sleep(self.delay)
+        self.records += 1
+
+    def flush(self):
+        pass
+
+
+def log_packet(logger, i, lazy):
+    topic = f"loraben/{i % 50}/msg"
+    values = {"id": i % 256, "batt": 4.0864, "temp": 62.6, "dist": 385, "rssi": -76}
+    if lazy:
+        payload = json.dumps(values)
+        logger.info("publishing %s:%s", topic, payload)
+        logger.debug("Published: %s %s", topic, payload)
+    else:
+        logger.info(f"publishing {topic}:{values}")
+        payload = json.dumps(values)
+        logger.debug(f"Published: {topic} {payload}")
+
+
+def setup(config, level, sink):
+    logger = logging.getLogger(f"bench_logging.{config}")
+    logger.propagate = False
+    logger.setLevel(level)
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    if config == "sync":
+        logger.addHandler(handler)
+        return logger, None
+    rate_limit = 5 if config == "queue+limit" else None
+    _queue_handler, listener = log.start_queue(
+        logger, [handler], queue_size=1024, rate_limit=rate_limit
+    )
+    return logger, listener
+
+
+def caller_cost(config, level, args):
+    sink = SlowSink(args.sink_delay)
+    logger, listener = setup(config, level, sink)
+    start = time.perf_counter()
+    for i in range(args.packets):
+        log_packet(logger, i, config != "sync")
+    elapsed = time.perf_counter() - start
+    if listener:
+        listener.stop()
+    return elapsed / args.packets * 1e6, sink.records
+
+
+async def loop_lag(config, level, args):
+    sink = SlowSink(args.sink_delay)
+    logger, listener = setup(config, level, sink)
+    lags = []
+
+    async def ticker():
+        while True:
+            ts = time.monotonic()
+            await asyncio.sleep(0.01)
+            lags.append(time.monotonic() - ts - 0.01)
+
+    async def producer():
+        for i in range(int(args.rate * args.duration)):
+            log_packet(logger, i, config != "sync")
+            await asyncio.sleep(1 / args.rate)
+
+    tick = asyncio.create_task(ticker())
+    await producer()
+    tick.cancel()
+    if listener:
+        listener.stop()
+    lags.sort()
+    return lags[len(lags) // 2], lags[int(len(lags) * 0.99)], lags[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--level", choices=("info", "debug"), default="info")
+    parser.add_argument("--sink-delay", type=float, default=0.0005, help="[s]")
+    parser.add_argument("--packets", type=int, default=5000)
+    parser.add_argument("--rate", type=float, default=100, help="packets/s")
+    parser.add_argument("--duration", type=float, default=2, help="[s]")
+    parser.add_argument("-o", "--output", help="save the results in this JSON file")
+    args = parser.parse_args()
+    level = logging.DEBUG if args.level == "debug" else logging.INFO
+
+    results = {"args": vars(args)}
+    for config in ("sync", "queue", "queue+limit"):
+        per_packet, written = caller_cost(config, level, args)
+        p50, p99, worst = asyncio.run(loop_lag(config, level, args))
+        results[config] = {
+            "caller_us_per_packet": round(per_packet, 2),
+            "records_written": written,
+            "loop_lag_p50_ms": round(p50 * 1000, 2),
+            "loop_lag_p99_ms": round(p99 * 1000, 2),
+            "loop_lag_max_ms": round(worst * 1000, 2),
+        }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
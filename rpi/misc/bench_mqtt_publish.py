@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Publish throughput and latency of handle_mqtt_publish against a stub broker.
+
+The stub broker acknowledges every publish after a fixed round trip time.
+Producers put messages for many nodes, the way publish_values does, and the
+end-to-end latency is measured from put() to the broker ack.
+
+Run from the top of the repo:  python3 -m rpi.misc.bench_mqtt_publish
+"""
+
+import argparse
+import asyncio
+import time
+
+from rpi import rpi_const as const
+from rpi.events import MqttMsgEvent
+from rpi.mqtt import MqttSendQueue, handle_mqtt_publish
+
+
+class StubBroker:
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.latencies = []
+
+    async def publish(self, topic, payload, qos=0, retain=False, timeout=None):
+        await asyncio.sleep(self.rtt)
+        self.latencies.append(time.monotonic() - payload)
+
+
+async def produce(mqtt_send_q, nodes, reports, interval):
+    for seq in range(reports):
+        for node in range(nodes):
+            for key in ("msg", "id", "batt", "temp", "dist", "rssi", "ts", "len"):
+                # payload carries the put time, for the latency measurement
+                topic = f"loraben/{node}/{key}"
+                await mqtt_send_q.put(
+                    MqttMsgEvent(topic=topic, payload=time.monotonic())
+                )
+        await asyncio.sleep(interval)
+
+
+async def run(args):
+    broker = StubBroker(args.rtt)
+    mqtt_send_q = MqttSendQueue(maxsize=args.queue, drop_policy=args.drop)
+    publisher = asyncio.create_task(handle_mqtt_publish(broker, mqtt_send_q))
+
+    ts = time.monotonic()
+    await produce(mqtt_send_q, args.nodes, args.reports, args.interval)
+    while mqtt_send_q.qsize():
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(args.rtt * 2)
+    elapsed = time.monotonic() - ts
+    publisher.cancel()
+
+    lat = sorted(broker.latencies)
+    put = args.nodes * args.reports * 8
+    print(
+        f"put:{put} published:{len(lat)} coalesced:{mqtt_send_q.coalesced}"
+        f" dropped:{mqtt_send_q.dropped}"
+    )
+    print(f"throughput: {len(lat) / elapsed:8.1f} msgs/s  in {elapsed:.2f} s")
+    print(
+        f"latency p50:{lat[len(lat) // 2] * 1000:8.1f} ms"
+        f"  p99:{lat[int(len(lat) * 0.99)] * 1000:8.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=20)
+    parser.add_argument("--reports", type=int, default=5)
+    parser.add_argument("--interval", type=float, default=0.5)
+    parser.add_argument("--rtt", type=float, default=0.02)
+    parser.add_argument("--rate", type=float, default=const.MQTT_PUBLISH_RATE)
+    parser.add_argument("--burst", type=float, default=const.MQTT_PUBLISH_BURST)
+    parser.add_argument("--in-flight", type=int, default=const.MQTT_MAX_IN_FLIGHT)
+    parser.add_argument("--queue", type=int, default=const.MQTT_SEND_QUEUE_SIZE)
+    parser.add_argument("--drop", default=const.MQTT_DROP_POLICY)
+    args = parser.parse_args()
+
+    const.MQTT_PUBLISH_RATE = args.rate
+    const.MQTT_PUBLISH_BURST = args.burst
+    const.MQTT_MAX_IN_FLIGHT = args.in_flight
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Encode/decode microbenchmark for the sensor report formats.
+
+Run from the top of the repo:  python3 -m rpi.misc.bench_packet
+"""
+
+import timeit
+
+from report import encode_report, encode_report_text
+from rpi.packet import decode_report
+
+HEADER = bytes([0xFF, 0x01, 0x00, 0x00])
+SAMPLE = (227, 3.6472, 59.9, 183)
+NUMBER = 100000
+
+
+def _bench(label, stmt, size):
+    secs = timeit.timeit(stmt, number=NUMBER)
+    print(f"{label:<14} {size:3d} bytes  {secs / NUMBER * 1e6:6.2f} us/op")
+
+
+def main():
+    binary = HEADER + encode_report(*SAMPLE)
+    text = HEADER + encode_report_text(*SAMPLE)
+    assert decode_report(binary) == decode_report(text)
+
+    _bench("encode binary", lambda: encode_report(*SAMPLE), len(binary) - 4)
+    _bench("encode text", lambda: encode_report_text(*SAMPLE), len(text) - 4)
+    _bench("decode binary", lambda: decode_report(binary), len(binary) - 4)
+    _bench("decode text", lambda: decode_report(text), len(text) - 4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Event loop latency while receiving from a fake radio.
+
+Compares calling the blocking receive() inside a coroutine (the old way)
+with reading the radio from a RadioReader thread.
+
+Run from the top of the repo:  python3 -m rpi.misc.bench_radio [rate] [secs]
+"""
+
+import asyncio
+import sys
+import time
+
+from rpi.radio import RadioReader
+
+
+class FakeRadio:
+    """Behaves like rfm9x.receive(): blocks until a frame is due or timeout."""
+
+    def __init__(self, rate):
+        self.period = 1.0 / rate
+        self.receive_timeout = 0.5
+        self.last_rssi = -70
+        self.next_frame = time.monotonic() + self.period
+        self.seq = 0
+
+    def receive(self, with_header=False, timeout=None):
+        timeout = self.receive_timeout if timeout is None else timeout
+        wait = self.next_frame - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return None
+        time.sleep(max(wait, 0))
+        self.next_frame += self.period
+        self.seq = (self.seq + 1) % 256
+        return bytearray([0xFF, 1, 0, 0, 1, self.seq, 0, 0, 0, 0, 0, 0])
+
+
+async def measure_latency(duration, interval=0.01):
+    # like a ping handler: how late does a coroutine that wants to run get to run
+    lags = []
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        ts = time.monotonic()
+        await asyncio.sleep(interval)
+        lags.append(time.monotonic() - ts - interval)
+    lags.sort()
+    return lags[len(lags) // 2], lags[int(len(lags) * 0.99)], lags[-1]
+
+
+async def inline_receive(radio, duration, counts):
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        await asyncio.sleep(0)
+        if radio.receive(with_header=True) is not None:
+            counts["frames"] += 1
+
+
+async def threaded_receive(radio, duration, counts):
+    frames_q = asyncio.Queue(maxsize=64)
+    reader = RadioReader(radio, asyncio.get_running_loop(), frames_q, 0.5)
+    reader.start()
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        try:
+            await asyncio.wait_for(frames_q.get(), timeout=0.1)
+            counts["frames"] += 1
+        except asyncio.TimeoutError:
+            pass
+    reader.stop()
+    counts["overflows"] = reader.overflows
+
+
+async def run(name, receive, rate, duration):
+    counts = {"frames": 0, "overflows": 0}
+    radio = FakeRadio(rate)
+    (p50, p99, worst), _ = await asyncio.gather(
+        measure_latency(duration), receive(radio, duration, counts)
+    )
+    print(
+        f"{name:<9} frames:{counts['frames']:5d} overflows:{counts['overflows']:3d}"
+        f"  loop lag p50:{p50 * 1000:7.2f} ms p99:{p99 * 1000:7.2f} ms"
+        f" max:{worst * 1000:7.2f} ms"
+    )
+
+
+def main():
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    print(f"fake radio at {rate} frames/s for {duration} s")
+    asyncio.run(run("inline", inline_receive, rate, duration))
+    asyncio.run(run("threaded", threaded_receive, rate, duration))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Capture and replay of raw frames: capture cost, replay and backfill speed.
+
+Makes --hours of synthetic traffic: --nodes sensors each sending a report
+every --interval seconds as --copies frames, of which --loss are lost,
+--batch of the sensors sending batch reports of 6 readings, on --channels
+radios that each also hear --leak of the frames of the others, and a few
+corrupt frames. The frames are written with rpi.capture.Capture, then read
+back and
+
+- replayed at full speed through the receive pipeline (rpi/replay.py),
+  with a store, the messages counted rather than published
+- backfilled into another store
+
+and the readings in both stores compared. Also times decode_report() of
+every frame.
+
+Run from the top of the repo:  python3 -m rpi.misc.bench_replay [-o out.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from rpi.misc import stubs
+
+stubs.install()
+
+import report  # noqa: E402  (of the sensor)
+from rpi import basic_receive, log  # noqa: E402
+from rpi import main as gateway  # noqa: E402
+from rpi import replay  # noqa: E402
+from rpi import rpi_const as const  # noqa: E402
+from rpi.capture import Capture, capture_files, read_frames  # noqa: E402
+from rpi.packet import HEADER_LEN, decode_report  # noqa: E402
+from rpi.radio import Frame  # noqa: E402
+from rpi.store import Store  # noqa: E402
+
+
+def traffic(args, start=1_700_000_000.0):
+    rnd = random.Random(args.seed)
+    frames = []
+    for node in range(1, args.nodes + 1):
+        batch = rnd.random() < args.batch
+        seq = rnd.randrange(256)
+        channel = node % args.channels
+        ts = start + rnd.uniform(0, args.interval)
+        while ts < start + args.hours * 3600:
+            battery = rnd.uniform(3.4, 4.2)
+            temperature = rnd.uniform(30, 90)
+            distance = rnd.randrange(280, 4500)
+            scaled = report.scale_reading(battery, temperature, distance)
+            readings = [
+                (600 * (5 - i), scaled[0], scaled[1] + i, scaled[2] - i)
+                for i in range(6)
+            ]
+            for copy in range(args.copies):
+                if batch:
+                    payload = report.encode_batch((seq + copy) & 0xFF, readings)
+                else:
+                    payload = report.encode_report(
+                        seq + copy, battery, temperature, distance
+                    )
+                packet = bytearray([0xFF, node, 0, 0]) + payload
+                if rnd.random() < 0.001:
+                    packet = packet[:-2]
+                rssi = -rnd.randrange(40, 120)
+                frame_ts = ts + copy * 0.2
+                if rnd.random() >= args.loss:
+                    frames.append(Frame(packet, rssi, frame_ts, channel, 7.25))
+                for other in range(args.channels):
+                    if other != channel and rnd.random() < args.leak:
+                        frames.append(Frame(packet, rssi - 20, frame_ts + 1e-3, other))
+            seq = (seq + args.copies) % 256
+            ts += args.interval
+    frames.sort(key=lambda f: f.ts)
+    return frames
+
+
+def open_store(directory):
+    return Store(
+        directory,
+        segment_records=const.STORE_SEGMENT_RECORDS,
+        max_segments=const.STORE_MAX_SEGMENTS,
+    )
+
+
+def store_records(directory):
+    store = open_store(directory)
+    try:
+        records = store.query(0, float("inf"))
+    finally:
+        store.close()
+    return sorted(records)
+
+
+async def run_replay(capture_dir):
+    sink = replay.PrintSink(False)
+    flusher = asyncio.create_task(basic_receive.flush_store())
+    count = await replay.replay(read_frames([capture_dir]), sink)
+    flusher.cancel()
+    await asyncio.gather(flusher, return_exceptions=True)
+    basic_receive.store.close()
+    return count, sink.messages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=50)
+    parser.add_argument("--hours", type=float, default=24)
+    parser.add_argument("--interval", type=float, default=300, help="[s]")
+    parser.add_argument("--copies", type=int, default=3)
+    parser.add_argument("--loss", type=float, default=0.1)
+    parser.add_argument("--batch", type=float, default=0.2)
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument("--leak", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-o", "--output", help="save the results in this JSON file")
+    args = parser.parse_args()
+
+    gateway.logger = log.getLogger()
+    tmp_dir = tempfile.mkdtemp(prefix="bench_replay-")
+    try:
+        frames = traffic(args)
+        n = len(frames)
+        capture_dir = os.path.join(tmp_dir, "capture")
+
+        start = time.perf_counter()
+        capture = Capture(capture_dir)
+        for frame in frames:
+            capture.add(frame)
+        capture.close()
+        capture_s = time.perf_counter() - start
+        capture_bytes = sum(os.path.getsize(f) for f in capture_files([capture_dir]))
+
+        start = time.perf_counter()
+        read_back = list(read_frames([capture_dir]))
+        read_s = time.perf_counter() - start
+
+        packets = [f.packet for f in read_back]
+        start = time.perf_counter()
+        for packet in packets:
+            try:
+                decode_report(packet, HEADER_LEN)
+            except Exception:
+                pass
+        decode_s = time.perf_counter() - start
+
+        const.STORE_DIR = os.path.join(tmp_dir, "replayed")
+        basic_receive.open_store()
+        start = time.perf_counter()
+        replayed, messages = asyncio.run(run_replay(capture_dir))
+        replay_s = time.perf_counter() - start
+
+        backfill_dir = os.path.join(tmp_dir, "backfilled")
+        store = open_store(backfill_dir)
+        start = time.perf_counter()
+        backfilled, failures = replay.backfill(read_frames([capture_dir]), store)
+        store.close()
+        backfill_s = time.perf_counter() - start
+
+        replayed_records = store_records(const.STORE_DIR)
+        backfilled_records = store_records(backfill_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def per_frame_us(seconds):
+        return round(seconds / n * 1e6, 2)
+
+    result = {
+        "args": vars(args),
+        "frames": n,
+        "frames_read_back": len(read_back),
+        "identical_frames": read_back == frames,
+        "capture_bytes_per_frame": round(capture_bytes / n, 1),
+        "capture_us_per_frame": per_frame_us(capture_s),
+        "read_us_per_frame": per_frame_us(read_s),
+        "decode_us_per_frame": per_frame_us(decode_s),
+        "replay": {
+            "frames": replayed,
+            "frames_per_s": round(replayed / replay_s),
+            "measurements": basic_receive.dedup.misses,
+            "duplicates": basic_receive.dedup.hits,
+            "cross_channel_duplicates": basic_receive.channel_dedup.hits,
+            "messages": messages,
+            "change_events_dropped": basic_receive.node_changes.dropped,
+            "records": len(replayed_records),
+        },
+        "backfill": {
+            "frames": backfilled,
+            "frames_per_s": round(backfilled / backfill_s),
+            "parse_failures": failures,
+            "records": len(backfilled_records),
+        },
+        "same_records": replayed_records == backfilled_records,
+    }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Readings published through a broker that goes away on a schedule.
+
+Runs rpi.main.main() unchanged on the stubs of rpi.misc.stubs, with the
+synthetic radio of rpi.misc.bench_gateway, and a stub broker that is
+unreachable during --outages (e.g. "3:8,12:14", seconds from the start).
+Every report released by dedup should reach the broker, in the order it
+was received, however long the broker was away; replays after a reconnect
+are limited to --replay-rate publishes a second.
+
+Counts reports that never made it, ones published more than once (the
+spool delivers at least once) and ones published out of order per node.
+
+Run from the top of the repo:  python3 -m rpi.misc.bench_spool [-o out.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from rpi.misc import stubs
+from rpi.misc.bench_gateway import SyntheticRadio
+from rpi.nodes import GATEWAY_NODE
+
+
+def parse_outages(text):
+    outages = []
+    for span in filter(None, text.split(",")):
+        start, end = span.split(":")
+        outages.append((float(start), float(end)))
+    return outages
+
+
+async def collect_released(basic_receive, released):
+    changes_q = basic_receive.subscribe_changes()
+    try:
+        while True:
+            change = await changes_q.get()
+            if change.node != GATEWAY_NODE:
+                released.append((change.node, change.values.get("id")))
+    finally:
+        basic_receive.unsubscribe_changes(changes_q)
+
+
+async def run(args):
+    radio = SyntheticRadio(args.nodes, args.rate, args.copies, args.loss)
+    published = []
+    publish_times = []
+
+    def on_publish(topic, payload):
+        parts = topic.split("/")
+        if len(parts) == 3 and parts[2] == "msg":
+            published.append((int(parts[1]), json.loads(payload).get("id")))
+            publish_times.append(time.monotonic())
+
+    broker = stubs.StubBroker(args.rtt, on_publish, parse_outages(args.outages))
+    stubs.install(radio, broker)
+
+    from rpi import log
+    from rpi import main as gateway
+    from rpi import basic_receive
+    from rpi import rpi_const as const
+    from rpi.metrics import registry
+
+    work_dir = tempfile.mkdtemp(prefix="bench_spool-")
+    const.STORE_DIR = None
+    const.SPOOL_DIR = os.path.join(work_dir, "spool")
+    const.SPOOL_REPLAY_RATE = args.replay_rate
+    const.SPOOL_REPLAY_BURST = args.replay_rate * 2
+    const.MQTT_RECONNECT_INTERVAL = args.reconnect
+    const.METRICS_HTTP_PORT = None
+    gateway.logger = log.getLogger()
+
+    released = []
+    tasks = [
+        asyncio.create_task(gateway.main()),
+        asyncio.create_task(collect_released(basic_receive, released)),
+    ]
+    start = time.monotonic()
+    radio.end = time.time() + args.duration
+    await asyncio.sleep(args.duration + const.DEDUP_HOLD)
+    # then give the spool until --drain seconds to empty
+    backlog = empty = None
+    deadline = time.monotonic() + args.drain
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.5)
+        # twice in a row, the last readings may not have been committed yet
+        backlog = registry.snapshot().get("loraben_spool_backlog_bytes")
+        if backlog == 0 and empty and not broker.down():
+            break
+        empty = backlog == 0
+    elapsed = time.monotonic() - start
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    unique = set(published)
+    # first publish of every report, in order, per node
+    first_order = {}
+    for report in dict.fromkeys(published):
+        first_order.setdefault(report[0], []).append(report)
+    release_order = {}
+    for report in released:
+        release_order.setdefault(report[0], []).append(report)
+    out_of_order = sum(
+        1
+        for node, reports in release_order.items()
+        for a, b in zip(reports, first_order.get(node, []))
+        if a != b
+    )
+    # most publishes in any one second
+    peak, lo = 0, 0
+    for hi, t in enumerate(publish_times):
+        while t - publish_times[lo] >= 1:
+            lo += 1
+        peak = max(peak, hi - lo + 1)
+    return {
+        "args": vars(args),
+        "elapsed_s": round(elapsed, 1),
+        "frames_received": radio.frames,
+        "reports_released": len(released),
+        "reports_published": len(unique & set(released)),
+        "reports_lost": len(set(released) - unique),
+        "duplicate_publishes": len(published) - len(unique),
+        "out_of_order": out_of_order,
+        "broker_connects": broker.connects,
+        "broker_failures": broker.failures,
+        "peak_publishes_per_s": peak,
+        "spool_backlog_bytes": backlog,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=4, help="reports/s, all nodes")
+    parser.add_argument("--copies", type=int, default=3)
+    parser.add_argument("--loss", type=float, default=0.1)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--outages", default="3:8,12:14", help="start:end,...")
+    parser.add_argument("--reconnect", type=float, default=1, help="[seconds]")
+    parser.add_argument("--replay-rate", type=float, default=10)
+    parser.add_argument("--rtt", type=float, default=0.02)
+    parser.add_argument("--drain", type=float, default=30, help="[seconds]")
+    parser.add_argument("-o", "--output", help="save the results in this JSON file")
+    args = parser.parse_args()
+    if not 0 < args.nodes < 255:
+        parser.error("--nodes must be 1 to 254, the node address is one byte")
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Gateway startup: import cost by module, and the time to each step of the start.
+
+Runs rpi.main.main() unchanged on the stubs of rpi.misc.stubs, in a fresh
+interpreter with -X importtime for each of:
+
+- lazy: the display and the radios are opened by their tasks, in a thread
+- eager: they are opened before main() starts, the way importing
+  rpi.basic_receive used to
+
+Opening a radio takes --radio-init seconds and the display --display-init
+(each of the --radios radios, all on one SPI bus). Reports the steps of
+rpi.startup (imports, display, radios, broker connected, receiving), the
+longest the event loop was held up, and the modules that took longest to
+import.
+
+Run from the top of the repo:  python3 -m rpi.misc.bench_startup [-o out.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from rpi.misc import stubs
+
+
+def parse_importtime(stderr, top):
+    # import time: self [us] | cumulative | imported package
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    cumulative = {name: us for name, _self, us in modules}
+    slowest = sorted(modules, key=lambda m: m[1], reverse=True)[:top]
+    return {
+        "rpi.main_cumulative_ms": round(cumulative.get("rpi.main", 0) / 1000, 1),
+        "slowest_self_ms": {name: round(us / 1000, 2) for name, us, _c in slowest},
+    }
+
+
+async def loop_lag(lags):
+    while True:
+        ts = time.monotonic()
+        await asyncio.sleep(0.005)
+        lags.append(time.monotonic() - ts - 0.005)
+
+
+async def run_child(args, gateway, basic_receive, startup):
+    lags = []
+    ticker = asyncio.create_task(loop_lag(lags))
+    if args.child == "eager":
+        basic_receive.open_display()
+        basic_receive.open_radios()
+    task = asyncio.create_task(gateway.main())
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline:
+        if "broker" in startup.steps and "receiving" in startup.steps:
+            break
+        await asyncio.sleep(0.01)
+    for t in (task, ticker):
+        t.cancel()
+    await asyncio.gather(task, ticker, return_exceptions=True)
+    return {
+        "steps_s": {step: round(s, 3) for step, s in startup.steps.items()},
+        "loop_lag_max_ms": round(max(lags, default=0) * 1000, 1),
+    }
+
+
+def child(args):
+    stubs.install(
+        broker=stubs.StubBroker(rtt=0.005),
+        radio_init=args.radio_init,
+        display_init=args.display_init,
+    )
+
+    from rpi import main as gateway
+    from rpi import basic_receive, log, startup
+    from rpi import rpi_const as const
+
+    startup.since_start("imports")
+    tmp_dir = tempfile.mkdtemp(prefix="bench_startup-")
+    const.STORE_DIR = os.path.join(tmp_dir, "store")
+    const.SPOOL_DIR = os.path.join(tmp_dir, "spool")
+    const.METRICS_HTTP_PORT = None
+    const.RADIOS = tuple(
+        dict(channel=i, cs="CE1", reset="D25", frequency=915.0 + 0.2 * i)
+        for i in range(args.radios)
+    )
+    gateway.logger = log.getLogger()
+    try:
+        result = asyncio.run(run_child(args, gateway, basic_receive, startup))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--radios", type=int, default=2)
+    parser.add_argument("--radio-init", type=float, default=0.05, help="[s]")
+    parser.add_argument("--display-init", type=float, default=0.1, help="[s]")
+    parser.add_argument("--timeout", type=float, default=10, help="[s]")
+    parser.add_argument("--top", type=int, default=8, help="slowest imports listed")
+    parser.add_argument("--child", choices=("lazy", "eager"), help=argparse.SUPPRESS)
+    parser.add_argument("-o", "--output", help="save the results in this JSON file")
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return
+
+    results = {"args": vars(args)}
+    for mode in ("eager", "lazy"):
+        argv = [a for a in sys.argv[1:] if a not in ("-o", "--output", args.output)]
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-m", __spec__.name]
+            + argv
+            + ["--child", mode],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        results[mode] = json.loads(proc.stdout.splitlines()[-1])
+        results[mode]["imports"] = parse_importtime(proc.stderr, args.top)
+    del results["args"]["child"]
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
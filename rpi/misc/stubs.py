@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Stand-ins for the gateway hardware and MQTT client libraries, so that
+rpi.basic_receive and rpi.main import and run on any host.
+
+install() puts board, busio, digitalio, adafruit_ssd1306, adafruit_rfm9x
+and asyncio_mqtt modules in sys.modules. adafruit_rfm9x.RFM9x() returns
+the radio handed to install(), or the next one if it is handed a list of
+them (one per entry of RADIOS in rpi_const.py), and asyncio_mqtt.Client talks to the
+StubBroker handed to it.
+"""
+
+import asyncio
+import contextlib
+import itertools
+import sys
+import time
+import types
+
+MODULES = (
+    "board",
+    "busio",
+    "digitalio",
+    "adafruit_ssd1306",
+    "adafruit_rfm9x",
+    "asyncio_mqtt",
+)
+
+
+class StubI2CDevice:
+    def __init__(self):
+        self.bytes_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def write(self, buf):
+        self.bytes_written += len(buf)
+
+
+class StubDisplay:
+    def __init__(self, width=128, height=32, *args, **kwargs):
+        self.width = width
+        self.height = height
+        self.i2c_device = StubI2CDevice()
+
+    def write_cmd(self, cmd):
+        pass
+
+    def invert(self, invert):
+        pass
+
+    def fill(self, color):
+        pass
+
+    def show(self):
+        pass
+
+
+class StubRadio:
+    """Never receives anything."""
+
+    def __init__(self):
+        self.receive_timeout = 0.5
+        self.last_rssi = 0
+
+    def receive(self, with_header=False, timeout=None):
+        time.sleep(self.receive_timeout if timeout is None else timeout)
+
+    def send(self, data, **kwargs):
+        return True
+
+
+class StubMessage:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class StubBroker:
+    """Acknowledges every publish after rtt seconds and keeps count of them.
+
+    on_publish(topic, payload) is called as each publish is acknowledged. Messages
+    for the gateway's subscriptions go in with deliver().
+
+    outages are (start, end) seconds from when the broker was made, during
+    which it is unreachable: connecting and publishing raise MqttError, and
+    so does a connection that was up, like after a missed keepalive.
+    """
+
+    def __init__(self, rtt=0.005, on_publish=None, outages=()):
+        self.rtt = rtt
+        self.on_publish = on_publish
+        self.outages = outages
+        self.started = time.monotonic()
+        self.failures = 0
+        self.connects = 0
+        self.published = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.subscriptions = []
+        self.incoming = None
+
+    def down(self):
+        now = time.monotonic() - self.started
+        return any(start <= now < end for start, end in self.outages)
+
+    def check(self):
+        if self.down():
+            self.failures += 1
+            raise MqttError("broker unreachable")
+
+    def deliver(self, topic, payload):
+        self._incoming().put_nowait(StubMessage(topic, payload.encode()))
+
+    def _incoming(self):
+        if self.incoming is None:
+            self.incoming = asyncio.Queue()
+        return self.incoming
+
+    async def publish(self, topic, payload, qos=0, retain=False, timeout=None):
+        self.check()
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.rtt)
+        finally:
+            self.in_flight -= 1
+        # lost if the broker went away before acknowledging it
+        self.check()
+        if self.on_publish:
+            self.on_publish(topic, payload)
+        self.published += 1
+
+
+class MqttError(Exception):
+    pass
+
+
+def _client_class(broker):
+    class Client:
+        def __init__(self, hostname, **kwargs):
+            self.broker = broker
+
+        async def __aenter__(self):
+            self.broker.check()
+            self.broker.connects += 1
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        @contextlib.asynccontextmanager
+        async def messages(self):
+            yield self._messages()
+
+        async def _messages(self):
+            incoming = self.broker._incoming()
+            while True:
+                try:
+                    yield await asyncio.wait_for(incoming.get(), 0.1)
+                except asyncio.TimeoutError:
+                    self.broker.check()
+
+        async def subscribe(self, topic, qos=0):
+            self.broker.subscriptions.append(topic)
+
+        async def publish(self, topic, payload=None, qos=0, retain=False, timeout=10):
+            await self.broker.publish(topic, payload, qos=qos, retain=retain)
+
+    return Client
+
+
+def install(radio=None, broker=None, radio_init=0, display_init=0):
+    """Puts the stub modules in sys.modules, before rpi.main is imported.
+
+    Opening a radio takes radio_init seconds and the display display_init,
+    like the reset and configuration of the real ones.
+    """
+
+    def module(name, **attrs):
+        m = types.ModuleType(name)
+        m.__dict__.update(attrs)
+        return m
+
+    def open_radio(*args, **kwargs):
+        time.sleep(radio_init)
+        return next(radios)
+
+    def open_display(*args, **kwargs):
+        time.sleep(display_init)
+        return StubDisplay(*args, **kwargs)
+
+    radio = radio or StubRadio()
+    radios = iter(radio if isinstance(radio, list) else itertools.repeat(radio))
+    broker = broker or StubBroker()
+    stub = type("Stub", (), {"__init__": lambda self, *args, **kwargs: None})
+    sys.modules.update(
+        {
+            # any board.X is a pin, named X
+            "board": module("board", __getattr__=lambda name: name),
+            "busio": module("busio", I2C=stub, SPI=stub),
+            "digitalio": module(
+                "digitalio", DigitalInOut=stub, Direction=stub, Pull=stub
+            ),
+            "adafruit_ssd1306": module("adafruit_ssd1306", SSD1306_I2C=open_display),
+            "adafruit_rfm9x": module("adafruit_rfm9x", RFM9x=open_radio),
+            "asyncio_mqtt": module(
+                "asyncio_mqtt", Client=_client_class(broker), MqttError=MqttError
+            ),
+        }
+    )
+    return radio, broker
@@ -1,30 +1,208 @@
 import asyncio
+import time
+from collections import OrderedDict
 
-import log
+from rpi import log
+from rpi import rpi_const as const
 from rpi.events import MqttMsgEvent
+from rpi.metrics import registry
 
 logger = log.getLogger()
 
+DROP_OLDEST = "oldest"
+DROP_NEWEST = "newest"
+DROP_BLOCK = "block"
 
-async def handle_mqtt_publish(client, mqtt_send_q: asyncio.Queue):
+published = registry.counter("loraben_mqtt_published_total", "MQTT messages published")
+publish_failures = registry.counter(
+    "loraben_mqtt_publish_failures_total", "MQTT publishes that failed"
+)
+publish_seconds = registry.histogram(
+    "loraben_mqtt_publish_seconds",
+    "Time for the broker to acknowledge a publish",
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 15),
+)
+
+
+class MqttSendQueue:
+    """Outgoing messages, coalesced per topic.
+
+    While a message waits to be published, a newer message for the same
+    topic replaces its payload in place (latest value wins). When maxsize
+    topics are pending, drop_policy decides what happens to a new one:
+    DROP_OLDEST evicts the oldest pending message, DROP_NEWEST discards the
+    new message and DROP_BLOCK makes put() wait for room.
+    """
+
+    def __init__(self, maxsize=256, drop_policy=DROP_OLDEST):
+        self.maxsize = maxsize
+        self.drop_policy = drop_policy
+        self.pending = OrderedDict()
+        self.coalesced = 0
+        self.dropped = 0
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+
+    def qsize(self):
+        return len(self.pending)
+
+    def put_nowait(self, mqtt_msg):
+        if mqtt_msg.topic in self.pending:
+            self.pending[mqtt_msg.topic] = mqtt_msg
+            self.coalesced += 1
+            return True
+        if len(self.pending) >= self.maxsize:
+            if self.drop_policy != DROP_OLDEST:
+                self.dropped += 1
+                return False
+            self.pending.popitem(last=False)
+            self.dropped += 1
+        self.pending[mqtt_msg.topic] = mqtt_msg
+        self._not_empty.set()
+        if len(self.pending) >= self.maxsize:
+            self._not_full.clear()
+        return True
+
+    async def put(self, mqtt_msg):
+        if self.drop_policy == DROP_BLOCK:
+            while (
+                len(self.pending) >= self.maxsize and mqtt_msg.topic not in self.pending
+            ):
+                await self._not_full.wait()
+        return self.put_nowait(mqtt_msg)
+
+    async def get(self):
+        while not self.pending:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        _topic, mqtt_msg = self.pending.popitem(last=False)
+        self._not_full.set()
+        return mqtt_msg
+
+    def task_done(self):
+        pass
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+async def _publish(client, mqtt_msg, in_flight: asyncio.Semaphore):
+    topic, payload = mqtt_msg.topic, mqtt_msg.payload
+    start = time.monotonic()
+    try:
+        await client.publish(
+            topic, payload, qos=const.MQTT_QOS, retain=mqtt_msg.retain, timeout=15
+        )
+        publish_seconds.observe(time.monotonic() - start)
+        published.inc()
+        logger.debug("Published: %s %s", topic, payload)
+    except Exception as e:
+        publish_failures.inc()
+        logger.error("client failed publish mqtt %s %s : %s", topic, payload, e)
+    finally:
+        in_flight.release()
+
+
+async def handle_mqtt_publish(client, mqtt_send_q: MqttSendQueue):
+    # Publishes are rate limited by a token bucket, as a fail-safe in case there
+    # is a bug lurking somewhere, and up to MQTT_MAX_IN_FLIGHT of them can be
+    # waiting on the broker at once.
+    bucket = TokenBucket(const.MQTT_PUBLISH_RATE, const.MQTT_PUBLISH_BURST)
+    in_flight = asyncio.Semaphore(const.MQTT_MAX_IN_FLIGHT)
+    tasks = set()
+    try:
+        while True:
+            mqtt_msg = await mqtt_send_q.get()
+            await bucket.acquire()
+            await in_flight.acquire()
+            task = asyncio.create_task(_publish(client, mqtt_msg, in_flight))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            mqtt_send_q.task_done()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _ack_in_order(spool, publishes: asyncio.Queue, in_flight):
     while True:
-        mqtt_msg = await mqtt_send_q.get()
-        topic, payload = mqtt_msg.topic, mqtt_msg.payload
-        # logger.debug(f"Publishing: {topic} {payload}")
+        task = await publishes.get()
         try:
-            await client.publish(topic, payload, timeout=15)
-            logger.debug(f"Published: {topic} {payload}")
-        except Exception as e:
-            logger.error("client failed publish mqtt %s %s : %s", topic, payload, e)
-        mqtt_send_q.task_done()
-        # Dampen publishes. This is a fail-safe and should not affect anything unless
-        # there is a bug lurking somewhere
-        await asyncio.sleep(1)
+            await task
+        finally:
+            in_flight.release()
+        spool.ack()
+
+
+async def _publish_spooled(client, mqtt_msg):
+    topic, payload = mqtt_msg.topic, mqtt_msg.payload
+    start = time.monotonic()
+    try:
+        await client.publish(
+            topic, payload, qos=const.MQTT_QOS, retain=mqtt_msg.retain, timeout=15
+        )
+    except Exception:
+        publish_failures.inc()
+        raise
+    publish_seconds.observe(time.monotonic() - start)
+    published.inc()
+    logger.debug("Published: %s %s", topic, payload)
+
+
+async def _publish_spool(client, spool, publishes: asyncio.Queue, in_flight):
+    replay = TokenBucket(const.SPOOL_REPLAY_RATE, const.SPOOL_REPLAY_BURST)
+    bucket = TokenBucket(const.MQTT_PUBLISH_RATE, const.MQTT_PUBLISH_BURST)
+    while True:
+        mqtt_msg = await spool.get()
+        await (replay if spool.replaying() else bucket).acquire()
+        await in_flight.acquire()
+        await publishes.put(asyncio.create_task(_publish_spooled(client, mqtt_msg)))
+
+
+async def handle_spool_publish(client, spool):
+    # Up to MQTT_MAX_IN_FLIGHT publishes wait on the broker at once, like
+    # from the send queue, and the spool is acknowledged in the order they
+    # were sent. A failed publish ends the connection; everything after the
+    # last acknowledged message is replayed once it is back, at up to
+    # SPOOL_REPLAY_RATE until it caught up with what was spooled meanwhile.
+    spool.rewind()
+    in_flight = asyncio.Semaphore(const.MQTT_MAX_IN_FLIGHT)
+    publishes = asyncio.Queue()
+    tasks = [
+        asyncio.create_task(_publish_spool(client, spool, publishes, in_flight)),
+        asyncio.create_task(_ack_in_order(spool, publishes, in_flight)),
+    ]
+    try:
+        done, _pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        while not publishes.empty():
+            publishes.get_nowait().cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 
 async def handle_mqtt_messages(messages, main_events_q: asyncio.Queue):
     async for message in messages:
         msg_topic = f"{message.topic}"
         msg_payload = message.payload.decode()
-        logger.debug(f"Received mqtt topic:{msg_topic} payload:{msg_payload}")
+        logger.debug("Received mqtt topic:%s payload:%s", msg_topic, msg_payload)
         await main_events_q.put(MqttMsgEvent(topic=msg_topic, payload=msg_payload))
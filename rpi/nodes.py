@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+
+# Values that describe the gateway itself (e.g. its ip) are kept under this node
+GATEWAY_NODE = None
+
+
+class NodeTable:
+    """Latest values of every node, indexed by the node address in the header.
+
+    update() returns only what changed, so nothing else needs to be diffed.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+
+    def get(self, node):
+        return self.nodes.get(node, {})
+
+    def update(self, node, values):
+        curr_values = self.nodes.setdefault(node, {})
+        delta = {k: v for k, v in values.items() if curr_values.get(k) != v}
+        curr_values.update(delta)
+        return delta
+
+    def discard(self, node, key):
+        self.nodes.get(node, {}).pop(key, None)
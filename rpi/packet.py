@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+import struct
+from collections import namedtuple
+
+# RFM9x header: destination, node (source), identifier, flags
+HEADER_LEN = 4
+
+# age is how many seconds before the report was sent the reading was taken
+Reading = namedtuple("Reading", "age battery temperature distance")
+# readings are oldest first
+Report = namedtuple("Report", "seq readings")
+
+# See report.py on the sensor side for the layouts
+REPORT_V1 = 1
+BATCH_V2 = 2
+_REPORT_V1 = struct.Struct("<BBHhh")
+
+
+def decode_report(packet, offset=HEADER_LEN):
+    """Decode a report, binary, batch or legacy text, starting at offset."""
+    if len(packet) - offset == _REPORT_V1.size and packet[offset] == REPORT_V1:
+        _version, seq, battery, temperature, distance = _REPORT_V1.unpack_from(
+            packet, offset
+        )
+        return Report(seq, (Reading(0, battery / 10000, temperature / 10, distance),))
+    if len(packet) - offset > 3 and packet[offset] == BATCH_V2:
+        return decode_batch(packet, offset)
+    return decode_report_text(str(packet[offset:], "ascii"))
+
+
+def _varint(packet, offset):
+    value, shift = 0, 0
+    while True:
+        try:
+            byte = packet[offset]
+        except IndexError:
+            raise ValueError("truncated batch report") from None
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def _unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def decode_batch(packet, offset=HEADER_LEN):
+    seq, count = packet[offset + 1], packet[offset + 2]
+    offset += 3
+    readings = []
+    age = battery = temperature = distance = 0
+    for i in range(count):
+        d_age, offset = _varint(packet, offset)
+        d_battery, offset = _varint(packet, offset)
+        d_temperature, offset = _varint(packet, offset)
+        d_distance, offset = _varint(packet, offset)
+        if i == 0:
+            age, battery = d_age, d_battery
+            temperature, distance = _unzigzag(d_temperature), _unzigzag(d_distance)
+        else:
+            age -= d_age
+            battery += _unzigzag(d_battery)
+            temperature += _unzigzag(d_temperature)
+            distance += _unzigzag(d_distance)
+        readings.append(Reading(age, battery / 10000, temperature / 10, distance))
+    if offset != len(packet):
+        raise ValueError(f"{len(packet) - offset} extra bytes in batch report")
+    return Report(seq, tuple(readings))
+
+
+def decode_report_text(packet_text):
+    # example packet_text:  'id:227, batt:3.6472 v, temp:59.9 F, dist:183 mm'
+    values = {}
+    for value in packet_text.split(","):
+        kv = value.strip().split(":")
+        if len(kv) == 2:
+            values[kv[0]] = kv[1].split()[0]
+    try:
+        reading = Reading(
+            0, float(values["batt"]), float(values["temp"]), int(values["dist"])
+        )
+        return Report(int(values["id"]), (reading,))
+    except KeyError as e:
+        raise ValueError(f"missing {e} in {packet_text!r}") from e
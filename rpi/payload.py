@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+import json
+import struct
+from datetime import datetime
+
+FORMAT_JSON = "json"
+FORMAT_CBOR = "cbor"
+
+# Node values are kept as numbers. These are the units they are in, and
+# how they used to be published as text (e.g. "3.6472 v").
+UNITS = {"batt": "v", "temp": "F", "dist": "mm", "rssi": "dB", "len": "bytes"}
+
+
+def format_value(key, value):
+    """The value as text with its unit, as shown on the display and per-key topics."""
+    unit = UNITS.get(key)
+    if value is None:
+        value = "?"
+    elif key == "ts":
+        return datetime.fromtimestamp(value).strftime("%d/%m/%Y %H:%M:%S")
+    return f"{value} {unit}" if unit else f"{value}"
+
+
+def encode(values, payload_format=FORMAT_JSON):
+    if payload_format == FORMAT_CBOR:
+        out = bytearray()
+        _cbor(values, out)
+        return bytes(out)
+    return json.dumps(values, separators=(",", ":"))
+
+
+def _cbor_head(major, n, out):
+    if n < 24:
+        out.append(major << 5 | n)
+    elif n < 0x100:
+        out += bytes((major << 5 | 24, n))
+    elif n < 0x10000:
+        out.append(major << 5 | 25)
+        out += n.to_bytes(2, "big")
+    elif n < 0x100000000:
+        out.append(major << 5 | 26)
+        out += n.to_bytes(4, "big")
+    else:
+        out.append(major << 5 | 27)
+        out += n.to_bytes(8, "big")
+
+
+def _cbor(value, out):
+    # just the types node values have (RFC 8949)
+    if value is None:
+        out.append(0xF6)
+    elif value is True:
+        out.append(0xF5)
+    elif value is False:
+        out.append(0xF4)
+    elif isinstance(value, int):
+        if value >= 0:
+            _cbor_head(0, value, out)
+        else:
+            _cbor_head(1, -1 - value, out)
+    elif isinstance(value, float):
+        out.append(0xFB)
+        out += struct.pack(">d", value)
+    elif isinstance(value, str):
+        data = value.encode()
+        _cbor_head(3, len(data), out)
+        out += data
+    elif isinstance(value, (bytes, bytearray)):
+        _cbor_head(2, len(value), out)
+        out += value
+    elif isinstance(value, (list, tuple)):
+        _cbor_head(4, len(value), out)
+        for item in value:
+            _cbor(item, out)
+    elif isinstance(value, dict):
+        _cbor_head(5, len(value), out)
+        for k, v in value.items():
+            _cbor(k, out)
+            _cbor(v, out)
+    else:
+        raise TypeError(f"can not encode {type(value).__name__} as CBOR")
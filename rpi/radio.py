@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+import asyncio
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from rpi import log
+
+logger = log.getLogger()
+
+# channel is the radio the frame came in on, snr is None for radios without it
+Frame = namedtuple("Frame", "packet rssi ts channel snr", defaults=(0, None))
+
+
+class RadioReader(threading.Thread):
+    """Polls the radio from its own thread and hands frames to the event loop.
+
+    rfm9x.receive() blocks for up to timeout seconds, so it must not run in
+    a coroutine. Frames go into frames_q (a bounded asyncio.Queue) through
+    loop.call_soon_threadsafe. When the queue is full the frame is dropped
+    and counted in overflows.
+
+    ack(frame), if given, returns the ACK to send back to the sensor of a
+    frame, or None. It is sent from this thread right away, while the
+    sensor listens for it.
+
+    An exception from the radio (an SPI error, say) is logged and counted in
+    errors, and the radio is read again after a backoff that doubles, from
+    retry_delay up to max_retry_delay seconds, while the errors go on.
+    """
+
+    def __init__(
+        self,
+        radio,
+        loop,
+        frames_q: asyncio.Queue,
+        timeout=2.0,
+        channel=0,
+        ack=None,
+        retry_delay=0.5,
+        max_retry_delay=30.0,
+    ):
+        super().__init__(name=f"radio-reader-{channel}", daemon=True)
+        self.radio = radio
+        self.channel = channel
+        self.radio.receive_timeout = timeout
+        self.loop = loop
+        self.frames_q = frames_q
+        self.ack = ack
+        self.received = 0
+        self.overflows = 0
+        self.acks = 0
+        self.ack_failures = 0
+        self.errors = 0
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._stopping = threading.Event()
+
+    def stop(self, timeout=None):
+        """Stops the thread, waiting up to timeout seconds (by default a bit
+        more than a receive) for it to finish. Returns True once it has."""
+        self._stopping.set()
+        if not self.is_alive() or threading.current_thread() is self:
+            return not self.is_alive()
+        self.join(self.timeout + 1.0 if timeout is None else timeout)
+        return not self.is_alive()
+
+    def run(self):
+        delay = self.retry_delay
+        while not self._stopping.is_set():
+            try:
+                packet = self.radio.receive(with_header=True)
+            except Exception as e:
+                self.errors += 1
+                logger.error(
+                    "radio %s receive failed, retrying in %.1fs: %r",
+                    self.channel,
+                    delay,
+                    e,
+                )
+                self._stopping.wait(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+                continue
+            delay = self.retry_delay
+            if packet is None:
+                continue
+            self.received += 1
+            frame = Frame(
+                packet,
+                self.radio.last_rssi,
+                time.time(),
+                self.channel,
+                getattr(self.radio, "last_snr", None),
+            )
+            if self.ack:
+                self._send_ack(frame)
+            try:
+                self.loop.call_soon_threadsafe(self._enqueue, frame)
+            except RuntimeError:
+                # event loop is closed
+                break
+
+    def _send_ack(self, frame):
+        try:
+            data = self.ack(frame)
+            if data is None:
+                return
+            if self.radio.send(data, destination=frame.packet[1]):
+                self.acks += 1
+            else:
+                self.ack_failures += 1
+        except Exception:
+            self.ack_failures += 1
+
+    def _enqueue(self, frame):
+        try:
+            self.frames_q.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.overflows += 1
+
+
+class RadioGroup:
+    """Reads several radios in parallel, each on its own channel.
+
+    radios are (channel, radio) pairs, where a radio is anything that
+    receives like rfm9x.receive(). Each one gets a RadioReader, and all
+    of them put their frames, tagged with the channel, in the same frames_q.
+
+    A frame heard on several channels is only acknowledged by the first
+    radio that hears it: the others find it in acked, a ChannelDedup of
+    ack_window seconds shared by the radio threads.
+    """
+
+    def __init__(
+        self,
+        radios,
+        loop,
+        frames_q: asyncio.Queue,
+        timeout=2.0,
+        ack=None,
+        ack_window=0.5,
+    ):
+        self.frames_q = frames_q
+        self.ack = ack
+        self.acked = ChannelDedup(window=ack_window)
+        self._ack_lock = threading.Lock()
+        self.readers = [
+            RadioReader(radio, loop, frames_q, timeout, channel, ack and self._ack)
+            for channel, radio in radios
+        ]
+
+    def _ack(self, frame):
+        with self._ack_lock:
+            if self.acked.seen(frame):
+                return None
+        return self.ack(frame)
+
+    @property
+    def received(self):
+        return sum(reader.received for reader in self.readers)
+
+    @property
+    def overflows(self):
+        return sum(reader.overflows for reader in self.readers)
+
+    @property
+    def acks(self):
+        return sum(reader.acks for reader in self.readers)
+
+    @property
+    def ack_failures(self):
+        return sum(reader.ack_failures for reader in self.readers)
+
+    @property
+    def errors(self):
+        return sum(reader.errors for reader in self.readers)
+
+    def start(self):
+        for reader in self.readers:
+            reader.start()
+
+    def stop(self, timeout=None):
+        """Stops all the readers; returns True once all of them finished."""
+        for reader in self.readers:
+            reader._stopping.set()
+        return all([reader.stop(timeout) for reader in self.readers])
+
+
+class ChannelDedup:
+    """Recognizes a frame that was already received on another channel.
+
+    Radios on neighbouring frequencies or spreading factors can all
+    demodulate a strong transmission. The copies have the same bytes and
+    arrive within window seconds of each other; only the first one counts.
+    """
+
+    def __init__(self, window=0.5, max_frames=256):
+        self.window = window
+        self.max_frames = max_frames
+        self.frames = OrderedDict()
+        self.hits = 0
+
+    def seen(self, frame):
+        """Returns True when frame is a copy of one from another channel."""
+        while self.frames:
+            ts, _channel = next(iter(self.frames.values()))
+            if frame.ts - ts < self.window and len(self.frames) < self.max_frames:
+                break
+            self.frames.popitem(last=False)
+        key = bytes(frame.packet)
+        earlier = self.frames.get(key)
+        if earlier and earlier[1] != frame.channel:
+            self.hits += 1
+            return True
+        self.frames.pop(key, None)
+        self.frames[key] = (frame.ts, frame.channel)
+        return False
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Replays the frames of capture files (see CAPTURE_DIR in rpi_const.py), with
+no radio attached.
+
+Frames go through what the gateway does with frames off the radio: channel
+dedup, decode, dedup of the copies, the node table and the messages
+published for every change, which are printed (--print) or published to the
+broker of rpi_const.py (--publish). Dedup runs on the time of the frames, so
+the result is the same at full speed (the default) or at --speed times real
+time (1 for real time). --store adds the readings to a store directory.
+
+--backfill DIR only adds the readings to the store in DIR, much faster than
+a full replay.
+
+Run from the top of the repo:  python3 -m rpi.replay CAPTURE... [options]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from asyncio_mqtt import Client
+
+from rpi import basic_receive, log
+from rpi import main as gateway
+from rpi import rpi_const as const
+from rpi.capture import read_frames
+from rpi.dedup import DedupCache
+from rpi.packet import HEADER_LEN, decode_report
+from rpi.radio import ChannelDedup
+from rpi.store import Store
+
+
+class PrintSink:
+    """Takes the messages of rpi.main.publish_values in place of a send queue."""
+
+    def __init__(self, show):
+        self.show = show
+        self.messages = 0
+
+    async def put(self, mqtt_msg):
+        self.messages += 1
+        if self.show:
+            payload = mqtt_msg.payload
+            if isinstance(payload, bytes):
+                payload = payload.hex()
+            print(f"{mqtt_msg.topic} {payload}")
+
+
+class BrokerSink(PrintSink):
+    def __init__(self, client, show):
+        super().__init__(show)
+        self.client = client
+
+    async def put(self, mqtt_msg):
+        await super().put(mqtt_msg)
+        await self.client.publish(
+            mqtt_msg.topic, mqtt_msg.payload, retain=mqtt_msg.retain
+        )
+
+
+async def replay(frames, sink, speed=0, quiet=True):
+    """Runs frames through the receive pipeline; returns how many there were."""
+    publisher = asyncio.create_task(gateway.monitor_latest_receive(sink))
+    # let it subscribe to the changes
+    await asyncio.sleep(0)
+    count, first_ts, start = 0, None, time.monotonic()
+    for frame in frames:
+        if first_ts is None:
+            first_ts = frame.ts
+        if speed:
+            delay = (frame.ts - first_ts) / speed - (time.monotonic() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        basic_receive.receive_frame(frame, quiet, frame.ts)
+        count += 1
+        # the publisher takes the changes of this frame
+        await asyncio.sleep(0)
+    publisher.cancel()
+    await asyncio.gather(publisher, return_exceptions=True)
+    return count
+
+
+def backfill(frames, store):
+    """Adds the readings of frames to store, with the dedup of the gateway.
+
+    Returns the number of frames and of frames that could not be decoded.
+    """
+    channel_dedup = ChannelDedup(window=const.RADIO_DEDUP_WINDOW)
+    dedup = DedupCache(window=const.DEDUP_WINDOW, hold=const.DEDUP_HOLD)
+    count = failures = 0
+    for frame in frames:
+        count += 1
+        if channel_dedup.seen(frame):
+            continue
+        try:
+            report = decode_report(frame.packet, HEADER_LEN)
+        except Exception:
+            failures += 1
+            continue
+        node = frame.packet[1]
+        entry = dedup.offer(
+            node, report.seq, report.readings, (report, frame), frame.ts
+        )
+        if entry:
+            for record in basic_receive.measurement_records(entry):
+                store.append(record)
+            if len(store.pending) >= store.batch:
+                store.flush()
+    store.flush()
+    return count, failures
+
+
+async def replay_main(args):
+    frames = read_frames(args.captures)
+    quiet = not args.verbose
+    flusher = None
+    if args.store:
+        const.STORE_DIR = args.store
+        basic_receive.open_store()
+        flusher = asyncio.create_task(basic_receive.flush_store())
+    sink = PrintSink(args.print)
+    try:
+        if args.publish:
+            client_id = const.MQTT_CLIENT_ID
+            if client_id:
+                client_id = f"{client_id}-replay"
+            async with Client(
+                const.MQTT_BROKER_IP,
+                username=const.MQTT_BROKER_USERNAME,
+                password=const.MQTT_BROKER_PASSWORD,
+                client_id=client_id,
+            ) as client:
+                sink = BrokerSink(client, args.print)
+                count = await replay(frames, sink, args.speed, quiet)
+        else:
+            count = await replay(frames, sink, args.speed, quiet)
+    finally:
+        if flusher:
+            flusher.cancel()
+            await asyncio.gather(flusher, return_exceptions=True)
+            basic_receive.store.close()
+    return count, sink.messages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("captures", nargs="+", help="capture files or directories")
+    parser.add_argument("--speed", type=float, default=0, help="0 for full speed")
+    parser.add_argument("--print", action="store_true", help="print the messages")
+    parser.add_argument("--publish", action="store_true", help="publish them too")
+    parser.add_argument("--store", help="add the readings to this store directory")
+    parser.add_argument("--backfill", metavar="DIR", help="only add them to DIR")
+    parser.add_argument("--verbose", action="store_true", help="print every frame")
+    args = parser.parse_args()
+
+    gateway.logger = log.getLogger()
+    start = time.monotonic()
+    if args.backfill:
+        store = Store(
+            args.backfill,
+            segment_records=const.STORE_SEGMENT_RECORDS,
+            max_segments=const.STORE_MAX_SEGMENTS,
+        )
+        try:
+            frames, failures = backfill(read_frames(args.captures), store)
+        finally:
+            store.close()
+        result = {"frames": frames, "parse_failures": failures}
+    else:
+        frames, messages = asyncio.run(replay_main(args))
+        result = {
+            "frames": frames,
+            "measurements": basic_receive.dedup.misses,
+            "duplicates": basic_receive.dedup.hits,
+            "messages": messages,
+            "change_events_dropped": basic_receive.node_changes.dropped,
+        }
+    result["seconds"] = round(time.monotonic() - start, 3)
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+from os import path
+
 MQTT_BROKER_IP = "192.168.10.238"  # set this!!!
 MQTT_CLIENT_ID = None
 MQTT_BROKER_USERNAME = None
@@ -5,15 +7,122 @@ MQTT_BROKER_PASSWORD = None
 MQTT_RECONNECT_INTERVAL = 13  # [seconds]
 LOG_TO_CONSOLE = False
 LOG_LEVEL_DEBUG = False
+# Log records go through a queue of LOG_QUEUE_SIZE to a thread that writes
+# them (dropped when it is full). Each line of code logs at most
+# LOG_RATE_LIMIT records a second, in bursts of LOG_RATE_BURST (None for no
+# limit). LOG_JSON writes one JSON object per record.
+LOG_QUEUE_SIZE = 1024
+LOG_RATE_LIMIT = 5  # [records per second]
+LOG_RATE_BURST = 20
+LOG_JSON = False
+
+# Outgoing MQTT messages are coalesced per topic and rate limited. When
+# MQTT_SEND_QUEUE_SIZE topics are pending, MQTT_DROP_POLICY is one of
+# "oldest", "newest" or "block" (see rpi/mqtt.py). Publishes are QoS 1, so
+# up to MQTT_MAX_IN_FLIGHT of them wait on an ack from the broker; 0 is fire
+# and forget, as publishes were before.
+MQTT_QOS = 1
+MQTT_PUBLISH_RATE = 20  # [messages per second]
+MQTT_PUBLISH_BURST = 40
+MQTT_MAX_IN_FLIGHT = 8
+MQTT_SEND_QUEUE_SIZE = 256
+MQTT_DROP_POLICY = "oldest"
+
+# Radio frames are read by a separate thread and queued for the event loop.
+# Frames that arrive while the queue is full are dropped (and counted).
+RADIO_RECEIVE_TIMEOUT = 2.0  # [seconds]
+RADIO_QUEUE_SIZE = 64
+
+# One entry per RFM9x module: the board pins of its chip select and reset,
+# its frequency [MHz] and spreading factor (6 to 12). Each one listens on its
+# own, and frames heard by more than one of them within RADIO_DEDUP_WINDOW are
+# only handled once. channel tells them apart in the logs and metrics.
+RADIOS = (
+    dict(channel=0, cs="CE1", reset="D25", frequency=915.0, spreading_factor=7),
+    # dict(channel=1, cs="CE0", reset="D17", frequency=915.2, spreading_factor=7),
+)
+RADIO_DEDUP_WINDOW = 0.5  # [seconds]
+
+# Every frame with a report is acknowledged right away, with the spreading
+# factor (out of those RADIOS listen on at its frequency) and transmit power
+# the sensor should use next: the lowest that leave ADR_MARGIN dB of SNR to
+# spare at the best of its last ADR_HISTORY frames (see rpi/link.py).
+ACK_ENABLED = True
+ADR_MARGIN = 10  # [dB]
+ADR_HISTORY = 8
+
+# Sensor readings to publish are spooled on disk, so that none are lost
+# while the broker is unreachable, in up to SPOOL_MAX_SEGMENTS files of
+# SPOOL_SEGMENT_BYTES. They are written every SPOOL_COMMIT_INTERVAL and
+# published in order, like the send queue (MQTT_PUBLISH_RATE and
+# MQTT_MAX_IN_FLIGHT), but at up to SPOOL_REPLAY_RATE while catching up on
+# what was spooled while the broker was away.
+# Set SPOOL_DIR to None to publish them straight from the send queue.
+SPOOL_DIR = path.expanduser("~/.loraben/spool")
+SPOOL_SEGMENT_BYTES = 1 << 20
+SPOOL_MAX_SEGMENTS = 16
+SPOOL_COMMIT_INTERVAL = 0.2  # [seconds]
+SPOOL_REPLAY_RATE = 10  # [messages per second]
+SPOOL_REPLAY_BURST = 20
+
+DISPLAY_MAX_FPS = 4
+
+# Metrics are served in the Prometheus text format on
+# http://<gateway>:METRICS_HTTP_PORT/metrics (None disables it) and published
+# to TOPIC_PREFIX + TOPIC_STATS every METRICS_PUBLISH_INTERVAL seconds.
+METRICS_HTTP_ADDR = "0.0.0.0"
+METRICS_HTTP_PORT = 9101
+METRICS_PUBLISH_INTERVAL = 60  # [seconds]
+
+# Received readings are kept on disk, in STORE_MAX_SEGMENTS files of
+# STORE_SEGMENT_RECORDS readings (20 bytes each). Set STORE_DIR to None to
+# disable it.
+STORE_DIR = path.expanduser("~/.loraben/store")
+STORE_SEGMENT_RECORDS = 16384
+STORE_MAX_SEGMENTS = 32
+STORE_FLUSH_INTERVAL = 5.0  # [seconds]
+
+# Every frame received can be kept, raw, in CAPTURE_MAX_SEGMENTS files of
+# up to CAPTURE_SEGMENT_BYTES (14 bytes and the frame each), to look into
+# odd readings or replay them later with rpi/replay.py. Off with None.
+CAPTURE_DIR = None  # e.g. path.expanduser("~/.loraben/capture")
+CAPTURE_SEGMENT_BYTES = 1 << 22
+CAPTURE_MAX_SEGMENTS = 16
+CAPTURE_FLUSH_INTERVAL = 5.0  # [seconds]
+
+# Sensors send every report send_packets times (see const.py), using
+# consecutive ids, until one is acknowledged. A reading is published on its
+# first copy; copies within DEDUP_WINDOW ids and DEDUP_HOLD seconds of it
+# are dropped.
+DEDUP_WINDOW = 3
+DEDUP_HOLD = 4.0  # [seconds]
 
 TOPIC_PREFIX = "loraben/"
-TOPIC_PUB_MSG = f"{TOPIC_PREFIX}msg"
+# Sensor values are published under TOPIC_PREFIX<node>/, where node is the
+# address the sensor sends from (rfm9x.node)
+TOPIC_MSG = "msg"
+# All values of a node go to TOPIC_MSG in one message, as JSON or CBOR
+# ("json" or "cbor"), retained or not. MQTT_PER_KEY_TOPICS also publishes each
+# changed value to its own topic, as text with its unit (e.g. loraben/1/batt
+# "3.6472 v"), like before there was a single message.
+MQTT_PAYLOAD_FORMAT = "json"
+MQTT_RETAIN_MSG = False
+MQTT_PER_KEY_TOPICS = False
+TOPIC_STATS = "stats"
+# History queries go to TOPIC_PREFIX + TOPIC_HISTORY, as JSON:
+#   {"id": "q1", "node": 1, "start": <epoch>, "end": <epoch>, "bucket": 3600}
+# and are answered from the store under TOPIC_PREFIX + TOPIC_HISTORY/<id>/<page>
+# with min/max/mean per bucket, HISTORY_PAGE_ROWS buckets per message.
+TOPIC_HISTORY = "history"
+HISTORY_PAGE_ROWS = 200
+HISTORY_MAX_BUCKETS = 5000
 SUB_TOPICS = frozenset(
     [
         TOPIC_PREFIX + t
         for t in [
             "ping",
             "noop",
+            TOPIC_HISTORY,
         ]
     ]
 )
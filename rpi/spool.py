@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+import asyncio
+import os
+import struct
+import threading
+import zlib
+from collections import deque
+
+from rpi.events import MqttMsgEvent
+from rpi.writer import QueuedWriter
+
+# Each entry is the crc32 of the rest of it, a header and then the topic and
+# payload. Entries are only ever appended to a segment, a torn one at the end
+# (power cut mid-write) fails the crc and is cut off when the spool is opened.
+_CRC = struct.Struct("<I")
+_HEAD = struct.Struct("<IHB")
+_RETAIN = 0x01
+_BINARY = 0x02
+# segment and offset of the first entry not acknowledged yet
+_ACK = struct.Struct("<QQ")
+
+
+def _encode(mqtt_msg):
+    topic = mqtt_msg.topic.encode()
+    payload = mqtt_msg.payload
+    flags = _RETAIN if mqtt_msg.retain else 0
+    if isinstance(payload, str):
+        payload = payload.encode()
+    else:
+        flags |= _BINARY
+    body = _HEAD.pack(len(payload), len(topic), flags) + topic + payload
+    return _CRC.pack(zlib.crc32(body)) + body
+
+
+def _decode(buf, offset):
+    """Returns (message, offset of the next entry), or None if there is no
+    complete, intact entry at offset."""
+    start = offset + _CRC.size + _HEAD.size
+    if start > len(buf):
+        return None
+    (crc,) = _CRC.unpack_from(buf, offset)
+    length, topic_length, flags = _HEAD.unpack_from(buf, offset + _CRC.size)
+    end = start + topic_length + length
+    if end > len(buf) or zlib.crc32(buf[offset + _CRC.size : end]) != crc:
+        return None
+    topic = bytes(buf[start : start + topic_length]).decode()
+    payload = bytes(buf[start + topic_length : end])
+    if not flags & _BINARY:
+        payload = payload.decode()
+    return MqttMsgEvent(topic, payload, bool(flags & _RETAIN)), end
+
+
+class Spool(QueuedWriter):
+    """Outgoing messages, kept on disk until the broker has acknowledged them.
+
+    Messages are appended in order to segment files of up to segment_bytes.
+    put() only queues a message; flusher() (see QueuedWriter) appends the
+    queued ones with a single write and fsync (group commit). Only committed
+    messages are handed out by get().
+
+    Positions in the spool are (segment, offset). ack() moves the
+    acknowledged position past the oldest message handed out and not
+    acknowledged yet, and rewind() (after losing the broker) hands out
+    everything after it again, so delivery is at least once and in order.
+    The acknowledged position is saved with each commit. Segments behind it
+    are deleted, and when there are more than max_segments the oldest ones
+    are deleted anyway, with whatever was not delivered from them, which
+    bounds the disk footprint during a long outage.
+    """
+
+    def __init__(
+        self,
+        directory,
+        segment_bytes=1 << 20,
+        max_segments=16,
+        batch=64,
+        read_bytes=1 << 14,
+    ):
+        self.directory = directory
+        self.read_bytes = read_bytes
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        super().__init__(batch)
+        self.dropped_segments = 0
+        self._lock = threading.Lock()
+        self._committed = asyncio.Event()
+        os.makedirs(directory, exist_ok=True)
+        self.segments = sorted(
+            int(f[6:-4])
+            for f in os.listdir(directory)
+            if f.startswith("spool-") and f.endswith(".log")
+        )
+        if not self.segments:
+            self.segments = [0]
+        self.sizes = {}
+        for number in self.segments:
+            self.sizes[number] = self._recover(number)
+        self._file = open(self._filename(self.segments[-1]), "ab")
+        last = self.segments[-1]
+        self.end = (last, self.sizes[last])
+        self.acked = self._clamp(self._load_ack())
+        self._ack_dirty = False
+        self.read_pos = self.acked
+        # what was committed when the broker was last lost, see replaying()
+        self.replay_end = self.end
+        # positions after the messages handed out and not acknowledged yet
+        self.handed = deque()
+        self.ready = deque()
+
+    def _filename(self, number):
+        return os.path.join(self.directory, f"spool-{number:010d}.log")
+
+    def _recover(self, number):
+        """Cuts the segment after its last intact entry, returns its size."""
+        filename = self._filename(number)
+        try:
+            with open(filename, "rb") as f:
+                buf = f.read()
+        except FileNotFoundError:
+            buf = b""
+        offset = 0
+        while offset < len(buf):
+            entry = _decode(buf, offset)
+            if entry is None:
+                break
+            offset = entry[1]
+        if offset < len(buf) or not os.path.exists(filename):
+            with open(filename, "ab") as f:
+                f.truncate(offset)
+        return offset
+
+    def _load_ack(self):
+        try:
+            with open(os.path.join(self.directory, "ack"), "rb") as f:
+                return _ACK.unpack(f.read(_ACK.size))
+        except (FileNotFoundError, struct.error):
+            return self.segments[0], 0
+
+    def _save_ack(self, acked):
+        filename = os.path.join(self.directory, "ack")
+        with open(filename + ".tmp", "wb") as f:
+            f.write(_ACK.pack(*acked))
+        os.replace(filename + ".tmp", filename)
+
+    def _clamp(self, position):
+        # a position in a deleted segment is the start of the oldest one left
+        if position[0] < self.segments[0]:
+            return self.segments[0], 0
+        return min(position, self.end)
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def backlog_bytes(self):
+        """Bytes of committed messages not acknowledged yet."""
+        segment, offset = self._clamp(self.acked)
+        sizes = list(self.sizes.items())
+        return sum(size for number, size in sizes if number >= segment) - offset
+
+    async def put(self, mqtt_msg):
+        self._queue(_encode(mqtt_msg))
+        return True
+
+    def _due(self):
+        # the acknowledged position is saved with each commit
+        return super()._due() or self._ack_dirty
+
+    def _written(self):
+        self._committed.set()
+
+    def _write(self, entries):
+        acked, self._ack_dirty = self.acked, False
+        with self._lock:
+            for entry in entries:
+                last = self.segments[-1]
+                if (
+                    self.sizes[last]
+                    and self.sizes[last] + len(entry) > self.segment_bytes
+                ):
+                    self._rotate()
+                    last = self.segments[-1]
+                self._file.write(entry)
+                self.sizes[last] += len(entry)
+            if entries:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self.end = (self.segments[-1], self.sizes[self.segments[-1]])
+            # delivered segments are not needed any more
+            while len(self.segments) > 1 and self.segments[0] < acked[0]:
+                self._remove_oldest()
+            self._save_ack(self._clamp(acked))
+
+    def _rotate(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        number = self.segments[-1] + 1
+        self.segments.append(number)
+        self.sizes[number] = 0
+        self._file = open(self._filename(number), "ab")
+        while len(self.segments) > self.max_segments:
+            self._remove_oldest()
+            self.dropped_segments += 1
+
+    def _remove_oldest(self):
+        number = self.segments.pop(0)
+        del self.sizes[number]
+        os.remove(self._filename(number))
+
+    def _read(self, position, max_entries):
+        """Committed messages from position on, with the position after each."""
+        entries = []
+        with self._lock:
+            segment, offset = self._clamp(position)
+            while len(entries) < max_entries and (segment, offset) < self.end:
+                size = self.sizes[segment]
+                if offset >= size:
+                    segment = self.segments[self.segments.index(segment) + 1]
+                    offset = 0
+                    continue
+                with open(self._filename(segment), "rb") as f:
+                    f.seek(offset)
+                    # only as much of the segment as the entries need
+                    buf = f.read(min(self.read_bytes, size - offset))
+                    pos = 0
+                    while len(entries) < max_entries:
+                        entry = _decode(buf, pos)
+                        if entry is None:
+                            read_to = offset + len(buf)
+                            if read_to >= size:
+                                break
+                            # an entry goes on past what was read
+                            buf = buf[pos:] + f.read(
+                                min(self.read_bytes, size - read_to)
+                            )
+                            offset += pos
+                            pos = 0
+                            continue
+                        mqtt_msg, pos = entry
+                        entries.append((mqtt_msg, (segment, offset + pos)))
+                # the rest of a segment that does not decode is skipped
+                offset = size if entry is None else offset + pos
+        return entries
+
+    async def get(self):
+        while not self.ready:
+            if self.read_pos < self.end:
+                entries = await asyncio.get_running_loop().run_in_executor(
+                    None, self._read, self.read_pos, self.batch
+                )
+                if entries:
+                    self.ready.extend(entries)
+                    self.read_pos = entries[-1][1]
+                else:
+                    self.read_pos = self.end
+                continue
+            self._committed.clear()
+            if self.read_pos >= self.end:
+                await self._committed.wait()
+        mqtt_msg, position = self.ready.popleft()
+        self.handed.append(position)
+        return mqtt_msg
+
+    def ack(self):
+        """The oldest message handed out by get() has been delivered."""
+        self.acked = self.handed.popleft()
+        self._ack_dirty = True
+
+    def rewind(self):
+        """Hands out everything not acknowledged again, from the oldest on.
+
+        Must not be called while a get() is waiting.
+        """
+        self.ready.clear()
+        self.handed.clear()
+        self.read_pos = self._clamp(self.acked)
+        self.replay_end = self.end
+
+    def replaying(self):
+        """True while the messages handed out were committed before the last
+        rewind(), the backlog of an outage, rather than since."""
+        return bool(self.handed) and self.handed[-1] <= self.replay_end
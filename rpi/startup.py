@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+import contextlib
+import time
+
+from rpi import log
+from rpi.metrics import registry
+
+# Time the gateway takes to start, by step: the imports of rpi.main, and the
+# peripherals, which are opened when first used rather than at import. Steps
+# can run at the same time (the radios open in a thread while the broker is
+# connected to), so each is timed on its own.
+started = time.monotonic()
+steps = {}
+
+startup_seconds = registry.gauge(
+    "loraben_startup_seconds", "Time taken by each step of the start", ("step",)
+)
+
+
+def record(step, seconds):
+    steps[step] = seconds
+    startup_seconds.labels(step).set(seconds)
+    log.getLogger().info("startup %s: %.3f s", step, seconds)
+
+
+def since_start(step):
+    """Records step as the time from when this module was imported."""
+    record(step, time.monotonic() - started)
+
+
+@contextlib.contextmanager
+def step(name):
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        record(name, time.monotonic() - start)
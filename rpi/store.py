@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+import heapq
+import mmap
+import os
+import struct
+import threading
+from collections import namedtuple
+
+from rpi.writer import QueuedWriter
+
+Record = namedtuple("Record", "ts node seq battery temperature distance rssi")
+
+# Each segment file is a header followed by up to segment_records records.
+# Battery (100 uV) and temperature (0.1 F) are scaled like in the sensor report.
+_HEADER = struct.Struct("<4sHHI")
+_MAGIC = b"LBTS"
+_VERSION = 1
+_RECORD = struct.Struct("<dBBHhih")
+_TS = struct.Struct("<d12x")
+_TS_NODE = struct.Struct("<dB11x")
+# A full segment, which never changes again, gets an index file next to it
+# with the newest record of every node in it, so that Store.latest() does
+# not have to read the segment.
+_INDEX_MAGIC = b"LBTI"
+
+
+def _pack(record):
+    ts, node, seq, battery, temperature, distance, rssi = record
+    return _RECORD.pack(
+        ts,
+        node,
+        seq & 0xFF,
+        round(battery * 10000),
+        round(temperature * 10),
+        distance,
+        round(rssi),
+    )
+
+
+def _unpack(buf, offset):
+    ts, node, seq, battery, temperature, distance, rssi = _RECORD.unpack_from(
+        buf, offset
+    )
+    return Record(ts, node, seq, battery / 10000, temperature / 10, distance, rssi)
+
+
+class Segment:
+    def __init__(self, filename, records):
+        self.filename = filename
+        self.capacity = records
+        size = _HEADER.size + records * _RECORD.size
+        new = not os.path.exists(filename)
+        self.fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.mm = mmap.mmap(self.fd, size)
+        if new:
+            _HEADER.pack_into(self.mm, 0, _MAGIC, _VERSION, _RECORD.size, 0)
+        magic, version, record_size, self.count = _HEADER.unpack_from(self.mm, 0)
+        if (magic, version, record_size) != (_MAGIC, _VERSION, _RECORD.size):
+            raise ValueError(f"{filename} is not a version {_VERSION} segment")
+        self.index_filename = filename[:-4] + ".idx"
+        # the newest record of every node in this segment
+        self.latest = self._load_index() if self.full() else None
+        if self.latest is None:
+            self.latest = self._scan_latest()
+            if self.full():
+                self._save_index()
+
+    def close(self):
+        self.mm.close()
+        os.close(self.fd)
+
+    def remove(self):
+        self.close()
+        os.remove(self.filename)
+        if os.path.exists(self.index_filename):
+            os.remove(self.index_filename)
+
+    def _scan_latest(self):
+        # (ts, index) of the newest record of every node
+        newest = {}
+        with memoryview(self.mm) as mm:
+            records = mm[_HEADER.size : _HEADER.size + self.count * _RECORD.size]
+            for i, (ts, node) in enumerate(_TS_NODE.iter_unpack(records)):
+                if node not in newest or ts >= newest[node][0]:
+                    newest[node] = ts, i
+            records.release()
+        return {node: self.record(i) for node, (_ts, i) in newest.items()}
+
+    def _load_index(self):
+        try:
+            with open(self.index_filename, "rb") as f:
+                data = f.read()
+            magic, version, record_size, count = _HEADER.unpack_from(data, 0)
+            if (magic, version, record_size) != (_INDEX_MAGIC, _VERSION, _RECORD.size):
+                return None
+            records = [
+                _unpack(data, _HEADER.size + i * _RECORD.size) for i in range(count)
+            ]
+        except (OSError, struct.error):
+            return None
+        return {record.node: record for record in records}
+
+    def _save_index(self):
+        records = list(self.latest.values())
+        data = _HEADER.pack(_INDEX_MAGIC, _VERSION, _RECORD.size, len(records))
+        data += b"".join(_pack(record) for record in records)
+        tmp = self.index_filename + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self.index_filename)
+
+    def full(self):
+        return self.count >= self.capacity
+
+    def record(self, i):
+        return _unpack(self.mm, _HEADER.size + i * _RECORD.size)
+
+    def overlaps(self, start, end):
+        return self.count > 0 and self.ts(self.count - 1) >= start and self.ts(0) < end
+
+    def ts(self, i):
+        return struct.unpack_from("<d", self.mm, _HEADER.size + i * _RECORD.size)[0]
+
+    def append(self, records):
+        """Adds records, sorted by ts, keeping the segment in ts order.
+
+        Returns how many fit: the oldest ones, the others are for the next
+        segment.
+        """
+        n = min(len(records), self.capacity - self.count)
+        records = records[:n]
+        if not n:
+            return 0
+        start = self.count
+        if start and records[0].ts < self.ts(start - 1):
+            # older than the newest record here: rewrite the records from
+            # where the oldest new one goes, merged with the new ones
+            start = self.bisect_right(records[0].ts)
+        offset = _HEADER.size + start * _RECORD.size
+        end = _HEADER.size + self.count * _RECORD.size
+        entries = [(record.ts, _pack(record)) for record in records]
+        if start < self.count:
+            tail = bytes(self.mm[offset:end])
+            older = [
+                (ts, tail[i : i + _RECORD.size])
+                for i, (ts,) in zip(
+                    range(0, len(tail), _RECORD.size), _TS.iter_unpack(tail)
+                )
+            ]
+            entries = heapq.merge(older, entries, key=lambda entry: entry[0])
+        data = b"".join(entry for _ts, entry in entries)
+        # records are in place before the count that makes them visible; only
+        # a crash in the middle of a merge can lose records, the newest ones
+        self.mm[offset : offset + len(data)] = data
+        self.count += n
+        _HEADER.pack_into(self.mm, 0, _MAGIC, _VERSION, _RECORD.size, self.count)
+        self.mm.flush()
+        for record in records:
+            newest = self.latest.get(record.node)
+            if newest is None or record.ts >= newest.ts:
+                self.latest[record.node] = _unpack(_pack(record), 0)
+        if self.full():
+            self._save_index()
+        return n
+
+    def bisect(self, ts):
+        # index of the first record at or after ts
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ts(mid) < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def bisect_right(self, ts):
+        # index of the first record after ts
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ts(mid) <= ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+
+class Store(QueuedWriter):
+    """Append-only store of received readings, in fixed size record segments.
+
+    Segments are memory mapped files named after the sequence they were
+    created in. Only the newest max_segments are kept, which bounds the disk
+    footprint. The records of a segment are kept sorted by ts, so range
+    queries can binary search them. Readings are not received in time order
+    (dedup holds them for a while, and a batch report holds readings up to
+    an hour old), so a record older than the newest one of the last segment
+    is merged into place, and segments can overlap in time.
+
+    append() only queues a record for flusher(), see QueuedWriter.
+    """
+
+    def __init__(self, directory, segment_records=4096, max_segments=32, batch=64):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.max_segments = max_segments
+        super().__init__(batch)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.segments = [
+            Segment(os.path.join(directory, f), segment_records)
+            for f in sorted(os.listdir(directory))
+            if f.startswith("seg-") and f.endswith(".dat")
+        ]
+        if not self.segments:
+            self._rotate()
+
+    def close(self):
+        self.flush()
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
+
+    def _rotate(self):
+        number = 0
+        if self.segments:
+            number = int(os.path.basename(self.segments[-1].filename)[4:-4]) + 1
+        filename = os.path.join(self.directory, f"seg-{number:010d}.dat")
+        self.segments.append(Segment(filename, self.segment_records))
+        while len(self.segments) > self.max_segments:
+            self.segments.pop(0).remove()
+
+    def append(self, record):
+        self._queue(record)
+
+    def _write(self, records):
+        records = sorted(records, key=lambda record: record.ts)
+        with self._lock:
+            while records:
+                if self.segments[-1].full():
+                    self._rotate()
+                records = records[self.segments[-1].append(records) :]
+
+    def query(self, start, end, node=None):
+        """Returns the records with start <= ts < end, oldest first."""
+        found = []
+        with self._lock:
+            for segment in self.segments:
+                if not segment.overlaps(start, end):
+                    continue
+                records = []
+                for i in range(segment.bisect(start), segment.count):
+                    record = segment.record(i)
+                    if record.ts >= end:
+                        break
+                    if node is None or record.node == node:
+                        records.append(record)
+                found.append(records)
+        if len(found) == 1:
+            return found[0]
+        return list(heapq.merge(*found, key=lambda record: record.ts))
+
+    def downsample(self, start, end, bucket, node=None):
+        """Min, max and mean of the readings in each bucket seconds from start.
+
+        Returns (bucket start, count, battery, temperature, distance) for the
+        buckets with readings, oldest first. battery, temperature and distance
+        are (min, max, mean) in the scaled units they are stored in; distance
+        only counts valid (not negative) readings, and is None without any.
+        Records are unpacked straight from the mapped segments, without
+        building a Record for each.
+        """
+        # battery, temperature and distance columns of each bucket
+        buckets = {}
+        with self._lock:
+            for segment in self.segments:
+                if not segment.overlaps(start, end):
+                    continue
+                lo, hi = segment.bisect(start), segment.bisect(end)
+                offset = _HEADER.size + lo * _RECORD.size
+                with memoryview(segment.mm) as mm:
+                    records = mm[offset : offset + (hi - lo) * _RECORD.size]
+                    for ts, rnode, _seq, b, t, d, _rssi in _RECORD.iter_unpack(records):
+                        if node is None or rnode == node:
+                            key = (ts - start) // bucket
+                            columns = buckets.get(key)
+                            if columns is None:
+                                columns = buckets[key] = [], [], []
+                            columns[0].append(b)
+                            columns[1].append(t)
+                            columns[2].append(d)
+                    records.release()
+        result = []
+        for key, (battery, temperature, distance) in sorted(buckets.items()):
+            distance = [d for d in distance if d >= 0]
+            result.append(
+                (
+                    start + key * bucket,
+                    len(battery),
+                    _min_max_mean(battery),
+                    _min_max_mean(temperature),
+                    _min_max_mean(distance) if distance else None,
+                )
+            )
+        return result
+
+    def latest(self):
+        """Returns the newest record of every node."""
+        latest = {}
+        with self._lock:
+            for segment in self.segments:
+                for node, record in segment.latest.items():
+                    newest = latest.get(node)
+                    if newest is None or record.ts >= newest.ts:
+                        latest[node] = record
+        return latest
+
+
+def _min_max_mean(values):
+    return min(values), max(values), sum(values) / len(values)
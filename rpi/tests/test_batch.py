@@ -0,0 +1,80 @@
+import batch  # of the sensor
+import report
+from rpi.packet import HEADER_LEN, Reading, decode_batch, decode_report
+
+
+def new_buffer(size, offset=8):
+    memory = bytearray(offset + batch.buffer_len(size))
+    return memory, batch.ReadingBuffer(memory, offset, size)
+
+
+def test_oldest_reading_is_dropped_when_the_buffer_is_full():
+    _memory, buf = new_buffer(3)
+    for i in range(5):
+        buf.add(40000 + i, 700 + i, 1000 + i)
+        buf.advance(60)
+    assert buf.count == 3
+    assert buf.readings() == [
+        (180, 40002, 702, 1002),
+        (120, 40003, 703, 1003),
+        (60, 40004, 704, 1004),
+    ]
+
+
+def test_ages_follow_the_clock_across_sleep_cycles():
+    memory, buf = new_buffer(4)
+    buf.advance(100)  # nothing buffered: the clock stays put
+    for distance in (500, 510, 520):
+        buf.add(40000, 700, distance)
+        buf.save()
+        # deep sleep, then a new buffer on the same memory
+        buf.advance(299.6)
+        buf.save()
+        buf = batch.ReadingBuffer(memory, 8, 4)
+    assert buf.clock == 900
+    assert [r[0] for r in buf.readings()] == [900, 600, 300]
+
+    buf.flushed()
+    assert (buf.count, buf.last_distance) == (0, 520)
+    # the clock starts over with the next reading
+    buf.add(40000, 700, 530)
+    assert (buf.clock, buf.readings()[0][0]) == (0, 0)
+
+
+def test_should_flush_triggers():
+    _memory, buf = new_buffer(3)
+    assert not buf.should_flush(max_age=600, distance_threshold=50)
+    buf.reset(last_distance=500)
+    buf.add(40000, 700, 520)
+    assert not buf.should_flush(max_age=600, distance_threshold=50)
+    # the oldest reading is too old
+    buf.advance(600)
+    assert buf.should_flush(max_age=600, distance_threshold=50)
+    assert not buf.should_flush(max_age=601, distance_threshold=50)
+    # the distance moved from the last one sent
+    buf.add(40000, 700, 450)
+    assert buf.should_flush(max_age=601, distance_threshold=50)
+    assert not buf.should_flush(max_age=601, distance_threshold=51)
+    # the buffer is full
+    buf.add(40000, 700, 500)
+    assert buf.should_flush(max_age=601, distance_threshold=51)
+
+
+def test_batch_round_trip_with_negative_deltas():
+    readings = [
+        (3600, 41500, 25, 4200),
+        (2400, 41480, -12, -1),
+        (1200, 41490, -300, 380),
+        (600, 41000, 5, -1),
+        (0, 40990, 6, 290),
+    ]
+    payload = report.encode_batch(257, readings)
+    assert len(payload) <= 3 + len(readings) * report.BATCH_READING_MAX_LEN
+    packet = bytes(HEADER_LEN) + payload
+    decoded = decode_batch(packet)
+    assert decoded == decode_report(packet)
+    assert decoded.seq == 1
+    assert decoded.readings == tuple(
+        Reading(age, battery / 10000, temperature / 10, distance)
+        for age, battery, temperature, distance in readings
+    )
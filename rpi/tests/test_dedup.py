@@ -0,0 +1,80 @@
+from rpi.dedup import DedupCache
+
+
+def new(cache, node, seq, key, now, item=None):
+    return cache.offer(node, seq, key, item, now) is not None
+
+
+def test_interleaved_copies_of_several_nodes():
+    cache = DedupCache(window=3, hold=4.0)
+    frames = [
+        (1, 10, b"a"),
+        (2, 40, b"b"),
+        (1, 11, b"a"),
+        (3, 7, b"c"),
+        (2, 41, b"b"),
+        (1, 12, b"a"),
+        (3, 8, b"c"),
+        (2, 42, b"b"),
+    ]
+    released = [
+        cache.offer(node, seq, key, None, i * 0.25)
+        for i, (node, seq, key) in enumerate(frames)
+    ]
+    # each measurement on its first copy
+    assert [(e.node, e.seq) for e in released if e] == [(1, 10), (2, 40), (3, 7)]
+    assert [e is None for e in released] == [False, False, True] + [False] + [True] * 4
+    assert (cache.misses, cache.hits) == (3, 5)
+    # the copies are counted on the measurement
+    assert [e.copies for e in released if e] == [3, 3, 2]
+
+
+def test_same_payload_from_another_node_is_not_a_copy():
+    cache = DedupCache(window=3)
+    assert new(cache, 1, 5, b"x", 0)
+    assert new(cache, 2, 5, b"x", 0)
+
+
+def test_sequence_wraps_from_255_to_0():
+    cache = DedupCache(window=3, hold=4.0)
+    assert new(cache, 1, 254, b"a", 0)
+    assert not new(cache, 1, 255, b"a", 0.2)
+    assert not new(cache, 1, 0, b"a", 0.4)
+    # the next report of the node, also across the wrap
+    assert new(cache, 1, 1, b"a", 60)
+    assert not new(cache, 1, 2, b"a", 60.2)
+
+
+def test_sequence_outside_the_window_is_a_new_measurement():
+    cache = DedupCache(window=3)
+    assert new(cache, 1, 10, b"a", 0)
+    assert new(cache, 1, 13, b"a", 0.5)
+    # behind the first copy
+    assert new(cache, 1, 9, b"a", 0.6)
+
+
+def test_identical_payload_outside_the_hold_is_a_new_measurement():
+    cache = DedupCache(window=3, hold=4.0)
+    assert new(cache, 1, 10, b"a", 0)
+    assert not new(cache, 1, 11, b"a", 3.9)
+    assert new(cache, 1, 11, b"a", 4.0)
+
+
+def test_released_on_the_first_copy_without_waiting_for_the_hold():
+    cache = DedupCache(window=3, hold=4.0)
+    entry = cache.offer(1, 10, b"a", "item", 100)
+    assert (entry.item, entry.copies, entry.first_seen) == ("item", 1, 100)
+    # later copies are only counted
+    assert cache.offer(1, 11, b"a", "copy", 100.2) is None
+    assert entry.copies == 2 and entry.item == "item"
+    assert cache.last_copy is entry
+
+
+def test_node_depth_and_max_nodes_bound_the_cache():
+    cache = DedupCache(window=3, node_depth=2, max_nodes=2)
+    for seq in (10, 20, 30):
+        cache.offer(1, seq, seq, None, 0)
+    assert [e.seq for e in cache.nodes[1]] == [20, 30]
+    cache.offer(2, 0, b"", None, 0)
+    cache.offer(3, 0, b"", None, 0)
+    assert list(cache.nodes) == [2, 3]
@@ -0,0 +1,39 @@
+import report  # of the sensor
+from rpi import basic_receive
+from rpi.radio import Frame
+
+
+def test_change_events_keep_the_values_they_were_published_with():
+    changes_q = basic_receive.subscribe_changes()
+    try:
+        basic_receive.update_node(99, {"seq": 1, "temperature": 20.5})
+        basic_receive.update_node(99, {"seq": 2, "temperature": 21.0})
+        first, second = changes_q.get_nowait(), changes_q.get_nowait()
+    finally:
+        basic_receive.unsubscribe_changes(changes_q)
+        basic_receive.node_table.nodes.pop(99, None)
+    assert first.values == {"seq": 1, "temperature": 20.5}
+    assert second.values == {"seq": 2, "temperature": 21.0}
+    assert second.delta == {"seq": 2, "temperature": 21.0}
+
+
+def test_later_copies_update_the_copies_count():
+    copies = [
+        Frame(
+            bytearray([0xFF, 98, 0, 0]) + report.encode_report(seq, 4.1, 62.5, 385),
+            -70,
+            1000.0 + i,
+        )
+        for i, seq in enumerate((10, 11, 12))
+    ]
+    changes_q = basic_receive.subscribe_changes()
+    try:
+        for frame in copies:
+            basic_receive.handle_frame(frame, True, frame.ts)
+        changes = [changes_q.get_nowait() for _ in range(changes_q.qsize())]
+    finally:
+        basic_receive.unsubscribe_changes(changes_q)
+        basic_receive.node_table.nodes.pop(98, None)
+    assert [change.delta.get("id") for change in changes] == [10, None, None]
+    assert [change.values["copies"] for change in changes] == [1, 2, 3]
+    assert changes[-1].delta == {"copies": 3}
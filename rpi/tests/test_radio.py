@@ -0,0 +1,182 @@
+import asyncio
+import time
+
+from rpi.misc.bench_radio import FakeRadio
+from rpi.radio import RadioGroup, RadioReader
+
+
+class FailingRadio(FakeRadio):
+    """Raises OSError, like an SPI error, for the first failures receives."""
+
+    def __init__(self, rate, failures):
+        super().__init__(rate)
+        self.failures = failures
+
+    def receive(self, with_header=False, timeout=None):
+        if self.failures:
+            self.failures -= 1
+            raise OSError(5, "Input/output error")
+        return super().receive(with_header, timeout)
+
+
+async def collect(reader, frames_q, count, timeout=5.0):
+    frames = []
+    end = time.monotonic() + timeout
+    while len(frames) < count and time.monotonic() < end:
+        try:
+            frames.append(await asyncio.wait_for(frames_q.get(), 0.1))
+        except asyncio.TimeoutError:
+            pass
+    return frames
+
+
+def test_frames_are_queued_for_the_event_loop():
+    async def run():
+        frames_q = asyncio.Queue(maxsize=64)
+        reader = RadioReader(
+            FakeRadio(200), asyncio.get_running_loop(), frames_q, 0.1, channel=3
+        )
+        reader.start()
+        frames = await collect(reader, frames_q, 10)
+        assert reader.stop()
+        return reader, frames
+
+    reader, frames = asyncio.run(run())
+    assert len(frames) == 10
+    assert {f.channel for f in frames} == {3}
+    assert [f.packet[5] for f in frames] == list(range(1, 11))
+    assert reader.overflows == 0 and reader.errors == 0
+
+
+def test_frames_are_dropped_and_counted_when_the_queue_is_full():
+    async def run():
+        frames_q = asyncio.Queue(maxsize=4)
+        reader = RadioReader(FakeRadio(500), asyncio.get_running_loop(), frames_q, 0.1)
+        reader.start()
+        # the event loop runs, but nothing takes the frames
+        while reader.received < 20:
+            await asyncio.sleep(0.01)
+        assert reader.stop()
+        return reader, frames_q
+
+    reader, frames_q = asyncio.run(run())
+    assert frames_q.qsize() == 4
+    assert reader.overflows == reader.received - 4
+    # the oldest frames are kept
+    assert [frames_q.get_nowait().packet[5] for _ in range(4)] == [1, 2, 3, 4]
+
+
+def test_stop_joins_the_thread_within_a_receive_timeout():
+    async def run():
+        # no frame is ever due, so receive() always waits the full timeout
+        reader = RadioReader(
+            FakeRadio(0.001), asyncio.get_running_loop(), asyncio.Queue(), 0.2
+        )
+        reader.start()
+        await asyncio.sleep(0.05)
+        start = time.monotonic()
+        stopped = reader.stop()
+        return reader, stopped, time.monotonic() - start
+
+    reader, stopped, seconds = asyncio.run(run())
+    assert stopped and not reader.is_alive()
+    assert seconds < 0.2 + 0.1
+
+
+def test_stop_before_start():
+    reader = RadioReader(FakeRadio(1), None, asyncio.Queue(), 0.1)
+    assert reader.stop()
+
+
+def test_receive_errors_are_counted_and_reading_goes_on():
+    async def run():
+        frames_q = asyncio.Queue(maxsize=64)
+        radio = FailingRadio(200, failures=3)
+        reader = RadioReader(
+            radio, asyncio.get_running_loop(), frames_q, 0.1, retry_delay=0.01
+        )
+        reader.start()
+        frames = await collect(reader, frames_q, 5)
+        assert reader.stop()
+        return reader, frames
+
+    reader, frames = asyncio.run(run())
+    assert reader.errors == 3
+    assert len(frames) == 5
+
+
+def test_backoff_doubles_up_to_the_limit_and_stop_interrupts_it():
+    async def run():
+        radio = FailingRadio(1, failures=1000)
+        reader = RadioReader(
+            radio,
+            asyncio.get_running_loop(),
+            asyncio.Queue(),
+            0.1,
+            retry_delay=0.02,
+            max_retry_delay=0.08,
+        )
+        reader.start()
+        await asyncio.sleep(0.5)
+        errors = reader.errors
+        start = time.monotonic()
+        assert reader.stop()
+        return errors, time.monotonic() - start
+
+    errors, seconds = asyncio.run(run())
+    # 0.02 + 0.04 + 0.08 + 0.08 ... in 0.5 s
+    assert 5 <= errors <= 8
+    assert seconds < 0.08 + 0.05
+
+
+def test_group_sums_the_counters_and_stops_every_reader():
+    async def run():
+        frames_q = asyncio.Queue(maxsize=64)
+        radios = [(0, FakeRadio(200)), (1, FailingRadio(200, failures=2))]
+        group = RadioGroup(radios, asyncio.get_running_loop(), frames_q, 0.1)
+        for reader in group.readers:
+            reader.retry_delay = 0.01
+        group.start()
+        frames = await collect(group, frames_q, 10)
+        assert group.stop()
+        return group, frames
+
+    group, frames = asyncio.run(run())
+    assert group.errors == 2
+    assert group.received >= len(frames) == 10
+    assert {f.channel for f in frames} == {0, 1}
+    assert not any(reader.is_alive() for reader in group.readers)
+
+
+class AckRadio(FakeRadio):
+    def __init__(self, rate):
+        super().__init__(rate)
+        self.sent = []
+
+    def send(self, data, destination=None):
+        self.sent.append(data)
+        return True
+
+
+def test_a_frame_heard_on_several_channels_is_acknowledged_once():
+    acked = []
+
+    def ack(frame):
+        acked.append(frame)
+        return bytes([3, frame.packet[5], 7, 23])
+
+    async def run():
+        frames_q = asyncio.Queue(maxsize=64)
+        radios = [(0, AckRadio(50)), (1, AckRadio(50))]
+        group = RadioGroup(radios, asyncio.get_running_loop(), frames_q, 0.1, ack=ack)
+        group.start()
+        frames = await collect(group, frames_q, 20)
+        assert group.stop()
+        return group, radios, frames
+
+    group, radios, frames = asyncio.run(run())
+    # both radios hear every frame
+    assert len(frames) == 20 and {f.channel for f in frames} == {0, 1}
+    packets = [bytes(f.packet) for f in acked]
+    assert len(packets) == len(set(packets)) >= 9
+    assert group.acks == len(acked) == sum(len(radio.sent) for _, radio in radios)
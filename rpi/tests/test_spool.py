@@ -0,0 +1,88 @@
+import asyncio
+import os
+
+from rpi.events import MqttMsgEvent
+from rpi.spool import Spool, _encode
+
+
+def msg(i):
+    # all the same size
+    return MqttMsgEvent(topic=f"loraben/{i:03d}/msg", payload=f'{{"id":{i:03d}}}')
+
+
+def put(spool, numbers):
+    async def run():
+        for i in numbers:
+            await spool.put(msg(i))
+
+    asyncio.run(run())
+    spool.flush()
+
+
+def get(spool, count):
+    async def run():
+        return [(await asyncio.wait_for(spool.get(), 1)).topic for _ in range(count)]
+
+    return asyncio.run(run())
+
+
+def topics(numbers):
+    return [msg(i).topic for i in numbers]
+
+
+def test_torn_entry_at_the_end_is_cut_off_on_reopening(tmp_path):
+    spool = Spool(tmp_path)
+    put(spool, range(3))
+    spool.close()
+    filename = spool._filename(spool.segments[-1])
+    size = os.path.getsize(filename)
+    with open(filename, "ab") as f:
+        # power cut in the middle of the next entry
+        f.write(_encode(msg(3))[:10])
+
+    spool = Spool(tmp_path)
+    assert os.path.getsize(filename) == size
+    assert spool.end == (spool.segments[-1], size)
+    put(spool, [4])
+    assert get(spool, 4) == topics([0, 1, 2, 4])
+    spool.close()
+
+
+def test_acknowledged_position_survives_a_restart(tmp_path):
+    spool = Spool(tmp_path)
+    put(spool, range(5))
+    assert get(spool, 3) == topics(range(3))
+    spool.ack()
+    spool.ack()
+    spool.close()
+
+    spool = Spool(tmp_path)
+    assert get(spool, 3) == topics(range(2, 5))
+    spool.close()
+
+
+def test_oldest_segments_are_dropped_beyond_max_segments(tmp_path):
+    entry_bytes = len(_encode(msg(0)))
+    spool = Spool(tmp_path, segment_bytes=4 * entry_bytes, max_segments=2)
+    put(spool, range(20))
+    assert spool.dropped_segments == 3
+    assert len(spool.segments) == 2
+    assert len(os.listdir(tmp_path)) == 3  # and the ack file
+    # delivery goes on with the oldest message left
+    assert get(spool, 8) == topics(range(12, 20))
+    spool.close()
+
+
+def test_rewind_hands_out_the_unacknowledged_messages_again_in_order(tmp_path):
+    spool = Spool(tmp_path)
+    put(spool, range(5))
+    assert get(spool, 3) == topics(range(3))
+    spool.ack()
+    # the broker was lost with 1 and 2 in flight
+    spool.rewind()
+    put(spool, [5])
+    assert get(spool, 4) == topics(range(1, 5))
+    assert spool.replaying()
+    assert get(spool, 1) == topics([5])
+    assert not spool.replaying()
+    spool.close()
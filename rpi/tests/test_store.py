@@ -0,0 +1,164 @@
+import random
+
+import report
+from rpi.basic_receive import measurement_records
+from rpi.dedup import Measurement
+from rpi.packet import decode_report
+from rpi.radio import Frame
+from rpi.store import Record, Store
+
+NOW = 1_700_000_000.0
+
+
+def record(ts, node, distance=500):
+    return Record(ts, node, 0, 4.0, 60.0, distance, -80)
+
+
+def test_batch_readings_older_than_stored_ones(tmp_path):
+    store = Store(str(tmp_path))
+    store.append(record(NOW - 50, 2))
+    store.flush()
+    for i in range(6):
+        store.append(record(NOW - 3100 + 600 * i, 1, 400 + i))
+    store.flush()
+
+    found = store.query(NOW - 3200, NOW - 1000, node=1)
+    assert [r.distance for r in found] == [400, 401, 402, 403]
+    assert [r.ts for r in store.query(0, NOW)] == sorted(
+        [NOW - 50] + [NOW - 3100 + 600 * i for i in range(6)]
+    )
+    rows = store.downsample(NOW - 3600, NOW, 3600, node=1)
+    assert [(ts, count) for ts, count, *_ in rows] == [(NOW - 3600, 6)]
+    store.close()
+
+
+def rows(records):
+    # as records come back from the store: scaled and rounded
+    return [
+        (r.ts, r.node, round(r.battery, 4), round(r.temperature, 1), r.distance)
+        for r in records
+    ]
+
+
+def frames(nodes=6, hours=12, seed=1):
+    """Interleaved single and batch reports, as the gateway receives them."""
+    rnd = random.Random(seed)
+    sent = []
+    for node in range(1, nodes + 1):
+        batch = node % 2 == 0
+        ts = NOW + rnd.uniform(0, 600)
+        readings, seq = [], 0
+        while ts < NOW + hours * 3600:
+            scaled = report.scale_reading(
+                rnd.uniform(3.5, 4.1), rnd.uniform(40, 80), rnd.randrange(300, 3000)
+            )
+            if not batch:
+                payload = report.encode_readings(seq, [(0, *scaled)])
+                sent.append((ts + rnd.uniform(0, 4), node, payload))
+            else:
+                readings.append((ts, scaled))
+                if len(readings) == 6:
+                    payload = report.encode_batch(
+                        seq,
+                        [(round(ts - taken), *values) for taken, values in readings],
+                    )
+                    sent.append((ts + rnd.uniform(0, 4), node, payload))
+                    readings = []
+            seq = (seq + 1) % 256
+            ts += 600
+    sent.sort()
+    return [
+        Frame(bytearray([0xFF, node, 0, 0]) + payload, -80, ts)
+        for ts, node, payload in sent
+    ]
+
+
+def test_interleaved_batch_and_single_reports(tmp_path):
+    # small segments, so batches go across them
+    store = Store(str(tmp_path), segment_records=16, max_segments=1000, batch=5)
+    expected = []
+    for i, frame in enumerate(frames()):
+        decoded = decode_report(frame.packet)
+        entry = Measurement(frame.packet[1], decoded.seq, None, (decoded, frame), 0)
+        for r in measurement_records(entry):
+            store.append(r)
+            expected.append(r)
+        if i % 3 == 0:
+            store.flush()
+    store.flush()
+    expected = sorted(rows(expected))
+
+    everything = store.query(0, float("inf"))
+    assert [r.ts for r in everything] == sorted(r.ts for r in everything)
+    assert sorted(rows(everything)) == expected
+    for segment in store.segments:
+        ts = [segment.ts(i) for i in range(segment.count)]
+        assert ts == sorted(ts)
+
+    for start, end in ((NOW, NOW + 7200), (NOW + 3000, NOW + 5000), (0, NOW)):
+        for node in (None, 1, 2):
+            found = rows(store.query(start, end, node=node))
+            assert found == sorted(found)
+            assert sorted(found) == [
+                row
+                for row in expected
+                if start <= row[0] < end and node in (None, row[1])
+            ]
+
+    for node in (1, 2):
+        counts = {}
+        for row in expected:
+            if row[1] == node:
+                key = NOW + (row[0] - NOW) // 3600 * 3600
+                counts[key] = counts.get(key, 0) + 1
+        buckets = store.downsample(NOW, NOW + 24 * 3600, 3600, node=node)
+        assert {ts: count for ts, count, *_ in buckets} == counts
+    store.close()
+
+
+def test_latest_is_the_newest_reading_of_every_node(tmp_path):
+    store = Store(str(tmp_path), segment_records=4, max_segments=3)
+    store.append(record(NOW - 50, 2))
+    store.flush()
+    # a batch of node 1, older than what node 2 sent
+    for i in range(6):
+        store.append(record(NOW - 3100 + 600 * i, 1, 400 + i))
+    store.flush()
+    store.append(record(NOW - 4000, 3))
+    store.flush()
+
+    latest = store.latest()
+    assert {node: r.ts for node, r in latest.items()} == {
+        1: NOW - 100,
+        2: NOW - 50,
+        3: NOW - 4000,
+    }
+    assert latest[1].distance == 405
+    store.close()
+
+
+def test_latest_of_full_segments_comes_from_their_index(tmp_path):
+    store = Store(str(tmp_path), segment_records=4, max_segments=3)
+    for i in range(13):
+        store.append(record(NOW + i, 1 + i % 3, i))
+        store.flush()
+    latest = store.latest()
+    store.close()
+    files = sorted(p.name for p in tmp_path.iterdir())
+    # the oldest segment and its index were removed
+    assert files == [
+        "seg-0000000001.dat",
+        "seg-0000000001.idx",
+        "seg-0000000002.dat",
+        "seg-0000000002.idx",
+        "seg-0000000003.dat",
+    ]
+
+    # the full segment is not read again, only its index
+    with open(tmp_path / "seg-0000000002.dat", "r+b") as f:
+        f.seek(12)
+        f.write(b"\xff" * 4 * 20)
+    store = Store(str(tmp_path), segment_records=4, max_segments=3)
+    assert store.latest() == latest
+    assert {node: r.distance for node, r in latest.items()} == {1: 12, 2: 10, 3: 11}
+    store.close()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+import asyncio
+
+
+class QueuedWriter:
+    """Queues entries in memory and writes them to disk in batches.
+
+    _queue() only appends an entry to pending; flusher() hands what is
+    pending to _write() every interval seconds, or as soon as batch entries
+    are queued, from an executor thread, so the event loop never waits on
+    I/O. flush() writes what is pending right away, from the caller.
+
+    Subclasses implement _write(entries), which runs in the executor while
+    the event loop goes on queueing, and can extend _due() and _written().
+    """
+
+    def __init__(self, batch=64):
+        self.batch = batch
+        self.pending = []
+        self._wakeup = None
+
+    def _queue(self, entry):
+        self.pending.append(entry)
+        if len(self.pending) >= self.batch and self._wakeup:
+            self._wakeup.set()
+
+    def _due(self):
+        # whether flusher() has anything to write
+        return bool(self.pending)
+
+    def _written(self):
+        # runs on the event loop after each write of flusher()
+        pass
+
+    def flush(self):
+        entries, self.pending = self.pending, []
+        self._write(entries)
+
+    async def flusher(self, interval=5.0):
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                if self._due():
+                    entries, self.pending = self.pending, []
+                    await loop.run_in_executor(None, self._write, entries)
+                    self._written()
+        finally:
+            self._wakeup = None
+            self.flush()
+
+    def _write(self, entries):
+        raise NotImplementedError
@@ -0,0 +1,113 @@
+import struct
+
+# Scheduling state kept in alarm.sleep_memory:
+#   valid:u8  interval:u16  distance:i16  temperature:i16 (0.1 F)
+#   distance_rate:f32 (mm/s)  temperature_rate:f32 (0.1 F/s)
+_STATE = "<BHhhff"
+STATE_LEN = struct.calcsize(_STATE)
+
+
+class SleepSchedule:
+    """Picks how long to deep sleep, from how fast the readings are changing.
+
+    The interval aims for about distance_step mm (or temperature_step F) of
+    change between wakes, within [min_interval, max_interval]. It shrinks at
+    once when things start moving and grows at most by backoff each wake when
+    they settle. Below battery_low volts it stays at max_interval; between
+    battery_low and battery_ok it is pulled towards max_interval the lower
+    the battery gets.
+    """
+
+    def __init__(
+        self,
+        memory,
+        offset,
+        min_interval=300,
+        max_interval=3600,
+        distance_step=20,
+        temperature_step=2,
+        battery_low=3.4,
+        battery_ok=3.7,
+        backoff=2,
+        smoothing=0.5,
+    ):
+        self.memory = memory
+        self.offset = offset
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.distance_step = distance_step
+        self.temperature_step = temperature_step * 10
+        self.battery_low = battery_low
+        self.battery_ok = battery_ok
+        self.backoff = backoff
+        self.smoothing = smoothing
+        state = struct.unpack_from(
+            _STATE, bytearray(memory[offset : offset + STATE_LEN]), 0
+        )
+        self.valid = state[0] == 1
+        (
+            self.interval,
+            self.distance,
+            self.temperature,
+            self.distance_rate,
+            self.temperature_rate,
+        ) = state[1:]
+
+    def reset(self):
+        self.valid = False
+
+    def save(self):
+        buf = bytearray(STATE_LEN)
+        struct.pack_into(
+            _STATE,
+            buf,
+            0,
+            1 if self.valid else 0,
+            self.interval,
+            self.distance,
+            self.temperature,
+            self.distance_rate,
+            self.temperature_rate,
+        )
+        self.memory[self.offset : self.offset + STATE_LEN] = buf
+
+    def _smooth(self, rate, change, elapsed):
+        return rate + self.smoothing * (abs(change) / elapsed - rate)
+
+    def next_interval(self, distance, temperature, battery, default):
+        """distance in mm (-1 if unknown), temperature in F, battery in volts."""
+        temperature = round(temperature * 10)
+        if not self.valid:
+            self.valid = True
+            self.interval = default
+            self.distance_rate = self.temperature_rate = 0.0
+        else:
+            elapsed = max(self.interval, 1)
+            if distance >= 0 and self.distance >= 0:
+                self.distance_rate = self._smooth(
+                    self.distance_rate, distance - self.distance, elapsed
+                )
+            self.temperature_rate = self._smooth(
+                self.temperature_rate, temperature - self.temperature, elapsed
+            )
+
+            interval = self.max_interval
+            if self.distance_rate > 0:
+                interval = min(interval, self.distance_step / self.distance_rate)
+            if self.temperature_rate > 0:
+                interval = min(interval, self.temperature_step / self.temperature_rate)
+            interval = min(interval, self.interval * self.backoff)
+
+            if battery <= self.battery_low:
+                interval = self.max_interval
+            elif battery < self.battery_ok:
+                charge = (battery - self.battery_low) / (
+                    self.battery_ok - self.battery_low
+                )
+                interval += (self.max_interval - interval) * (1 - charge)
+            self.interval = round(
+                max(self.min_interval, min(self.max_interval, interval))
+            )
+
+        self.distance, self.temperature = distance, temperature
+        return self.interval
@@ -1,64 +1,61 @@
+import asyncio
 import time
 import board
 import busio
 
-uart = busio.UART(tx=None, rx=board.A3, baudrate=9600)
+from estimator import DistanceEstimator
+from me007ys import FrameDecoder
+
+# Opened when first read, like the radio in lora.py
+uart = None
 
 # Read multiple ultrasonic values and average them out for better
-# precision
+# precision. Sampling stops once SONAR_MIN_SAMPLES agree within
+# SONAR_TOLERANCE mm; only noisy readings take up to SONAR_SAMPLES.
 WARM_UP_SAMPLES = 7
+SONAR_MIN_SAMPLES = 5
 SONAR_SAMPLES = 15
-
-
-def _read_me007ys(timeout=1.0):
-    ts = time.monotonic()
-    buf = bytearray(3)
-    idx = 0
-
-    while True:
-        # time out while waiting to get valid data
-        if time.monotonic() - ts > timeout:
-            break
-
-        r = uart.read(1)
-        if r is None:
+SONAR_TOLERANCE = 5  # [mm]
+
+
+def _init():
+    global uart
+    if uart is None:
+        uart = busio.UART(tx=None, rx=board.A3, baudrate=9600, timeout=0)
+
+
+async def read_sonar_async(timeout=10.0):
+    # returns (distance, samples used, confidence) or None on timeout
+    _init()
+    decoder = FrameDecoder()
+    estimator = DistanceEstimator(SONAR_TOLERANCE, SONAR_MIN_SAMPLES, SONAR_SAMPLES)
+    warm_up = WARM_UP_SAMPLES
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        distances = decoder.read(uart)
+        if not distances:
+            # nothing waiting yet; a 4 byte frame takes ~4 ms at 9600 baud
+            await asyncio.sleep(0.01)
             continue
-
-        c = r[0]
-        # print(c)
-        if idx == 0 and c == 0xFF:
-            buf[0] = c
-            idx = idx + 1
-        elif 0 < idx < 3:
-            buf[idx] = c
-            idx = idx + 1
-        else:
-            chksum = sum(buf) & 0xFF
-            if chksum == c:
-                return (buf[1] << 8) + buf[2]
-            idx = 0
+        for value in distances:
+            # Ignore the inital readings
+            if warm_up:
+                warm_up -= 1
+                continue
+            estimator.add(value)
+            if estimator.done():
+                return (
+                    estimator.distance(),
+                    len(estimator.samples),
+                    estimator.confidence(),
+                )
 
 
 def read_sonar(timeout=10.0):
+    # timeout=None keeps measuring and printing, e.g. from the REPL
     while True:
-        values = []
-        ts = time.monotonic()
-        while len(values) < WARM_UP_SAMPLES + SONAR_SAMPLES:
-            if (timeout is not None) and (time.monotonic() - ts > timeout):
-                return
-            value = _read_me007ys()
-            if value is None:
-                time.sleep(0.05)
-                continue
-            values.append(value)
-        values.sort()
-        count, result = 0, 0
-        # Ignore the inital readings
-        for value in values[WARM_UP_SAMPLES : len(values) - 1]:
-            count += 1
-            result += value
-            # print("  sample ", value)
-        if timeout is None:
-            print("distance:", result // count)
-        else:
-            return result // count
+        result = asyncio.run(read_sonar_async(10.0 if timeout is None else timeout))
+        if timeout is not None:
+            return result
+        if result:
+            print("distance: %d samples: %d confidence: %.2f" % result)
@@ -0,0 +1,20 @@
+import time
+
+# Where the awake time goes, step by step: main.py marks the end of each
+# step, and prints them all before going to sleep with startup_profile in
+# const.py. Imported first, so that the imports are the first step.
+started = time.monotonic()
+steps = []
+_last = started
+
+
+def mark(step):
+    global _last
+    now = time.monotonic()
+    steps.append((step, now - _last))
+    _last = now
+
+
+def report():
+    for step, seconds in steps:
+        print(f"startup {step}: {seconds * 1000:.1f} ms")
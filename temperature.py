@@ -1,8 +1,38 @@
+import asyncio
 import board
 
+from const import sleep_memory_ds18, temperature_resolution
+
 ow_bus = None
 ds18 = None
 
+# First byte of every DS18B20 ROM id
+DS18B20_FAMILY = 0x28
+ROM_LEN = 8
+
+
+def _load_rom():
+    # ROM id found by the scan on an earlier wake, if it is still good
+    try:
+        import alarm
+
+        rom = alarm.sleep_memory[sleep_memory_ds18 : sleep_memory_ds18 + ROM_LEN]
+    except (NotImplementedError, IndexError):
+        # https://github.com/adafruit/circuitpython/issues/5081
+        return None
+    if rom[0] != DS18B20_FAMILY or ow_bus.crc8(rom[:7]) != rom[7]:
+        return None
+    return rom
+
+
+def _save_rom(rom):
+    try:
+        import alarm
+
+        alarm.sleep_memory[sleep_memory_ds18 : sleep_memory_ds18 + ROM_LEN] = rom
+    except (NotImplementedError, IndexError):
+        pass
+
 
 def _init():
     global ow_bus, ds18
@@ -12,12 +42,38 @@ def _init():
         ow_bus = OneWireBus(board.D12)
     if ds18 is None:
         from adafruit_ds18x20 import DS18X20
+        from adafruit_onewire.bus import OneWireAddress
+
+        # the bus scan is slow, so it only runs when nothing is cached
+        rom = _load_rom()
+        if rom is None:
+            rom = bytes(ow_bus.scan()[0].rom)
+            _save_rom(rom)
+        ds18 = DS18X20(ow_bus, OneWireAddress(bytearray(rom)))
+        # the sensor is powered off while sleeping, which resets the resolution
+        ds18.resolution = temperature_resolution
+
 
-        ds18 = DS18X20(ow_bus, ow_bus.scan()[0])
+def _fahrenheit(celsius):
+    return (celsius * 9 / 5) + 32
 
 
 def read_temperature():
     _init()
 
     # ... in Fahrenheits
-    return (ds18.temperature * 9 / 5) + 32
+    return _fahrenheit(ds18.temperature)
+
+
+async def read_temperature_async():
+    # Same as read_temperature(), but other tasks run during the conversion
+    # (up to 750 ms at 12 bits). Returns None if the sensor did not answer.
+    _init()
+    await asyncio.sleep(ds18.start_temperature_read())
+    try:
+        celsius = ds18.read_temperature()
+    except RuntimeError:
+        # CRC error: likely a different sensor than the cached ROM id
+        _save_rom(bytes(ROM_LEN))
+        return None
+    return _fahrenheit(celsius)